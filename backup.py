@@ -0,0 +1,179 @@
+"""
+Модуль резервного копирования базы данных бота клуба X10.
+Копия снимается через SQLite Online Backup API в отдельном потоке,
+поэтому не блокирует обработчики и не захватывает несогласованное состояние WAL.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+# Сжатие zstd используется, только если установлен пакет zstandard
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from config import BackupConfig
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при сжатии файла копии
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# Расширения файлов копий для разных способов сжатия
+EXTENSIONS = {
+    "zstd": ".db.zst",
+    "gzip": ".db.gz",
+    "none": ".db",
+}
+
+
+def _resolve_compression(compression: str) -> str:
+    """
+    Выбор доступного способа сжатия
+    :param compression: запрошенный способ (zstd, gzip или none)
+    :return: Способ сжатия, который можно использовать
+    """
+    if compression == "zstd" and zstandard is None:
+        logger.warning("Пакет zstandard не установлен, резервная копия будет сжата gzip")
+        return "gzip"
+    if compression not in EXTENSIONS:
+        logger.warning(f"Неизвестный способ сжатия {compression}, используется gzip")
+        return "gzip"
+    return compression
+
+
+def _copy_database(db_path: str, target_path: str, pages_per_step: int):
+    """
+    Снятие копии базы данных через Backup API (выполняется в отдельном потоке)
+    :param db_path: путь к файлу базы данных
+    :param target_path: путь к файлу копии
+    :param pages_per_step: количество страниц, копируемых за один шаг
+    """
+    source = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        # Между шагами блокировка чтения отпускается и запись в базу продолжается;
+        # если база изменилась, SQLite начинает копирование заново, поэтому копия всегда согласована
+        source.backup(target, pages=pages_per_step)
+    finally:
+        target.close()
+        source.close()
+
+
+def _compress_file(source_path: str, target_path: str, compression: str):
+    """
+    Потоковое сжатие файла копии (выполняется в отдельном потоке)
+    :param source_path: путь к несжатой копии
+    :param target_path: путь к сжатому файлу
+    :param compression: способ сжатия (zstd, gzip или none)
+    """
+    with open(source_path, "rb") as source:
+        if compression == "zstd":
+            with open(target_path, "wb") as raw, zstandard.ZstdCompressor().stream_writer(raw) as target:
+                shutil.copyfileobj(source, target, COMPRESS_CHUNK_SIZE)
+        elif compression == "gzip":
+            with gzip.open(target_path, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target, COMPRESS_CHUNK_SIZE)
+        else:
+            with open(target_path, "wb") as target:
+                shutil.copyfileobj(source, target, COMPRESS_CHUNK_SIZE)
+
+
+def _make_backup(db_path: str, config: BackupConfig, compression: str, backup_dir: str) -> str:
+    """
+    Создание сжатой резервной копии (выполняется в отдельном потоке)
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+
+    name = f"{config.prefix}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+    # Несколько копий в одну секунду получают порядковый суффикс
+    base_name, suffix = name, 1
+    while os.path.exists(os.path.join(backup_dir, f"{name}{EXTENSIONS[compression]}")):
+        name = f"{base_name}_{suffix}"
+        suffix += 1
+
+    raw_path = os.path.join(backup_dir, f"{name}.tmp")
+    partial_path = os.path.join(backup_dir, f"{name}{EXTENSIONS[compression]}.part")
+    backup_path = os.path.join(backup_dir, f"{name}{EXTENSIONS[compression]}")
+
+    try:
+        _copy_database(db_path, raw_path, config.pages_per_step)
+        _compress_file(raw_path, partial_path, compression)
+        # Готовый файл появляется под своим именем только целиком
+        os.replace(partial_path, backup_path)
+    finally:
+        for path in (raw_path, partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return backup_path
+
+
+async def create_backup(db_path: str, config: BackupConfig, backup_dir: Optional[str] = None) -> str:
+    """
+    Создание резервной копии базы данных без блокировки цикла событий
+    :param db_path: путь к файлу базы данных
+    :param config: настройки резервного копирования
+    :param backup_dir: папка для копии (по умолчанию - папка резервных копий, участвующая в ротации)
+    :return: Путь к файлу резервной копии
+    """
+    compression = _resolve_compression(config.compression)
+    started = asyncio.get_running_loop().time()
+
+    backup_path = await asyncio.to_thread(
+        _make_backup, db_path, config, compression, backup_dir or config.backup_dir
+    )
+
+    elapsed = asyncio.get_running_loop().time() - started
+    logger.info(
+        f"Создана резервная копия базы данных {backup_path} "
+        f"({os.path.getsize(backup_path)} байт, {elapsed:.1f} сек)"
+    )
+    return backup_path
+
+
+def list_backups(config: BackupConfig) -> List[str]:
+    """
+    Список резервных копий от старых к новым
+    :param config: настройки резервного копирования
+    :return: Пути к файлам копий
+    """
+    if not os.path.isdir(config.backup_dir):
+        return []
+
+    backups = [
+        os.path.join(config.backup_dir, name)
+        for name in os.listdir(config.backup_dir)
+        if name.startswith(f"{config.prefix}_") and name.endswith(tuple(EXTENSIONS.values()))
+    ]
+    # Дата в имени файла идет в сортируемом формате
+    return sorted(backups)
+
+
+def rotate_backups(config: BackupConfig, keep: Optional[int] = None) -> List[str]:
+    """
+    Удаление старых резервных копий
+    :param config: настройки резервного копирования
+    :param keep: сколько последних копий оставить (по умолчанию - из настроек)
+    :return: Пути к удаленным файлам
+    """
+    keep = config.keep if keep is None else keep
+    backups = list_backups(config)
+    removed = backups[:-keep] if keep > 0 else backups
+
+    for path in removed:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Ошибка при удалении старой резервной копии {path}: {e}")
+
+    if removed:
+        logger.info(f"Удалено старых резервных копий: {len(removed)}")
+    return removed
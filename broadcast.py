@@ -0,0 +1,321 @@
+"""
+Рассылки бота клуба X10.
+Состояние рассылки (курсор по пользователям, статус каждого получателя, счетчики) хранится
+в базе данных, поэтому рассылку можно приостановить, продолжить или отменить, а после
+перезапуска бота незавершенные рассылки продолжаются с места остановки.
+Сообщения отправляют несколько параллельных обработчиков; темп задает планировщик
+исходящих сообщений (рассылки идут с приоритетом PRIORITY_BULK).
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.methods import TelegramMethod, SendMessage, SendPhoto, SendVideo, SendDocument
+
+from config import BroadcastConfig
+from delivery import Delivery
+from outbound import send_priority, PRIORITY_BULK
+from records import Broadcast
+from repository import Repository, BROADCAST_CAMPAIGN_PREFIX
+from segments import Segment
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAMES = {
+    "running": "идет",
+    "paused": "приостановлена",
+    "cancelled": "отменена",
+    "completed": "завершена",
+}
+
+
+def format_progress(broadcast: Broadcast) -> str:
+    """
+    Текст сообщения с ходом рассылки
+    :param broadcast: рассылка
+    :return: Текст
+    """
+    processed = broadcast.sent + broadcast.failed
+    # Пользователи, зарегистрированные во время рассылки, тоже получают сообщение
+    total = max(broadcast.total, processed)
+    percent = int(processed / total * 100) if total else 100
+    audience = Segment.from_json(broadcast.segment).describe()
+
+    if broadcast.status == "completed":
+        return (
+            f"✅ Рассылка #{broadcast.broadcast_id} завершена!\n\n"
+            f"Аудитория: {audience}\n"
+            f"Всего пользователей: {total}\n"
+            f"Успешно отправлено: {broadcast.sent}\n"
+            f"Ошибок: {broadcast.failed}\n"
+            f"Эффективность: {int(broadcast.sent / total * 100) if total else 0}%"
+        )
+
+    text = (
+        f"Рассылка #{broadcast.broadcast_id}: {STATUS_NAMES.get(broadcast.status, broadcast.status)}"
+        f"{' ⏳' if broadcast.status == 'running' else ''}\n\n"
+        f"Аудитория: {audience}\n"
+        f"Прогресс: {processed}/{total} ({percent}%)\n"
+        f"Успешно: {broadcast.sent}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+    if broadcast.status == "running":
+        text += f"\n\n/broadcast_pause {broadcast.broadcast_id} - приостановить"
+    if broadcast.status == "paused":
+        text += f"\n\n/broadcast_resume {broadcast.broadcast_id} - продолжить"
+    if broadcast.status in ("running", "paused"):
+        text += f"\n/broadcast_cancel {broadcast.broadcast_id} - отменить"
+    return text
+
+
+def _build_method(broadcast: Broadcast, user_id: int) -> TelegramMethod:
+    """
+    Метод Bot API для отправки сообщения рассылки пользователю
+    """
+    if broadcast.message_type == "photo":
+        return SendPhoto(chat_id=user_id, photo=broadcast.file_id, caption=broadcast.text)
+    if broadcast.message_type == "video":
+        return SendVideo(chat_id=user_id, video=broadcast.file_id, caption=broadcast.text)
+    if broadcast.message_type == "document":
+        return SendDocument(chat_id=user_id, document=broadcast.file_id, caption=broadcast.text)
+    return SendMessage(chat_id=user_id, text=broadcast.text)
+
+
+class _Job:
+    """Выполняющаяся рассылка"""
+    __slots__ = ("broadcast_id", "task", "stopping")
+
+    def __init__(self, broadcast_id: int):
+        self.broadcast_id = broadcast_id
+        self.task: Optional[asyncio.Task] = None
+        # Установлен при паузе, отмене или остановке бота: новые отправки не начинаются
+        self.stopping = asyncio.Event()
+
+
+class BroadcastEngine:
+    def __init__(self, bot: Bot, db: Repository, config: BroadcastConfig, delivery: Optional[Delivery] = None):
+        """
+        Инициализация движка рассылок
+        :param bot: объект бота
+        :param db: хранилище данных
+        :param config: настройки рассылок
+        :param delivery: доставка сообщений (общая с планировщиком задач)
+        """
+        self.bot = bot
+        self.db = db
+        self.config = config
+        self.delivery = delivery or Delivery(bot, db)
+        self._jobs: Dict[int, _Job] = {}
+
+    async def start(self):
+        """
+        Продолжение рассылок, прерванных остановкой бота
+        """
+        for broadcast in await self.db.get_broadcasts(statuses=("running",), limit=100):
+            logger.info(f"Продолжение рассылки #{broadcast.broadcast_id} после перезапуска")
+            self._start_job(broadcast.broadcast_id)
+
+    async def create(self, created_by: int, message_type: str, text: Optional[str], file_id: Optional[str],
+                     status_chat_id: Optional[int] = None, status_message_id: Optional[int] = None,
+                     segment: Optional[Segment] = None) -> int:
+        """
+        Создание и запуск рассылки пользователям сегмента
+        :param created_by: ID администратора
+        :param message_type: тип сообщения (text, photo, video, document)
+        :param text: текст или подпись
+        :param file_id: ID файла в Telegram
+        :param status_chat_id: чат сообщения с ходом рассылки
+        :param status_message_id: ID сообщения с ходом рассылки
+        :param segment: сегмент получателей (None - все пользователи, которым бот может писать)
+        :return: ID рассылки
+        """
+        if segment is None:
+            segment = Segment()
+        total = await self.db.count_users(segment)
+        broadcast_id = await self.db.create_broadcast(
+            created_by, message_type, text, file_id, total, status_chat_id, status_message_id, segment
+        )
+        logger.info(f"Рассылка #{broadcast_id} создана администратором {created_by}, получателей: {total}")
+        self._start_job(broadcast_id)
+        return broadcast_id
+
+    async def pause(self, broadcast_id: int) -> bool:
+        """
+        Приостановка рассылки (отправки, начатые до паузы, завершаются)
+        :return: True, если рассылка шла и приостановлена
+        """
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast.status != "running":
+            return False
+        await self.db.set_broadcast_status(broadcast_id, "paused")
+        await self._stop_job(broadcast_id)
+        await self._update_status_message(broadcast_id)
+        logger.info(f"Рассылка #{broadcast_id} приостановлена")
+        return True
+
+    async def resume(self, broadcast_id: int) -> bool:
+        """
+        Продолжение приостановленной рассылки
+        :return: True, если рассылка была на паузе и продолжена
+        """
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast.status != "paused":
+            return False
+        await self.db.set_broadcast_status(broadcast_id, "running")
+        self._start_job(broadcast_id)
+        logger.info(f"Рассылка #{broadcast_id} продолжена")
+        return True
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """
+        Отмена рассылки (оставшимся получателям сообщение не отправляется)
+        :return: True, если рассылка шла или была на паузе и отменена
+        """
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast.status not in ("running", "paused"):
+            return False
+        await self.db.set_broadcast_status(broadcast_id, "cancelled")
+        await self._stop_job(broadcast_id)
+        await self._update_status_message(broadcast_id)
+        logger.info(f"Рассылка #{broadcast_id} отменена")
+        return True
+
+    async def recent(self, limit: int = 10) -> List[Broadcast]:
+        """
+        Последние рассылки
+        """
+        return await self.db.get_broadcasts(limit=limit)
+
+    async def close(self):
+        """
+        Остановка всех рассылок при остановке бота
+        Статус остается running: после перезапуска рассылки продолжатся
+        """
+        for broadcast_id in tuple(self._jobs):
+            await self._stop_job(broadcast_id)
+
+    def _start_job(self, broadcast_id: int):
+        """
+        Запуск задачи рассылки (если она еще не выполняется)
+        """
+        job = self._jobs.get(broadcast_id)
+        if job is not None and not job.task.done():
+            return
+        job = _Job(broadcast_id)
+        job.task = asyncio.create_task(self._run(job), name=f"broadcast_{broadcast_id}")
+        self._jobs[broadcast_id] = job
+
+    async def _stop_job(self, broadcast_id: int):
+        """
+        Остановка задачи рассылки с ожиданием уже начатых отправок
+        """
+        job = self._jobs.pop(broadcast_id, None)
+        if job is None:
+            return
+        job.stopping.set()
+        try:
+            await job.task
+        except Exception as e:
+            logger.error(f"Ошибка при остановке рассылки #{broadcast_id}: {e}")
+
+    async def _run(self, job: _Job):
+        """
+        Выполнение рассылки: получатели забираются из базы пачками и раздаются обработчикам
+        """
+        broadcast_id = job.broadcast_id
+        try:
+            # Взятые в работу, но не отправленные получатели возвращаются в очередь
+            reset = await self.db.reset_broadcast_recipients(broadcast_id)
+            if reset["interrupted"]:
+                logger.warning(
+                    f"Рассылка #{broadcast_id}: {reset['interrupted']} отправок были прерваны "
+                    f"и не повторяются, чтобы не отправить сообщение дважды"
+                )
+
+            broadcast = await self.db.get_broadcast(broadcast_id)
+            if broadcast is None:
+                return
+
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.config.workers * 2)
+            workers = [
+                asyncio.create_task(self._worker(job, broadcast, queue))
+                for _ in range(max(1, self.config.workers))
+            ]
+            progress = asyncio.create_task(self._report_progress(job))
+
+            try:
+                while not job.stopping.is_set():
+                    user_ids = await self.db.claim_broadcast_recipients(broadcast_id, self.config.claim_batch)
+                    if not user_ids:
+                        break
+                    for user_id in user_ids:
+                        await queue.put(user_id)
+            finally:
+                # Обработчики разбирают очередь до конца (при остановке - без отправки) и завершаются
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                progress.cancel()
+
+            if not job.stopping.is_set():
+                await self.db.set_broadcast_status(broadcast_id, "completed")
+                self._jobs.pop(broadcast_id, None)
+                await self._update_status_message(broadcast_id)
+                logger.info(f"Рассылка #{broadcast_id} завершена")
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении рассылки #{broadcast_id}: {e}")
+
+    async def _worker(self, job: _Job, broadcast: Broadcast, queue: asyncio.Queue):
+        """
+        Обработчик отправки сообщений рассылки
+        """
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            if job.stopping.is_set():
+                # Получатель остается взятым в работу и вернется в очередь при продолжении
+                continue
+            try:
+                await self._deliver(broadcast, user_id)
+            except Exception as e:
+                # Ошибки доставки обрабатывает Delivery; здесь - непредвиденные, обработчик продолжает работу
+                logger.error(f"Ошибка рассылки #{broadcast.broadcast_id} для пользователя {user_id}: {e}")
+
+    async def _deliver(self, broadcast: Broadcast, user_id: int):
+        """
+        Отправка сообщения рассылки одному получателю с сохранением результата
+        """
+        broadcast_id = broadcast.broadcast_id
+        await self.db.mark_broadcast_sending(broadcast_id, user_id)
+        with send_priority(PRIORITY_BULK):
+            result = await self.delivery.send(_build_method(broadcast, user_id), f"{BROADCAST_CAMPAIGN_PREFIX}{broadcast_id}")
+        await self.db.finish_broadcast_recipient(
+            broadcast_id, user_id, result.ok, result.error[:500] if result.error else None
+        )
+
+    async def _report_progress(self, job: _Job):
+        """
+        Периодическое обновление сообщения с ходом рассылки
+        """
+        while not job.stopping.is_set():
+            await asyncio.sleep(self.config.progress_interval)
+            await self._update_status_message(job.broadcast_id)
+
+    async def _update_status_message(self, broadcast_id: int):
+        """
+        Обновление сообщения с ходом рассылки у администратора
+        """
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or not broadcast.status_chat_id or not broadcast.status_message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                format_progress(broadcast),
+                chat_id=broadcast.status_chat_id,
+                message_id=broadcast.status_message_id,
+            )
+        except Exception as e:
+            # В том числе «message is not modified», если прогресс не изменился
+            logger.debug(f"Сообщение с ходом рассылки #{broadcast_id} не обновлено: {e}")
@@ -0,0 +1,125 @@
+"""
+Кэш для часто читаемых данных бота клуба X10.
+LRU-кэш с ограниченным временем жизни записей и объединением
+одновременных промахов по одному ключу (single-flight).
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 10000, ttl: float = 60.0):
+        """
+        Инициализация кэша
+        :param name: название кэша (для статистики)
+        :param maxsize: максимальное количество записей
+        :param ttl: время жизни записи в секундах
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        # Счетчики для статистики
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Получение значения из кэша или загрузка при промахе
+        Одновременные промахи по одному ключу ждут один и тот же запрос
+        :param key: ключ
+        :param loader: корутина-функция для загрузки значения
+        :return: Значение
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            # Такой же запрос уже выполняется - ждем его результат
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменили загрузку другого вызывающего, а не нас - загружаем сами
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_load(key, loader)
+                raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if not future.done():
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    # Исключение уже получил вызывающий, не логируем его повторно для ожидающих
+                    future.exception()
+                else:
+                    future.cancel()
+            raise
+
+        # Если ключ инвалидировали во время загрузки, значение могло устареть - не сохраняем его
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key: Hashable, value: Any):
+        """
+        Сохранение значения с вытеснением самых старых записей
+        """
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """
+        Удаление значения из кэша (после изменения данных)
+        :param key: ключ
+        """
+        self.invalidations += 1
+        self._data.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        """
+        Очистка кэша
+        """
+        self._data.clear()
+        self._inflight.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика использования кэша
+        :return: Словарь со счетчиками
+        """
+        requests = self.hits + self.misses + self.coalesced
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+        }
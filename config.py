@@ -22,6 +22,78 @@ class BotConfig:
 class DbConfig:
     """Конфигурация базы данных"""
     db_path: str  # Путь к файлу базы данных
+    backend: str = "sqlite"  # Хранилище данных: sqlite или memory
+    read_pool_size: int = 4  # Количество соединений для чтения в пуле
+    journal_mode: str = "WAL"  # Режим журнала SQLite
+    synchronous: str = "NORMAL"  # Режим синхронизации с диском
+    cache_size: int = -16000  # Размер кэша страниц (отрицательное значение - в КиБ)
+    mmap_size: int = 134217728  # Размер отображаемой в память области (байт)
+    busy_timeout: int = 5000  # Время ожидания блокировки (мс)
+    write_batch_size: int = 100  # Максимум операций записи в одной транзакции
+    write_flush_interval: float = 0.002  # Время накопления пакета записи (сек)
+    user_cache_size: int = 10000  # Максимум пользователей в кэше чтения
+    user_cache_ttl: float = 60.0  # Время жизни записи в кэше (сек)
+    analytics_cache_size: int = -32000  # Размер кэша страниц соединения для отчетов
+    slow_query_ms: float = 100.0  # Порог медленного запроса (мс)
+    capture_query_plans: bool = True  # Получать план каждого нового запроса
+    subscription_index_check_minutes: int = 60  # Период сверки индекса активных подписок (мин)
+
+
+@dataclass
+class BackupConfig:
+    """Настройки резервного копирования базы данных"""
+    backup_dir: str = "backups"  # Папка для резервных копий
+    keep: int = 7  # Сколько последних копий хранить
+    compression: str = "gzip"  # Способ сжатия: gzip, zstd или none
+    pages_per_step: int = 1024  # Страниц за один шаг Backup API
+    hour: int = 4  # Час ежедневного резервного копирования
+    prefix: str = "x10_club"  # Префикс имени файлов копий
+
+
+@dataclass
+class ArchiveConfig:
+    """Настройки архивации старых подписок и платежей"""
+    confirmed_payment_days: int = 90  # Возраст подтвержденного платежа для архивации (дней)
+    pending_payment_days: int = 30  # Возраст неоплаченного платежа для архивации (дней)
+    batch_size: int = 500  # Строк в одной транзакции переноса
+    hour: int = 3  # Час ежедневной архивации
+
+
+@dataclass
+class MaintenanceConfig:
+    """Настройки обслуживания базы данных"""
+    interval_hours: int = 24  # Период обслуживания (часов)
+    analysis_limit: int = 1000  # PRAGMA analysis_limit для ANALYZE
+    incremental_vacuum_pages: int = 0  # Страниц за один incremental_vacuum (0 - все)
+    busy_timeout: int = 30000  # Время ожидания блокировки (мс)
+
+
+@dataclass
+class OutboundConfig:
+    """Ограничения исходящих сообщений"""
+    enabled: bool = True  # Включить планировщик исходящих сообщений
+    global_rate: float = 25.0  # Сообщений в секунду на всех
+    global_burst: float = 25.0  # Запас сообщений без ожидания на всех
+    chat_rate: float = 1.0  # Сообщений в секунду в личный чат
+    chat_burst: float = 3.0  # Запас сообщений в личный чат
+    group_rate: float = 20 / 60  # Сообщений в секунду в группу или канал
+    group_burst: float = 3.0  # Запас сообщений в группу или канал
+    max_retries: int = 3  # Повторов запроса после 429 или сетевой ошибки (кроме отправки сообщений)
+    retry_base_delay: float = 1.0  # Начальная задержка повтора после сетевой ошибки (сек)
+    retry_max_delay: float = 30.0  # Максимальная задержка повтора после сетевой ошибки (сек)
+    flood_window: float = 10.0  # Окно подсчета ответов 429 (сек)
+    flood_cluster: int = 3  # Столько ответов 429 в окне - снижение общей скорости
+    rate_decrease: float = 0.5  # Множитель общей скорости при серии 429
+    rate_increase: float = 0.5  # Прибавка к общей скорости за секунду без 429
+    min_rate: float = 1.0  # Минимальная общая скорость (сообщений в секунду)
+
+
+@dataclass
+class BroadcastConfig:
+    """Настройки рассылок"""
+    workers: int = 20  # Параллельных отправок в одной рассылке
+    claim_batch: int = 200  # Получателей, забираемых из базы за раз
+    progress_interval: int = 5  # Период обновления сообщения с ходом рассылки (сек)
 
 
 @dataclass
@@ -62,6 +134,11 @@ class Config:
     db: DbConfig
     payment: PaymentConfig
     referral: ReferralConfig
+    backup: BackupConfig
+    archive: ArchiveConfig
+    maintenance: MaintenanceConfig
+    outbound: OutboundConfig
+    broadcast: BroadcastConfig
 
 
 def load_config() -> Config:
@@ -74,6 +151,21 @@ def load_config() -> Config:
         ),
         db=DbConfig(
             db_path=DB_PATH,
+            backend=DB_BACKEND,
+            read_pool_size=DB_READ_POOL_SIZE,
+            journal_mode=DB_JOURNAL_MODE,
+            synchronous=DB_SYNCHRONOUS,
+            cache_size=DB_CACHE_SIZE,
+            mmap_size=DB_MMAP_SIZE,
+            busy_timeout=DB_BUSY_TIMEOUT,
+            write_batch_size=DB_WRITE_BATCH_SIZE,
+            write_flush_interval=DB_WRITE_FLUSH_INTERVAL,
+            user_cache_size=DB_USER_CACHE_SIZE,
+            user_cache_ttl=DB_USER_CACHE_TTL,
+            analytics_cache_size=DB_ANALYTICS_CACHE_SIZE,
+            slow_query_ms=DB_SLOW_QUERY_MS,
+            capture_query_plans=DB_CAPTURE_QUERY_PLANS,
+            subscription_index_check_minutes=DB_SUBSCRIPTION_INDEX_CHECK_MINUTES,
         ),
         payment=PaymentConfig(
             club_price=CLUB_PRICE,
@@ -91,5 +183,46 @@ def load_config() -> Config:
             points_per_referral=POINTS_PER_REFERRAL,
             free_days=FREE_DAYS,
             bonus_levels=BONUS_LEVELS
+        ),
+        backup=BackupConfig(
+            backup_dir=BACKUP_DIR,
+            keep=BACKUP_KEEP,
+            compression=BACKUP_COMPRESSION,
+            pages_per_step=BACKUP_PAGES_PER_STEP,
+            hour=BACKUP_HOUR,
+        ),
+        archive=ArchiveConfig(
+            confirmed_payment_days=ARCHIVE_CONFIRMED_PAYMENT_DAYS,
+            pending_payment_days=ARCHIVE_PENDING_PAYMENT_DAYS,
+            batch_size=ARCHIVE_BATCH_SIZE,
+            hour=ARCHIVE_HOUR,
+        ),
+        maintenance=MaintenanceConfig(
+            interval_hours=MAINTENANCE_INTERVAL_HOURS,
+            analysis_limit=MAINTENANCE_ANALYSIS_LIMIT,
+            incremental_vacuum_pages=MAINTENANCE_INCREMENTAL_VACUUM_PAGES,
+            busy_timeout=MAINTENANCE_BUSY_TIMEOUT,
+        ),
+        outbound=OutboundConfig(
+            enabled=OUTBOUND_ENABLED,
+            global_rate=OUTBOUND_GLOBAL_RATE,
+            global_burst=OUTBOUND_GLOBAL_BURST,
+            chat_rate=OUTBOUND_CHAT_RATE,
+            chat_burst=OUTBOUND_CHAT_BURST,
+            group_rate=OUTBOUND_GROUP_RATE,
+            group_burst=OUTBOUND_GROUP_BURST,
+            max_retries=OUTBOUND_MAX_RETRIES,
+            retry_base_delay=OUTBOUND_RETRY_BASE_DELAY,
+            retry_max_delay=OUTBOUND_RETRY_MAX_DELAY,
+            flood_window=OUTBOUND_FLOOD_WINDOW,
+            flood_cluster=OUTBOUND_FLOOD_CLUSTER,
+            rate_decrease=OUTBOUND_RATE_DECREASE,
+            rate_increase=OUTBOUND_RATE_INCREASE,
+            min_rate=OUTBOUND_MIN_RATE,
+        ),
+        broadcast=BroadcastConfig(
+            workers=BROADCAST_WORKERS,
+            claim_batch=BROADCAST_CLAIM_BATCH,
+            progress_interval=BROADCAST_PROGRESS_INTERVAL,
         )
     )
\ No newline at end of file
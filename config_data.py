@@ -9,7 +9,64 @@ ADMIN_IDS = [278355059,804644988,335605223]  # Список ID админист
 GROUP_ID = -1002542126851  # ID группы клуба X10 (заменить на реальный)
 
 # Конфигурация базы данных
+DB_BACKEND = "sqlite"  # Хранилище данных: sqlite или memory (в памяти, для тестов и замеров)
 DB_PATH = "x10_club.db"  # Путь к файлу базы данных
+DB_READ_POOL_SIZE = 4  # Количество соединений для чтения
+DB_JOURNAL_MODE = "WAL"  # Режим журнала (WAL позволяет читать во время записи)
+DB_SYNCHRONOUS = "NORMAL"  # Режим синхронизации (NORMAL безопасен в режиме WAL)
+DB_CACHE_SIZE = -16000  # Размер кэша страниц на соединение (-16000 = 16 МБ)
+DB_MMAP_SIZE = 128 * 1024 * 1024  # Размер memory-mapped I/O (128 МБ)
+DB_BUSY_TIMEOUT = 5000  # Время ожидания блокировки БД (мс)
+DB_WRITE_BATCH_SIZE = 100  # Максимум операций записи, фиксируемых одной транзакцией
+DB_WRITE_FLUSH_INTERVAL = 0.002  # Сколько ждать накопления пакета записи (сек)
+DB_USER_CACHE_SIZE = 10000  # Максимум пользователей в кэше get_user/check_subscription
+DB_USER_CACHE_TTL = 60  # Время жизни записи в кэше (сек)
+DB_ANALYTICS_CACHE_SIZE = -32000  # Размер кэша страниц соединения для отчетов (-32000 = 32 МБ)
+DB_SLOW_QUERY_MS = 100  # Порог медленного запроса для записи в лог (мс)
+DB_CAPTURE_QUERY_PLANS = True  # Сохранять план (EXPLAIN QUERY PLAN) каждого нового запроса
+DB_SUBSCRIPTION_INDEX_CHECK_MINUTES = 60  # Как часто сверять индекс активных подписок с таблицей (мин)
+
+# Резервное копирование базы данных
+BACKUP_DIR = "backups"  # Папка для резервных копий
+BACKUP_KEEP = 7  # Сколько последних копий хранить
+BACKUP_COMPRESSION = "gzip"  # Сжатие копий: gzip, zstd (нужен пакет zstandard) или none
+BACKUP_PAGES_PER_STEP = 1024  # Количество страниц, копируемых за один шаг Backup API
+BACKUP_HOUR = 4  # Час ежедневного резервного копирования
+
+# Архивация старых данных
+ARCHIVE_CONFIRMED_PAYMENT_DAYS = 90  # Через сколько дней переносить в архив подтвержденные платежи
+ARCHIVE_PENDING_PAYMENT_DAYS = 30  # Через сколько дней переносить в архив неоплаченные платежи
+ARCHIVE_BATCH_SIZE = 500  # Количество строк, переносимых одной транзакцией
+ARCHIVE_HOUR = 3  # Час ежедневной архивации
+
+# Обслуживание базы данных (ANALYZE, optimize, incremental_vacuum, checkpoint)
+MAINTENANCE_INTERVAL_HOURS = 24  # Как часто выполнять обслуживание (часов)
+MAINTENANCE_ANALYSIS_LIMIT = 1000  # Ограничение строк на индекс для ANALYZE (0 - без ограничения)
+MAINTENANCE_INCREMENTAL_VACUUM_PAGES = 0  # Сколько свободных страниц возвращать за раз (0 - все)
+MAINTENANCE_BUSY_TIMEOUT = 30000  # Время ожидания блокировки для обслуживания (мс)
+
+# Ограничение исходящих сообщений (лимиты Telegram: ~30 сообщений в секунду всего,
+# ~1 в секунду в личный чат, 20 в минуту в группу)
+OUTBOUND_ENABLED = True  # Включить планировщик исходящих сообщений
+OUTBOUND_GLOBAL_RATE = 25  # Сообщений в секунду на всех (с запасом до лимита Telegram)
+OUTBOUND_GLOBAL_BURST = 25  # Сколько сообщений можно отправить подряд без ожидания
+OUTBOUND_CHAT_RATE = 1  # Сообщений в секунду в один личный чат
+OUTBOUND_CHAT_BURST = 3  # Сообщений подряд в один личный чат
+OUTBOUND_GROUP_RATE = 20 / 60  # Сообщений в секунду в одну группу или канал
+OUTBOUND_GROUP_BURST = 3  # Сообщений подряд в одну группу или канал
+OUTBOUND_MAX_RETRIES = 3  # Сколько раз повторять запрос после 429 или сетевой ошибки (кроме отправки сообщений)
+OUTBOUND_RETRY_BASE_DELAY = 1.0  # Начальная задержка повтора после сетевой ошибки (сек, удваивается)
+OUTBOUND_RETRY_MAX_DELAY = 30.0  # Максимальная задержка повтора после сетевой ошибки (сек)
+OUTBOUND_FLOOD_WINDOW = 10  # Окно, в котором считаются ответы 429 (сек)
+OUTBOUND_FLOOD_CLUSTER = 3  # Столько ответов 429 в окне - общая пауза и снижение скорости
+OUTBOUND_RATE_DECREASE = 0.5  # Во сколько раз снижать общую скорость при серии 429
+OUTBOUND_RATE_INCREASE = 0.5  # На сколько сообщений в секунду восстанавливать скорость каждую секунду
+OUTBOUND_MIN_RATE = 1  # Ниже этой общей скорости не опускаться (сообщений в секунду)
+
+# Рассылки (состояние сохраняется в базе, прерванная рассылка продолжается после перезапуска)
+BROADCAST_WORKERS = 20  # Параллельных отправок в одной рассылке (скорость ограничивает OUTBOUND_*)
+BROADCAST_CLAIM_BATCH = 200  # Сколько получателей забирать из базы за раз
+BROADCAST_PROGRESS_INTERVAL = 5  # Как часто обновлять сообщение с ходом рассылки (сек)
 
 # Настройки платежей
 CLUB_PRICE = 1000  # Стоимость членства в клубе (руб)
@@ -1,365 +1,951 @@
 """
 Модуль для работы с базой данных.
-Содержит функции для взаимодействия с SQLite.
+Содержит хранилище на SQLite (реализация интерфейса repository.Repository).
 """
 import sqlite3
 import aiosqlite
 import asyncio
 import datetime
-from typing import List, Dict, Any, Optional, Tuple, Union
+import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Union, Callable, Awaitable, Iterable, AsyncIterator, Sequence
 
+from cache import TTLCache
+from instrumentation import InstrumentedConnection, QueryStats
+from config import DbConfig
+from migrations import apply_migrations, get_schema_version, LATEST_VERSION
+from records import User, Subscription, Payment, Referral, Broadcast, DeadLetter
+from repository import Repository, ITER_BATCH_SIZE, broadcast_campaign_id
+from segments import Segment
+from subscription_index import SubscriptionIndex
 
-class Database:
-    def __init__(self, db_path: str):
+logger = logging.getLogger(__name__)
+
+# Максимальное количество параметров в одном запросе вида IN (...)
+# (SQLite по умолчанию ограничивает число параметров запроса)
+BULK_CHUNK_SIZE = 500
+
+# Таблицы, строки которых переносятся в архив: первичный ключ и переносимые столбцы
+ARCHIVE_TABLES = {
+    "subscriptions": (
+        "subscription_id",
+        ("subscription_id", "user_id", "start_date", "end_date", "status", "start_ts", "end_ts"),
+    ),
+    "payments": (
+        "payment_id",
+        ("payment_id", "user_id", "amount", "product_type", "payment_method", "status",
+         "created_at", "confirmed_at", "created_ts", "confirmed_ts", "tx_id", "currency"),
+    ),
+}
+
+
+def now_ts() -> int:
+    """
+    Текущее время в секундах Unix (UTC)
+    """
+    return int(time.time())
+
+
+def day_bounds_ts(day: datetime.date) -> Tuple[int, int]:
+    """
+    Границы локальных суток в секундах Unix
+    :param day: дата
+    :return: Полуинтервал [начало суток, начало следующих суток)
+    """
+    start = datetime.datetime.combine(day, datetime.time.min)
+    end = start + datetime.timedelta(days=1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def normalize_tx_id(tx_id: str) -> str:
+    """
+    Приведение TxID к единому виду для поиска повторов
+    Шестнадцатеричные хэши (ETH, TRON, BTC) не зависят от регистра, поэтому приводятся к нижнему
+    :param tx_id: ID транзакции в том виде, как его прислал пользователь
+    :return: Нормализованный TxID
+    """
+    tx_id = tx_id.strip()
+    if re.fullmatch(r"(0[xX])?[0-9a-fA-F]+", tx_id):
+        return tx_id.lower()
+    return tx_id
+
+
+class Database(Repository):
+    def __init__(self, db_path: str, config: Optional[DbConfig] = None):
         """
         Инициализация базы данных
         :param db_path: путь к файлу базы данных
+        :param config: настройки пула соединений и PRAGMA (по умолчанию - значения DbConfig)
         """
         self.db_path = db_path
+        self.config = config or DbConfig(db_path=db_path)
 
-    async def create_tables(self):
-        """Создание необходимых таблиц в базе данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Пользователи
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                balance INTEGER DEFAULT 0,
-                is_admin BOOLEAN DEFAULT 0
-            )
-            ''')
-
-            # Подписки на клуб
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                end_date TIMESTAMP,
-                status TEXT DEFAULT 'active',
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-
-            # Платежи
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount INTEGER,
-                product_type TEXT,
-                payment_method TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                confirmed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-
-            # Реферальная система
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS referrals (
-                referral_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                referrer_id INTEGER,
-                join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (referrer_id) REFERENCES users (user_id)
-            )
-            ''')
-
-            # Мероприятия и регистрации
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                description TEXT,
-                event_date TIMESTAMP,
-                price INTEGER,
-                max_participants INTEGER DEFAULT NULL
-            )
-            ''')
-
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS event_registrations (
-                registration_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_id INTEGER,
-                user_id INTEGER,
-                payment_id INTEGER,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'registered',
-                FOREIGN KEY (event_id) REFERENCES events (event_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (payment_id) REFERENCES payments (payment_id)
-            )
-            ''')
-
-            await db.commit()
+        # Пул соединений: одно соединение для записи и несколько для чтения
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._connect_lock = asyncio.Lock()
 
-    # Методы для работы с пользователями
-    async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        # Отдельное соединение только для чтения (mode=ro) для тяжелых отчетов администраторов,
+        # чтобы они не занимали пул, которым пользуются обработчики пользователей
+        self._analytics: Optional[aiosqlite.Connection] = None
+        self._analytics_lock = asyncio.Lock()
+
+        # Очередь операций записи, которые выполняет единственная задача-писатель
+        self._write_ops: deque = deque()
+        self._write_event = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+
+        # Статистика времени выполнения запросов по всем соединениям
+        self.query_stats = QueryStats(self.config.slow_query_ms, self.config.capture_query_plans)
+
+        # Кэш данных пользователей и их активных подписок
+        self._user_cache = TTLCache("users", self.config.user_cache_size, self.config.user_cache_ttl)
+        self._subscription_cache = TTLCache("subscriptions", self.config.user_cache_size, self.config.user_cache_ttl)
+
+        # Индекс активных подписок в памяти (заполняется load_subscription_index при запуске)
+        self.subscription_index = SubscriptionIndex()
+
+    async def _open_connection(self, read_only: bool = False, analytics: bool = False) -> aiosqlite.Connection:
         """
-        Добавление нового пользователя или обновление существующего
+        Открытие соединения с применением PRAGMA из конфигурации
+        :param read_only: запретить запись через это соединение
+        :param analytics: открыть файл в режиме mode=ro для отчетов (подразумевает read_only)
+        :return: Объект соединения
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, существует ли пользователь
-            cursor = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            user = await cursor.fetchone()
+        if analytics:
+            read_only = True
+            # В режиме WAL такое соединение читает согласованный снимок и никогда не блокирует запись
+            database = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = await aiosqlite.connect(database, uri=True, isolation_level="")
+        else:
+            # Транзакциями соединения для записи управляет задача-писатель (BEGIN/COMMIT вручную)
+            conn = await aiosqlite.connect(self.db_path, isolation_level="" if read_only else None)
+        conn.row_factory = sqlite3.Row
 
-            if user:
-                # Обновляем информацию о пользователе
-                await db.execute(
-                    "UPDATE users SET username = ?, first_name = ?, last_name = ? WHERE user_id = ?",
-                    (username, first_name, last_name, user_id)
-                )
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.config.busy_timeout)}")
+        if not read_only:
+            # Новая база сразу создается с инкрементальной очисткой (для существующей режим
+            # переключает задача обслуживания через VACUUM)
+            await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # Режим журнала хранится в файле БД, достаточно установить его один раз
+            await conn.execute(f"PRAGMA journal_mode = {self.config.journal_mode}")
+        await conn.execute(f"PRAGMA synchronous = {self.config.synchronous}")
+        cache_size = self.config.analytics_cache_size if analytics else self.config.cache_size
+        await conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+        await conn.execute(f"PRAGMA mmap_size = {int(self.config.mmap_size)}")
+        if read_only:
+            await conn.execute("PRAGMA query_only = 1")
+
+        # Все запросы через соединение замеряются (PRAGMA выше в статистику не попадают)
+        return InstrumentedConnection(conn, self.query_stats)
+
+    async def connect(self):
+        """
+        Открытие пула соединений (вызывается один раз при запуске)
+        """
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+
+            # Соединение для записи открываем первым, чтобы включить WAL до открытия читателей
+            self._writer = await self._open_connection()
+            self._writer_task = asyncio.create_task(self._writer_loop(), name="db_writer")
+
+            self._readers = asyncio.Queue()
+            for _ in range(max(1, self.config.read_pool_size)):
+                conn = await self._open_connection(read_only=True)
+                self._reader_conns.append(conn)
+                self._readers.put_nowait(conn)
+
+            logger.info(
+                f"Пул соединений с БД открыт: 1 на запись, {len(self._reader_conns)} на чтение "
+                f"(journal_mode={self.config.journal_mode}, synchronous={self.config.synchronous})"
+            )
+
+    async def close(self):
+        """
+        Закрытие всех соединений пула (вызывается при остановке бота)
+        """
+        async with self._connect_lock:
+            if self._writer_task is not None:
+                # Задача-писатель выполнит все поставленные в очередь операции и завершится
+                self._write_ops.append(None)
+                self._write_event.set()
+                await self._writer_task
+                self._writer_task = None
+
+            for conn in self._reader_conns:
+                await conn.close()
+            self._reader_conns = []
+            self._readers = None
+
+            async with self._analytics_lock:
+                if self._analytics is not None:
+                    await self._analytics.close()
+                    self._analytics = None
+
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+            logger.info("Пул соединений с БД закрыт")
+
+    @asynccontextmanager
+    async def _read(self, analytics: bool = False):
+        """
+        Получение соединения для чтения из пула
+        :param analytics: использовать соединение для отчетов вместо пула
+        """
+        if self._readers is None:
+            await self.connect()
+
+        if analytics:
+            # Отчеты выполняются по одному, соединение открывается при первом отчете
+            async with self._analytics_lock:
+                if self._analytics is None:
+                    self._analytics = await self._open_connection(analytics=True)
+                yield self._analytics
+            return
+
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def _submit(self, operation: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+        """
+        Постановка операции записи в очередь задачи-писателя
+        :param operation: корутина-функция, принимающая соединение для записи
+        :return: Результат операции после фиксации транзакции
+        """
+        if self._writer_task is None:
+            await self.connect()
+        elif self._writer_task.done():
+            # Задача-писатель завершается только при close(); иначе она упала - перезапускаем
+            error = None if self._writer_task.cancelled() else self._writer_task.exception()
+            logger.error(f"Задача-писатель БД завершилась аварийно ({error}), перезапуск")
+            self._writer_task = asyncio.create_task(self._writer_loop(), name="db_writer")
+
+        future = asyncio.get_running_loop().create_future()
+        self._write_ops.append((operation, future))
+        self._write_event.set()
+        return await future
+
+    async def _writer_loop(self):
+        """
+        Задача-писатель: выполняет операции записи пакетами в одной транзакции (group commit)
+        """
+        batch_size = max(1, self.config.write_batch_size)
+        flush_interval = self.config.write_flush_interval
+
+        while True:
+            await self._write_event.wait()
+
+            # Даем накопиться операциям, но не дольше flush_interval
+            if flush_interval > 0 and len(self._write_ops) < batch_size and None not in self._write_ops:
+                await asyncio.sleep(flush_interval)
+
+            self._write_event.clear()
+            batch = []
+            stop = False
+            while self._write_ops and len(batch) < batch_size:
+                item = self._write_ops.popleft()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if self._write_ops:
+                self._write_event.set()
+
+            if batch:
+                await self._commit_batch_safe(batch)
+
+            if stop:
+                # Выполняем то, что успели поставить в очередь до остановки
+                while self._write_ops:
+                    item = self._write_ops.popleft()
+                    if item is not None:
+                        await self._commit_batch_safe([item])
+                return
+
+    async def _commit_batch_safe(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        """
+        Выполнение пакета без остановки задачи-писателя при непредвиденной ошибке
+        (операции пакета завершаются с этой ошибкой, следующие пакеты выполняются)
+        """
+        try:
+            await self._commit_batch(batch)
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка задачи-писателя ({len(batch)} операций): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _commit_batch(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        """
+        Выполнение пакета операций записи в одной транзакции
+        Каждая операция выполняется в своей точке сохранения, поэтому ошибка
+        одной операции не отменяет остальные
+        :param batch: список пар (операция, future вызывающего)
+        """
+        db = self._writer
+        results = []
+
+        try:
+            if db.in_transaction:
+                # Транзакция осталась открытой после неудачного отката предыдущего пакета
+                await db.execute("ROLLBACK")
+            await db.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                if future.done():
+                    # Вызывающий уже отменил ожидание - операцию не выполняем
+                    continue
+                await db.execute("SAVEPOINT write_op")
+                try:
+                    result = await operation(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO write_op")
+                    await db.execute("RELEASE write_op")
+                    results.append((future, None, e))
+                else:
+                    await db.execute("RELEASE write_op")
+                    results.append((future, result, None))
+            await db.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка при фиксации пакета записи ({len(batch)} операций): {e}")
+            try:
+                if db.in_transaction:
+                    await db.execute("ROLLBACK")
+            except Exception as rollback_error:
+                # Ошибка отката не должна останавливать задачу-писатель
+                logger.error(f"Ошибка при откате пакета записи: {rollback_error}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
             else:
-                # Добавляем нового пользователя
-                await db.execute(
-                    "INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
-                    (user_id, username, first_name, last_name)
-                )
+                future.set_result(result)
 
-            await db.commit()
+    async def _fetch_bulk(self, query: str, ids: Iterable[int], params: tuple = (),
+                          analytics: bool = False) -> List[aiosqlite.Row]:
+        """
+        Выполнение запроса для набора идентификаторов частями по BULK_CHUNK_SIZE
+        :param query: SQL-запрос с местом {placeholders} для списка параметров IN (...)
+        :param ids: идентификаторы (дубликаты отбрасываются)
+        :param params: параметры запроса, идущие перед списком идентификаторов
+        :param analytics: выполнить через соединение для отчетов
+        :return: Строки результата по всем частям
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        rows = []
+        if not unique_ids:
+            return rows
+
+        async with self._read(analytics) as db:
+            for i in range(0, len(unique_ids), BULK_CHUNK_SIZE):
+                chunk = unique_ids[i:i + BULK_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(query.format(placeholders=placeholders), (*params, *chunk))
+                rows.extend(await cursor.fetchall())
+        return rows
+
+    async def migrate(self) -> int:
+        """
+        Приведение схемы базы данных к последней версии
+        Если схема уже актуальна, DDL-выражения не выполняются
+        :return: Текущая версия схемы
+        """
+        async with self._read() as db:
+            current_version = await get_schema_version(db)
+
+        if current_version >= LATEST_VERSION:
+            return current_version
+
+        # Миграции - разовые полные проходы по таблицам, в статистику запросов их не включаем
+        version = await self._submit(lambda db: apply_migrations(db.raw))
+        logger.info(f"Схема базы данных обновлена с версии {current_version} до {version}")
+        return version
+
+    # Методы для работы с пользователями
+    def cache_stats(self) -> List[Dict[str, Any]]:
+        """
+        Статистика кэшей (попадания, промахи, объединенные запросы)
+        """
+        return [self._user_cache.stats(), self._subscription_cache.stats()]
+
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        """
+        Добавление нового пользователя или обновление существующего
+        Строка обновляется только если данные пользователя изменились или он был недоступен
+        (пользователь написал боту - значит, снова может получать сообщения)
+        """
+        async def operation(db):
+            await db.execute(
+                """
+                INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    reachable = 1,
+                    unreachable_ts = NULL
+                WHERE users.username IS NOT excluded.username
+                   OR users.first_name IS NOT excluded.first_name
+                   OR users.last_name IS NOT excluded.last_name
+                   OR users.reachable = 0
+                """,
+                (user_id, username, first_name, last_name)
+            )
             return True
 
-    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        result = await self._submit(operation)
+        self._user_cache.invalidate(user_id)
+        return result
+
+    async def get_user(self, user_id: int) -> Optional[User]:
         """
-        Получение информации о пользователе
+        Получение информации о пользователе (через кэш)
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
-            cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = await cursor.fetchone()
+        async def load():
+            async with self._read() as db:
+                cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+                user = await cursor.fetchone()
 
-            if user:
-                return dict(user)
-            return None
+                if user:
+                    return User.from_row(user)
+                return None
+
+        return await self._user_cache.get_or_load(user_id, load)
 
     async def update_user_balance(self, user_id: int, amount: int) -> int:
         """
         Обновление баланса пользователя
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+        async def operation(db):
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
                 (amount, user_id)
             )
-            await db.commit()
-
-            # Получаем обновленный баланс
-            cursor = await db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
             result = await cursor.fetchone()
             return result[0] if result else 0
 
+        balance = await self._submit(operation)
+        self._user_cache.invalidate(user_id)
+        return balance
+
+    async def set_user_reachable(self, user_id: int, reachable: bool) -> bool:
+        """
+        Отметка доступности пользователя для сообщений бота
+        :param user_id: ID пользователя
+        :param reachable: False - пользователь заблокировал бота или чат не найден
+        :return: True, если отметка изменилась
+        """
+        async def operation(db):
+            cursor = await db.execute(
+                """
+                UPDATE users SET reachable = ?, unreachable_ts = ?
+                WHERE user_id = ? AND reachable IS NOT ?
+                """,
+                (int(reachable), None if reachable else now_ts(), user_id, int(reachable))
+            )
+            return cursor.rowcount > 0
+
+        changed = await self._submit(operation)
+        if changed:
+            self._user_cache.invalidate(user_id)
+        return changed
+
+    async def count_unreachable_users(self) -> int:
+        """
+        Количество пользователей, заблокировавших бота
+        """
+        async with self._read() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM users WHERE reachable = 0")
+            return (await cursor.fetchone())[0]
+
+    async def get_users_bulk(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """
+        Получение информации о нескольких пользователях за несколько запросов
+        :param user_ids: ID пользователей
+        :return: Словарь {user_id: пользователь}; отсутствующих в базе пользователей в нем нет
+        """
+        rows = await self._fetch_bulk(
+            "SELECT * FROM users WHERE user_id IN ({placeholders})",
+            user_ids
+        )
+        return {row['user_id']: User.from_row(row) for row in rows}
+
+    async def count_users(self, segment: Optional[Segment] = None) -> int:
+        """
+        Подсчет количества пользователей
+        :param segment: сегмент пользователей (None - все пользователи)
+        :return: Количество пользователей
+        """
+        query = "SELECT COUNT(*) FROM users"
+        where, params = segment.to_sql(now_ts()) if segment else ("", ())
+        if where:
+            query += f" WHERE {where}"
+        async with self._read() as db:
+            cursor = await db.execute(query, params)
+            return (await cursor.fetchone())[0]
+
+    async def iter_user_pages(self, segment: Optional[Segment] = None,
+                              batch_size: int = ITER_BATCH_SIZE,
+                              analytics: bool = False) -> AsyncIterator[List[User]]:
+        """
+        Постраничный обход пользователей в порядке user_id
+        Страницы выбираются по ключу (user_id > последнего просмотренного), поэтому каждая страница
+        читается по первичному ключу, а соединение занято только на время чтения одной страницы
+        :param segment: сегмент пользователей (None - все пользователи)
+        :param batch_size: размер страницы
+        :param analytics: читать через соединение для отчетов
+        :return: Асинхронный генератор списков пользователей
+        """
+        query = "SELECT * FROM users WHERE user_id > ?"
+        where, params = segment.to_sql(now_ts()) if segment else ("", ())
+        if where:
+            query += f" AND ({where})"
+        query += " ORDER BY user_id LIMIT ?"
+
+        last_id = -2 ** 63
+        while True:
+            async with self._read(analytics) as db:
+                cursor = await db.execute(query, (last_id, *params, batch_size))
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+
+            yield [User.from_row(row) for row in rows]
+
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['user_id']
+
     # Методы для работы с подписками
-    async def add_subscription(self, user_id: int, days: int) -> int:
+    async def _extend_subscription(self, db: aiosqlite.Connection, user_id: int, days: int) -> Tuple[int, int]:
         """
-        Добавление подписки для пользователя
+        Продление активной подписки или создание новой (внутри транзакции записи)
+        :param db: соединение для записи
+        :param user_id: ID пользователя
+        :param days: количество дней
+        :return: ID подписки и новое время окончания
         """
-        end_date = datetime.datetime.now() + datetime.timedelta(days=days)
+        now = now_ts()
+        period = days * 86400
+
+        # Проверяем наличие активной подписки
+        cursor = await db.execute(
+            "SELECT subscription_id, end_ts FROM subscriptions WHERE user_id = ? AND status = 'active' ORDER BY end_ts DESC LIMIT 1",
+            (user_id,)
+        )
+        existing_sub = await cursor.fetchone()
 
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем наличие активной подписки
+        if existing_sub:
+            # Если есть активная подписка, продлеваем ее
+            subscription_id, current_end_ts = existing_sub
+
+            # Если дата окончания в прошлом, отсчитываем от текущего момента
+            if not current_end_ts or current_end_ts < now:
+                new_end_ts = now + period
+            else:
+                new_end_ts = current_end_ts + period
+
+            await db.execute(
+                "UPDATE subscriptions SET end_ts = ?, end_date = ? WHERE subscription_id = ?",
+                (new_end_ts, datetime.datetime.fromtimestamp(new_end_ts).isoformat(), subscription_id)
+            )
+        else:
+            # Создаем новую подписку
+            new_end_ts = now + period
             cursor = await db.execute(
-                "SELECT subscription_id, end_date FROM subscriptions WHERE user_id = ? AND status = 'active' ORDER BY end_date DESC LIMIT 1",
-                (user_id,)
+                "INSERT INTO subscriptions (user_id, start_ts, end_ts, end_date) VALUES (?, ?, ?, ?)",
+                (user_id, now, new_end_ts, datetime.datetime.fromtimestamp(new_end_ts).isoformat())
             )
-            existing_sub = await cursor.fetchone()
+            subscription_id = cursor.lastrowid
 
-            if existing_sub:
-                # Если есть активная подписка, продлеваем ее
-                subscription_id, current_end = existing_sub
+        return subscription_id, new_end_ts
 
-                # Конвертируем строку в datetime, если необходимо
-                if isinstance(current_end, str):
-                    current_end = datetime.datetime.fromisoformat(current_end.replace('Z', '+00:00'))
+    async def add_subscription(self, user_id: int, days: int) -> int:
+        """
+        Добавление подписки для пользователя
+        """
+        async def operation(db):
+            return await self._extend_subscription(db, user_id, days)
 
-                # Если дата окончания в прошлом, используем текущую дату
-                if current_end < datetime.datetime.now():
-                    new_end_date = end_date
-                else:
-                    new_end_date = current_end + datetime.timedelta(days=days)
+        subscription_id, end_ts = await self._submit(operation)
+        self._subscription_cache.invalidate(user_id)
+        self.subscription_index.set(user_id, subscription_id, end_ts)
+        return subscription_id
 
-                await db.execute(
-                    "UPDATE subscriptions SET end_date = ? WHERE subscription_id = ?",
-                    (new_end_date.isoformat(), subscription_id)
-                )
-            else:
-                # Создаем новую подписку
-                cursor = await db.execute(
-                    "INSERT INTO subscriptions (user_id, end_date) VALUES (?, ?)",
-                    (user_id, end_date.isoformat())
-                )
-                subscription_id = cursor.lastrowid
+    async def _fetch_active_subscriptions(self, db: aiosqlite.Connection) -> List[Tuple[int, int, int]]:
+        """
+        Активные подписки для индекса (по одной, самой поздней, на пользователя)
+        :param db: соединение
+        :return: Список (user_id, subscription_id, end_ts)
+        """
+        cursor = await db.execute(
+            "SELECT user_id, subscription_id, end_ts FROM subscriptions WHERE status = 'active' AND end_ts IS NOT NULL"
+        )
+        return [tuple(row) for row in await cursor.fetchall()]
 
-            await db.commit()
-            return subscription_id
+    async def load_subscription_index(self) -> int:
+        """
+        Заполнение индекса активных подписок одним запросом (вызывается при запуске после migrate)
+        :return: Количество пользователей с активной подпиской
+        """
+        async with self._read() as db:
+            rows = await self._fetch_active_subscriptions(db)
+        self.subscription_index.load(rows)
+        logger.info(f"Индекс активных подписок загружен: {len(self.subscription_index)} пользователей")
+        return len(self.subscription_index)
 
-    async def check_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+    async def verify_subscription_index(self) -> Dict[str, List[int]]:
         """
-        Проверка активной подписки пользователя
+        Сверка индекса активных подписок с таблицей и его перестроение при расхождении
+        Чтение выполняется в очереди записи, поэтому не пересекается с изменениями подписок
+        :return: Словарь расхождений (missing, stale, changed) со списками user_id
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
-            cursor = await db.execute(
-                "SELECT * FROM subscriptions WHERE user_id = ? AND status = 'active' AND end_date > datetime('now') ORDER BY end_date DESC LIMIT 1",
-                (user_id,)
+        rows = await self._submit(self._fetch_active_subscriptions)
+        diff = self.subscription_index.diff(rows)
+        if any(diff.values()):
+            logger.warning(
+                f"Индекс активных подписок расходится с таблицей: нет в индексе {diff['missing'][:10]}, "
+                f"лишние {diff['stale'][:10]}, изменены {diff['changed'][:10]} - индекс перестроен"
             )
-            subscription = await cursor.fetchone()
+            self.subscription_index.load(rows)
+        return diff
+
+    async def check_subscription(self, user_id: int) -> Optional[Subscription]:
+        """
+        Проверка активной подписки пользователя (через кэш)
+        """
+        # Если индекс знает, что подписки нет, запрос не нужен
+        if self.subscription_index.loaded and self.subscription_index.get(user_id, now_ts()) is None:
+            return None
+
+        async def load():
+            async with self._read() as db:
+                cursor = await db.execute(
+                    "SELECT * FROM subscriptions WHERE user_id = ? AND status = 'active' AND end_ts > ? ORDER BY end_ts DESC LIMIT 1",
+                    (user_id, now_ts())
+                )
+                subscription = await cursor.fetchone()
+
+                if subscription:
+                    return Subscription.from_row(subscription)
+                return None
+
+        subscription = await self._subscription_cache.get_or_load(user_id, load)
 
-            if subscription:
-                return dict(subscription)
+        # Подписка из кэша могла истечь с момента загрузки
+        if subscription and subscription['end_ts'] <= now_ts():
             return None
+        return subscription
 
-    async def get_expiring_subscriptions(self, days: int = 3) -> List[Dict[str, Any]]:
+    async def get_active_subscriptions_bulk(self, user_ids: Iterable[int],
+                                            analytics: bool = False) -> Dict[int, Subscription]:
+        """
+        Получение активных подписок нескольких пользователей
+        :param user_ids: ID пользователей
+        :param analytics: читать через соединение для отчетов
+        :return: Словарь {user_id: подписка с самым поздним окончанием}; пользователей без подписки в нем нет
+        """
+        rows = await self._fetch_bulk(
+            """
+            SELECT * FROM subscriptions
+            WHERE status = 'active' AND end_ts > ? AND user_id IN ({placeholders})
+            ORDER BY end_ts
+            """,
+            user_ids,
+            (now_ts(),),
+            analytics
+        )
+        # Строки упорядочены по end_ts, поэтому для каждого пользователя остается самая поздняя
+        return {row['user_id']: Subscription.from_row(row) for row in rows}
+
+    async def get_expiring_subscriptions(self, days: int = 3) -> List[Subscription]:
         """
         Получение списка подписок, которые истекают через указанное количество дней
+        (в течение локальных суток, наступающих через days дней)
         """
         target_date = (datetime.datetime.now() + datetime.timedelta(days=days)).date()
+        start_ts, end_ts = day_bounds_ts(target_date)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 """
                 SELECT s.*, u.user_id, u.username, u.first_name, u.last_name
                 FROM subscriptions s
                 JOIN users u ON s.user_id = u.user_id
                 WHERE s.status = 'active'
-                AND date(s.end_date) = date(?)
+                AND s.end_ts >= ? AND s.end_ts < ?
                 """,
-                (target_date.isoformat(),)
+                (start_ts, end_ts)
             )
 
             subscriptions = await cursor.fetchall()
-            return [dict(sub) for sub in subscriptions]
+            return [Subscription.from_row(sub) for sub in subscriptions]
 
-    async def get_expired_subscriptions(self) -> List[Dict[str, Any]]:
+    async def get_expired_subscriptions(self) -> List[Subscription]:
         """
         Получение списка истекших подписок, которые еще активны
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 """
                 SELECT s.*, u.user_id, u.username, u.first_name, u.last_name
                 FROM subscriptions s
                 JOIN users u ON s.user_id = u.user_id
                 WHERE s.status = 'active'
-                AND datetime(s.end_date) < datetime('now')
-                """
+                AND s.end_ts < ?
+                """,
+                (now_ts(),)
             )
 
             subscriptions = await cursor.fetchall()
-            return [dict(sub) for sub in subscriptions]
+            return [Subscription.from_row(sub) for sub in subscriptions]
 
     async def deactivate_subscription(self, subscription_id: int) -> bool:
         """
-        Деактивация подписки
+        Деактивация истекшей подписки
+        Условие проверяется в том же UPDATE: подписка, продленная после выборки истекших, не деактивируется
+        :param subscription_id: ID подписки
+        :return: True, если подписка деактивирована
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE subscriptions SET status = 'expired' WHERE subscription_id = ?",
-                (subscription_id,)
+        async def operation(db):
+            cursor = await db.execute(
+                """
+                UPDATE subscriptions SET status = 'expired'
+                WHERE subscription_id = ? AND status = 'active' AND end_ts <= ?
+                RETURNING user_id
+                """,
+                (subscription_id, now_ts())
             )
-            await db.commit()
-            return True
+            return await cursor.fetchone()
+
+        row = await self._submit(operation)
+        if row is None:
+            return False
+        self._subscription_cache.invalidate(row[0])
+        self.subscription_index.remove(row[0], subscription_id)
+        return True
 
     # Методы для работы с платежами
     async def create_payment(self, user_id: int, amount: int, product_type: str, payment_method: str) -> int:
         """
         Создание новой записи о платеже
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async def operation(db):
             cursor = await db.execute(
-                "INSERT INTO payments (user_id, amount, product_type, payment_method) VALUES (?, ?, ?, ?)",
-                (user_id, amount, product_type, payment_method)
+                "INSERT INTO payments (user_id, amount, product_type, payment_method, created_ts) VALUES (?, ?, ?, ?, ?)",
+                (user_id, amount, product_type, payment_method, now_ts())
             )
             payment_id = cursor.lastrowid
-            await db.commit()
             return payment_id
 
+        return await self._submit(operation)
+
     async def confirm_payment(self, payment_id: int) -> bool:
         """
         Подтверждение платежа
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            confirmed_at = datetime.datetime.now().isoformat()
+        async def operation(db):
+            confirmed_ts = now_ts()
             await db.execute(
-                "UPDATE payments SET status = 'confirmed', confirmed_at = ? WHERE payment_id = ?",
-                (confirmed_at, payment_id)
+                "UPDATE payments SET status = 'confirmed', confirmed_at = ?, confirmed_ts = ? WHERE payment_id = ?",
+                (datetime.datetime.fromtimestamp(confirmed_ts).isoformat(), confirmed_ts, payment_id)
             )
-            await db.commit()
             return True
 
-    async def get_payment(self, payment_id: int) -> Optional[Dict[str, Any]]:
+        return await self._submit(operation)
+
+    async def get_payment(self, payment_id: int) -> Optional[Payment]:
         """
         Получение информации о платеже
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute("SELECT * FROM payments WHERE payment_id = ?", (payment_id,))
             payment = await cursor.fetchone()
 
             if payment:
-                return dict(payment)
+                return Payment.from_row(payment)
             return None
 
+    async def get_pending_payments(self, limit: int = 15) -> List[Payment]:
+        """
+        Получение последних ожидающих подтверждения платежей (для администраторов)
+        :param limit: максимальное количество платежей
+        :return: Список платежей с данными пользователей
+        """
+        async with self._read(analytics=True) as db:
+            cursor = await db.execute(
+                """
+                SELECT p.payment_id, p.user_id, u.username, u.first_name, p.product_type, p.amount,
+                       p.payment_method, p.created_at, p.tx_id, p.currency
+                FROM payments p
+                LEFT JOIN users u ON p.user_id = u.user_id
+                WHERE p.status = 'pending'
+                ORDER BY p.created_at DESC
+                LIMIT ?
+                """,
+                (limit,)
+            )
+            payments = await cursor.fetchall()
+            return [Payment.from_row(payment) for payment in payments]
+
+    async def attach_tx_id(self, payment_id: int, tx_id: str, currency: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Привязка ID транзакции (TxID) к криптоплатежу
+        TxID уникален: если он уже привязан к другому платежу (в том числе архивному), привязка не выполняется
+        :param payment_id: ID платежа
+        :param tx_id: ID транзакции
+        :param currency: криптовалюта платежа
+        :return: Словарь {"attached": bool, "tx_id": нормализованный TxID,
+                 "duplicate_payment_id": ID платежа с тем же TxID или None}
+        """
+        tx_id = normalize_tx_id(tx_id)
+
+        async def operation(db):
+            # Поиск по уникальному индексу - без просмотра таблицы платежей
+            cursor = await db.execute(
+                """
+                SELECT payment_id FROM payments WHERE tx_id = ?
+                UNION ALL
+                SELECT payment_id FROM payments_archive WHERE tx_id = ?
+                LIMIT 1
+                """,
+                (tx_id, tx_id)
+            )
+            row = await cursor.fetchone()
+            if row and row[0] != payment_id:
+                return {"attached": False, "tx_id": tx_id, "duplicate_payment_id": row[0]}
+
+            try:
+                cursor = await db.execute(
+                    "UPDATE payments SET tx_id = ?, currency = COALESCE(?, currency) WHERE payment_id = ?",
+                    (tx_id, currency, payment_id)
+                )
+            except sqlite3.IntegrityError:
+                # TxID занят платежом, привязанным после проверки выше
+                cursor = await db.execute("SELECT payment_id FROM payments WHERE tx_id = ?", (tx_id,))
+                row = await cursor.fetchone()
+                return {"attached": False, "tx_id": tx_id, "duplicate_payment_id": row[0] if row else None}
+            return {"attached": cursor.rowcount > 0, "tx_id": tx_id, "duplicate_payment_id": None}
+
+        result = await self._submit(operation)
+        if result["duplicate_payment_id"]:
+            logger.warning(
+                f"TxID {tx_id} для платежа {payment_id} уже использован в платеже {result['duplicate_payment_id']}"
+            )
+        return result
+
     # Методы для работы с реферальной системой
     async def add_referral(self, user_id: int, referrer_id: int) -> int:
         """
         Добавление записи о реферале
+        :return: ID записи или 0, если пользователь уже является рефералом
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, не является ли пользователь уже рефералом
+        async def operation(db):
+            # Уникальный индекс по user_id не даст добавить вторую запись
             cursor = await db.execute(
-                "SELECT referral_id FROM referrals WHERE user_id = ?",
-                (user_id,)
+                "INSERT OR IGNORE INTO referrals (user_id, referrer_id, join_ts) VALUES (?, ?, ?)",
+                (user_id, referrer_id, now_ts())
             )
-            existing = await cursor.fetchone()
-
-            if existing:
+            if cursor.rowcount == 0:
                 return 0  # Пользователь уже является рефералом
+            return cursor.lastrowid
+
+        referral_id = await self._submit(operation)
+        if referral_id:
+            # Триггер изменил счетчик рефералов пригласившего
+            self._user_cache.invalidate(referrer_id)
+        return referral_id
+
+    async def apply_referral(self, user_id: int, referrer_id: int, points: int, free_days: int) -> Optional[Dict[str, Any]]:
+        """
+        Начисление за приглашение одной транзакцией: запись о реферале,
+        баллы пригласившему и бесплатные дни приглашенному
+        :param user_id: ID приглашенного пользователя
+        :param referrer_id: ID пригласившего пользователя
+        :param points: количество баллов для пригласившего
+        :param free_days: количество бесплатных дней для приглашенного
+        :return: Словарь с referral_id, balance и referrals_count пригласившего,
+                 subscription_id и end_ts подписки приглашенного
+                 или None, если реферер не найден или пользователь уже является рефералом
+        """
+        async def operation(db):
+            cursor = await db.execute("SELECT 1 FROM users WHERE user_id = ?", (referrer_id,))
+            if not await cursor.fetchone():
+                return None
 
-            # Добавляем запись о реферале
             cursor = await db.execute(
-                "INSERT INTO referrals (user_id, referrer_id) VALUES (?, ?)",
-                (user_id, referrer_id)
+                "INSERT OR IGNORE INTO referrals (user_id, referrer_id, join_ts) VALUES (?, ?, ?)",
+                (user_id, referrer_id, now_ts())
             )
+            if cursor.rowcount == 0:
+                return None
             referral_id = cursor.lastrowid
-            await db.commit()
-            return referral_id
 
-    async def get_user_referrals(self, user_id: int) -> List[Dict[str, Any]]:
+            # Счетчик рефералов уже увеличен триггером на вставку в referrals
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance, referral_count",
+                (points, referrer_id)
+            )
+            balance, referrals_count = await cursor.fetchone()
+
+            subscription_id, end_ts = await self._extend_subscription(db, user_id, free_days)
+
+            return {
+                "referral_id": referral_id,
+                "balance": balance,
+                "referrals_count": referrals_count,
+                "subscription_id": subscription_id,
+                "end_ts": end_ts,
+            }
+
+        result = await self._submit(operation)
+        if result:
+            self._user_cache.invalidate(referrer_id)
+            self._subscription_cache.invalidate(user_id)
+            self.subscription_index.set(user_id, result["subscription_id"], result["end_ts"])
+        return result
+
+    async def get_user_referrals(self, user_id: int) -> List[Referral]:
         """
         Получение списка рефералов пользователя
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 """
                 SELECT r.*, u.username, u.first_name, u.last_name
                 FROM referrals r
                 JOIN users u ON r.user_id = u.user_id
                 WHERE r.referrer_id = ? AND r.is_active = 1
-                ORDER BY r.join_date DESC
+                ORDER BY r.join_ts DESC
                 """,
                 (user_id,)
             )
 
             referrals = await cursor.fetchall()
-            return [dict(ref) for ref in referrals]
+            return [Referral.from_row(ref) for ref in referrals]
 
-    async def get_user_referrer(self, user_id: int) -> Optional[Dict[str, Any]]:
+    async def get_user_referrer(self, user_id: int) -> Optional[User]:
         """
         Получение информации о пригласившем пользователе
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute(
                 """
                 SELECT u.*
@@ -371,19 +957,507 @@ class Database:
             )
 
             referrer = await cursor.fetchone()
-            return dict(referrer) if referrer else None
+            return User.from_row(referrer) if referrer else None
+
+    async def count_referrals_bulk(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        Подсчет количества рефералов нескольких пользователей
+        :param user_ids: ID пользователей
+        :return: Словарь {user_id: количество рефералов} (0 для неизвестных пользователей)
+        """
+        user_ids = list(user_ids)
+        rows = await self._fetch_bulk(
+            "SELECT user_id, referral_count FROM users WHERE user_id IN ({placeholders})",
+            user_ids
+        )
+        counts = dict.fromkeys(user_ids, 0)
+        counts.update((row['user_id'], row['referral_count']) for row in rows)
+        return counts
 
-    async def count_user_referrals(self, user_id: int) -> int:
+    # Методы для работы со статистикой
+    async def get_stats(self, days: int = 7) -> Dict[str, Any]:
         """
-        Подсчет количества рефералов пользователя
+        Получение общей статистики из агрегированных таблиц
+        Итоги и дневные счетчики поддерживаются триггерами, поэтому запрос читает несколько строк
+        :param days: за сколько последних дней (включая сегодня) считать недавние платежи
+        :return: Словарь с итогами и суммами за период
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        async with self._read(analytics=True) as db:
+            cursor = await db.execute("SELECT * FROM stats_totals WHERE id = 1")
+            totals = await cursor.fetchone()
+            stats = dict(totals) if totals else {
+                "users": 0, "referrals": 0, "payments": 0,
+                "payments_confirmed": 0, "revenue": 0, "active_subscriptions": 0,
+            }
+            stats.pop("id", None)
+
+            # Счетчик триггеров учитывает все строки со статусом active; активной, как и раньше,
+            # считается только неистекшая подписка - вычитаем истекшие, но еще не деактивированные
+            # (поиск по индексу статуса и времени окончания, таких подписок - только хвост до проверки)
             cursor = await db.execute(
-                "SELECT COUNT(*) FROM referrals WHERE referrer_id = ? AND is_active = 1",
-                (user_id,)
+                """
+                SELECT (SELECT COUNT(*) FROM subscriptions WHERE status = 'active' AND end_ts <= ?)
+                     + (SELECT COUNT(*) FROM subscriptions WHERE status = 'active' AND end_ts IS NULL)
+                """,
+                (now_ts(),)
             )
-            count = await cursor.fetchone()
-            return count[0] if count else 0
+            stats["active_subscriptions"] -= (await cursor.fetchone())[0]
+
+            cursor = await db.execute(
+                """
+                SELECT COALESCE(SUM(new_users), 0), COALESCE(SUM(payments_created), 0),
+                       COALESCE(SUM(payments_confirmed), 0), COALESCE(SUM(revenue), 0)
+                FROM stats_daily WHERE day >= ?
+                """,
+                (since,)
+            )
+            (stats["recent_users"], stats["recent_payments"],
+             stats["recent_payments_confirmed"], stats["recent_revenue"]) = await cursor.fetchone()
+            return stats
+
+    async def get_daily_stats(self, day: datetime.date) -> Dict[str, Any]:
+        """
+        Получение статистики за один день
+        :param day: дата (локальная)
+        :return: Словарь с дневными счетчиками (нули, если за день ничего не было)
+        """
+        async with self._read(analytics=True) as db:
+            cursor = await db.execute("SELECT * FROM stats_daily WHERE day = ?", (day.isoformat(),))
+            row = await cursor.fetchone()
+            if row:
+                return dict(row)
+            return {
+                "day": day.isoformat(), "new_users": 0, "new_referrals": 0,
+                "payments_created": 0, "payments_confirmed": 0, "revenue": 0,
+            }
+
+    # Методы для архивации
+    async def _archive_batch(self, table: str, where: str, params: Sequence[Any], batch_size: int) -> int:
+        """
+        Перенос одной пачки строк в архивную таблицу (одна транзакция)
+        :param table: название таблицы (ключ ARCHIVE_TABLES)
+        :param where: SQL-условие отбора строк
+        :param params: параметры условия
+        :param batch_size: максимальное количество строк в пачке
+        :return: Количество перенесенных строк
+        """
+        key, columns = ARCHIVE_TABLES[table]
+        column_list = ", ".join(columns)
+        batch_size = min(batch_size, BULK_CHUNK_SIZE)
+
+        async def operation(db):
+            cursor = await db.execute(
+                f"SELECT {key} FROM {table} WHERE {where} LIMIT ?",
+                (*params, batch_size)
+            )
+            ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                return 0
+
+            placeholders = ", ".join("?" * len(ids))
+            await db.execute(
+                f"INSERT OR REPLACE INTO {table}_archive ({column_list}, archived_ts) "
+                f"SELECT {column_list}, ? FROM {table} WHERE {key} IN ({placeholders})",
+                (now_ts(), *ids)
+            )
+            await db.execute(f"DELETE FROM {table} WHERE {key} IN ({placeholders})", ids)
+            return len(ids)
+
+        return await self._submit(operation)
+
+    async def _archive(self, table: str, where: str, params: Sequence[Any], batch_size: int) -> int:
+        """
+        Перенос всех подходящих строк в архив пачками
+        Каждая пачка - отдельная короткая транзакция, между ними выполняются остальные записи
+        :return: Общее количество перенесенных строк
+        """
+        total = 0
+        while True:
+            moved = await self._archive_batch(table, where, params, batch_size)
+            total += moved
+            if moved < min(batch_size, BULK_CHUNK_SIZE):
+                return total
+            await asyncio.sleep(0)
+
+    async def archive_subscriptions(self, batch_size: int = BULK_CHUNK_SIZE) -> int:
+        """
+        Перенос истекших (деактивированных) подписок в архив
+        :param batch_size: размер пачки
+        :return: Количество перенесенных подписок
+        """
+        moved = await self._archive("subscriptions", "status = 'expired'", (), batch_size)
+        if moved:
+            logger.info(f"Перенесено в архив подписок: {moved}")
+        return moved
+
+    async def archive_payments(self, confirmed_days: int, pending_days: int,
+                               batch_size: int = BULK_CHUNK_SIZE) -> int:
+        """
+        Перенос старых подтвержденных и брошенных неоплаченных платежей в архив
+        :param confirmed_days: через сколько дней после создания архивировать подтвержденные платежи
+        :param pending_days: через сколько дней архивировать неподтвержденные платежи
+        :param batch_size: размер пачки
+        :return: Количество перенесенных платежей
+        """
+        now = now_ts()
+        moved = await self._archive(
+            "payments", "status = 'confirmed' AND created_ts < ?",
+            (now - confirmed_days * 86400,), batch_size
+        )
+        moved += await self._archive(
+            "payments", "status = 'pending' AND created_ts < ?",
+            (now - pending_days * 86400,), batch_size
+        )
+        if moved:
+            logger.info(f"Перенесено в архив платежей: {moved}")
+        return moved
+
+    async def get_user_subscriptions(self, user_id: int, include_archive: bool = False,
+                                     limit: int = 10) -> List[Subscription]:
+        """
+        История подписок пользователя (новые первыми)
+        :param user_id: ID пользователя
+        :param include_archive: включить подписки из архива
+        :param limit: максимальное количество подписок
+        :return: Список подписок (у архивных заполнено archived_ts)
+        """
+        columns = ", ".join(ARCHIVE_TABLES["subscriptions"][1])
+        query = f"SELECT {columns}, NULL AS archived_ts FROM subscriptions WHERE user_id = ?"
+        params = [user_id]
+        if include_archive:
+            query += f" UNION ALL SELECT {columns}, archived_ts FROM subscriptions_archive WHERE user_id = ?"
+            params.append(user_id)
+        query += " ORDER BY end_ts DESC LIMIT ?"
+
+        async with self._read() as db:
+            cursor = await db.execute(query, (*params, limit))
+            return [Subscription.from_row(row) for row in await cursor.fetchall()]
+
+    async def get_user_payments(self, user_id: int, include_archive: bool = False,
+                                limit: int = 10) -> List[Payment]:
+        """
+        История платежей пользователя (новые первыми)
+        :param user_id: ID пользователя
+        :param include_archive: включить платежи из архива
+        :param limit: максимальное количество платежей
+        :return: Список платежей (у архивных заполнено archived_ts)
+        """
+        columns = ", ".join(ARCHIVE_TABLES["payments"][1])
+        query = f"SELECT {columns}, NULL AS archived_ts FROM payments WHERE user_id = ?"
+        params = [user_id]
+        if include_archive:
+            query += f" UNION ALL SELECT {columns}, archived_ts FROM payments_archive WHERE user_id = ?"
+            params.append(user_id)
+        query += " ORDER BY created_ts DESC LIMIT ?"
+
+        async with self._read() as db:
+            cursor = await db.execute(query, (*params, limit))
+            return [Payment.from_row(row) for row in await cursor.fetchall()]
+
+    # Методы для работы с рассылками
+    async def create_broadcast(self, created_by: int, message_type: str, text: Optional[str], file_id: Optional[str],
+                               total: int, status_chat_id: Optional[int] = None,
+                               status_message_id: Optional[int] = None, segment: Optional[Segment] = None) -> int:
+        """
+        Создание рассылки в статусе running
+        :param created_by: ID администратора
+        :param message_type: тип сообщения (text, photo, video, document)
+        :param text: текст или подпись
+        :param file_id: ID файла в Telegram (для фото, видео и документов)
+        :param total: ожидаемое количество получателей
+        :param status_chat_id: чат сообщения с ходом рассылки
+        :param status_message_id: ID сообщения с ходом рассылки
+        :param segment: сегмент получателей (None - все пользователи)
+        :return: ID рассылки
+        """
+        segment_json = segment.to_json() if segment is not None and not segment.is_empty else None
+
+        async def operation(db):
+            now = now_ts()
+            cursor = await db.execute(
+                """
+                INSERT INTO broadcasts (created_by, created_ts, message_type, text, file_id, segment, status, total,
+                                        status_chat_id, status_message_id, started_ts)
+                VALUES (?, ?, ?, ?, ?, ?, 'running', ?, ?, ?, ?)
+                """,
+                (created_by, now, message_type, text, file_id, segment_json, total,
+                 status_chat_id, status_message_id, now)
+            )
+            return cursor.lastrowid
+
+        return await self._submit(operation)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Получение рассылки
+        """
+        async with self._read() as db:
+            cursor = await db.execute("SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+            row = await cursor.fetchone()
+            return Broadcast.from_row(row) if row else None
+
+    async def get_broadcasts(self, statuses: Optional[Iterable[str]] = None, limit: int = 10) -> List[Broadcast]:
+        """
+        Последние рассылки (новые первыми)
+        :param statuses: только рассылки с этими статусами
+        :param limit: максимальное количество рассылок
+        :return: Список рассылок
+        """
+        # Условие по первичному ключу: обход с конца по rowid вместо полного просмотра таблицы
+        query = "SELECT * FROM broadcasts WHERE broadcast_id > 0"
+        params: List[Any] = []
+        if statuses is not None:
+            statuses = list(statuses)
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        query += " ORDER BY broadcast_id DESC LIMIT ?"
+
+        async with self._read() as db:
+            cursor = await db.execute(query, (*params, limit))
+            return [Broadcast.from_row(row) for row in await cursor.fetchall()]
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str) -> bool:
+        """
+        Изменение статуса рассылки
+        :param broadcast_id: ID рассылки
+        :param status: running, paused, cancelled или completed
+        :return: True, если рассылка найдена
+        """
+        async def operation(db):
+            now = now_ts()
+            finished_ts = now if status in ("cancelled", "completed") else None
+            cursor = await db.execute(
+                """
+                UPDATE broadcasts SET status = ?, started_ts = COALESCE(started_ts, ?), finished_ts = ?
+                WHERE broadcast_id = ?
+                """,
+                (status, now, finished_ts, broadcast_id)
+            )
+            return cursor.rowcount > 0
+
+        return await self._submit(operation)
+
+    async def reset_broadcast_recipients(self, broadcast_id: int) -> Dict[str, int]:
+        """
+        Подготовка рассылки к продолжению после паузы или перезапуска
+        Получатели, взятые в работу, возвращаются в очередь; получатели, отправка которым прервалась,
+        считаются неудачными - неизвестно, дошло ли сообщение, а повторная отправка хуже пропуска
+        :param broadcast_id: ID рассылки
+        :return: Словарь {"requeued": количество, "interrupted": количество}
+        """
+        async def operation(db):
+            now = now_ts()
+            cursor = await db.execute(
+                "UPDATE broadcast_recipients SET status = 'pending', updated_ts = ? WHERE broadcast_id = ? AND status = 'queued'",
+                (now, broadcast_id)
+            )
+            requeued = cursor.rowcount
+            cursor = await db.execute(
+                """
+                UPDATE broadcast_recipients SET status = 'failed', error = 'interrupted', updated_ts = ?
+                WHERE broadcast_id = ? AND status = 'sending'
+                """,
+                (now, broadcast_id)
+            )
+            interrupted = cursor.rowcount
+            if interrupted:
+                await db.execute(
+                    "UPDATE broadcasts SET failed = failed + ? WHERE broadcast_id = ?",
+                    (interrupted, broadcast_id)
+                )
+            return {"requeued": requeued, "interrupted": interrupted}
+
+        return await self._submit(operation)
+
+    async def claim_broadcast_recipients(self, broadcast_id: int, limit: int) -> List[int]:
+        """
+        Взятие в работу следующих получателей рассылки
+        Сначала берутся получатели, возвращенные в очередь, затем новые пользователи сегмента
+        после курсора (по первичному ключу users), курсор сдвигается в той же транзакции
+        :param broadcast_id: ID рассылки
+        :param limit: максимальное количество получателей
+        :return: ID пользователей
+        """
+        async def operation(db):
+            now = now_ts()
+            cursor = await db.execute(
+                """
+                UPDATE broadcast_recipients SET status = 'queued', updated_ts = ?
+                WHERE broadcast_id = ? AND user_id IN (
+                    SELECT user_id FROM broadcast_recipients
+                    WHERE broadcast_id = ? AND status = 'pending'
+                    ORDER BY user_id LIMIT ?
+                )
+                RETURNING user_id
+                """,
+                (now, broadcast_id, broadcast_id, limit)
+            )
+            user_ids = [row[0] for row in await cursor.fetchall()]
+            if len(user_ids) >= limit:
+                return sorted(user_ids)
+
+            cursor = await db.execute(
+                "SELECT cursor_user_id, segment FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return sorted(user_ids)
+            last_id = row[0] if row[0] is not None else -2 ** 63
+            where, params = Segment.from_json(row[1]).to_sql(now)
+
+            cursor = await db.execute(
+                f"""
+                INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id, status, updated_ts)
+                SELECT ?, user_id, 'queued', ? FROM users WHERE user_id > ? {f"AND ({where})" if where else ""}
+                ORDER BY user_id LIMIT ?
+                RETURNING user_id
+                """,
+                (broadcast_id, now, last_id, *params, limit - len(user_ids))
+            )
+            new_ids = [row[0] for row in await cursor.fetchall()]
+            if new_ids:
+                await db.execute(
+                    "UPDATE broadcasts SET cursor_user_id = ? WHERE broadcast_id = ?",
+                    (max(new_ids), broadcast_id)
+                )
+            return sorted(user_ids + new_ids)
+
+        return await self._submit(operation)
+
+    async def mark_broadcast_sending(self, broadcast_id: int, user_id: int):
+        """
+        Отметка получателя перед отправкой сообщения
+        """
+        async def operation(db):
+            await db.execute(
+                "UPDATE broadcast_recipients SET status = 'sending', updated_ts = ? WHERE broadcast_id = ? AND user_id = ?",
+                (now_ts(), broadcast_id, user_id)
+            )
+
+        await self._submit(operation)
+
+    async def finish_broadcast_recipient(self, broadcast_id: int, user_id: int, sent: bool,
+                                         error: Optional[str] = None):
+        """
+        Сохранение результата отправки получателю и счетчиков рассылки
+        :param broadcast_id: ID рассылки
+        :param user_id: ID пользователя
+        :param sent: сообщение доставлено
+        :param error: текст ошибки
+        """
+        status = "sent" if sent else "failed"
+
+        async def operation(db):
+            cursor = await db.execute(
+                """
+                UPDATE broadcast_recipients SET status = ?, error = ?, updated_ts = ?
+                WHERE broadcast_id = ? AND user_id = ? AND status NOT IN ('sent', 'failed')
+                """,
+                (status, error, now_ts(), broadcast_id, user_id)
+            )
+            if cursor.rowcount:
+                await db.execute(
+                    f"UPDATE broadcasts SET {status} = {status} + 1 WHERE broadcast_id = ?",
+                    (broadcast_id,)
+                )
+
+        await self._submit(operation)
+
+    # Методы для работы с недоставленными сообщениями
+    async def add_dead_letter(self, campaign: str, chat_id: Optional[int], method: str, payload: str,
+                              error: Optional[str]) -> int:
+        """
+        Сохранение недоставленного сообщения для повторной отправки
+        :param campaign: кампания (broadcast:ID, referral_reminder, ...)
+        :param chat_id: ID чата
+        :param method: название метода Bot API (SendMessage, SendPhoto, ...)
+        :param payload: параметры метода в JSON
+        :param error: текст ошибки
+        :return: ID записи
+        """
+        async def operation(db):
+            now = now_ts()
+            cursor = await db.execute(
+                """
+                INSERT INTO dead_letters (created_ts, campaign, chat_id, method, payload, error, updated_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (now, campaign, chat_id, method, payload, error, now)
+            )
+            return cursor.lastrowid
+
+        return await self._submit(operation)
+
+    async def get_dead_letters(self, campaign: Optional[str] = None, limit: int = 100) -> List[DeadLetter]:
+        """
+        Недоставленные сообщения, ожидающие повторной отправки
+        :param campaign: только сообщения этой кампании
+        :param limit: максимальное количество
+        :return: Список сообщений (старые первыми)
+        """
+        query = "SELECT * FROM dead_letters WHERE status = 'pending'"
+        params: List[Any] = []
+        if campaign is not None:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        query += " ORDER BY dead_letter_id LIMIT ?"
+
+        async with self._read() as db:
+            cursor = await db.execute(query, (*params, limit))
+            return [DeadLetter.from_row(row) for row in await cursor.fetchall()]
+
+    async def count_dead_letters(self) -> Dict[str, int]:
+        """
+        Количество ожидающих повторной отправки сообщений по кампаниям
+        """
+        async with self._read() as db:
+            cursor = await db.execute(
+                "SELECT campaign, COUNT(*) FROM dead_letters WHERE status = 'pending' GROUP BY campaign"
+            )
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def resolve_dead_letter(self, dead_letter_id: int, delivered: bool, error: Optional[str] = None):
+        """
+        Сохранение результата повторной отправки
+        :param dead_letter_id: ID записи
+        :param delivered: сообщение доставлено
+        :param error: текст ошибки, если не доставлено
+        """
+        async def operation(db):
+            if delivered:
+                cursor = await db.execute(
+                    """
+                    UPDATE dead_letters SET status = 'redriven', updated_ts = ?
+                    WHERE dead_letter_id = ? AND status = 'pending'
+                    RETURNING campaign, chat_id
+                    """,
+                    (now_ts(), dead_letter_id)
+                )
+                row = await cursor.fetchone()
+                broadcast_id = broadcast_campaign_id(row[0]) if row else None
+                if broadcast_id is None:
+                    return
+                # Получатель рассылки теперь получил сообщение: ошибка становится доставкой
+                cursor = await db.execute(
+                    """
+                    UPDATE broadcast_recipients SET status = 'sent', error = NULL, updated_ts = ?
+                    WHERE broadcast_id = ? AND user_id = ? AND status = 'failed'
+                    """,
+                    (now_ts(), broadcast_id, row[1])
+                )
+                if cursor.rowcount:
+                    await db.execute(
+                        "UPDATE broadcasts SET sent = sent + 1, failed = failed - 1 WHERE broadcast_id = ?",
+                        (broadcast_id,)
+                    )
+            else:
+                await db.execute(
+                    "UPDATE dead_letters SET attempts = attempts + 1, error = ?, updated_ts = ? WHERE dead_letter_id = ?",
+                    (error, now_ts(), dead_letter_id)
+                )
+
+        await self._submit(operation)
 
     # Методы для работы с мероприятиями
     async def add_event(self, name: str, description: str, event_date: datetime.datetime, price: int,
@@ -391,21 +1465,21 @@ class Database:
         """
         Добавление нового мероприятия
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async def operation(db):
             cursor = await db.execute(
                 "INSERT INTO events (name, description, event_date, price, max_participants) VALUES (?, ?, ?, ?, ?)",
                 (name, description, event_date.isoformat(), price, max_participants)
             )
             event_id = cursor.lastrowid
-            await db.commit()
             return event_id
 
+        return await self._submit(operation)
+
     async def get_event(self, event_id: int) -> Optional[Dict[str, Any]]:
         """
         Получение информации о мероприятии
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = sqlite3.Row
+        async with self._read() as db:
             cursor = await db.execute("SELECT * FROM events WHERE event_id = ?", (event_id,))
             event = await cursor.fetchone()
 
@@ -417,20 +1491,12 @@ class Database:
         """
         Регистрация пользователя на мероприятие
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async def operation(db):
             cursor = await db.execute(
                 "INSERT INTO event_registrations (event_id, user_id, payment_id) VALUES (?, ?, ?)",
                 (event_id, user_id, payment_id)
             )
             registration_id = cursor.lastrowid
-            await db.commit()
             return registration_id
 
-    async def get_conn(self):
-        """
-        Получение соединения с базой данных для выполнения прямых SQL-запросов
-        :return: Объект соединения с базой данных
-        """
-        conn = await aiosqlite.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
\ No newline at end of file
+        return await self._submit(operation)
@@ -0,0 +1,146 @@
+"""
+Доставка сообщений бота клуба X10 для рассылок и кампаний планировщика.
+Повторы после 429 и сетевых ошибок выполняет планировщик исходящих сообщений (outbound),
+поэтому ошибка, дошедшая сюда, окончательная: сообщение сохраняется в таблицу
+недоставленных (dead_letters) и может быть отправлено повторно командой администратора.
+Если пользователь заблокировал бота или чат не найден, пользователь отмечается недоступным
+(users.reachable = 0) и больше не попадает в сегменты рассылок; такое сообщение не сохраняется.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional
+
+import aiogram.methods
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import TelegramMethod, SendMessage
+
+from repository import Repository
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryResult:
+    """Результат доставки (истинен, если сообщение доставлено)"""
+    __slots__ = ("ok", "error", "unreachable")
+
+    def __init__(self, ok: bool, error: Optional[str] = None, unreachable: bool = False):
+        self.ok = ok
+        self.error = error
+        # Пользователь заблокировал бота или чат не найден
+        self.unreachable = unreachable
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+
+def dump_method(method: TelegramMethod) -> str:
+    """
+    Параметры метода Bot API в JSON (значения по умолчанию бота не сохраняются)
+    """
+    defaults = {name for name, value in method if isinstance(value, Default)}
+    return json.dumps(method.model_dump(mode="json", exclude_none=True, exclude=defaults), ensure_ascii=False)
+
+
+def is_unreachable_error(error: TelegramAPIError) -> bool:
+    """
+    Ошибка означает, что писать в чат бесполезно: бот заблокирован, пользователь удален или чат не найден
+    """
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+
+
+def load_method(name: str, payload: str) -> TelegramMethod:
+    """
+    Метод Bot API из названия и параметров в JSON
+    """
+    method_class = getattr(aiogram.methods, name, None)
+    if method_class is None or not isinstance(method_class, type) or not issubclass(method_class, TelegramMethod):
+        raise ValueError(f"Неизвестный метод Bot API: {name}")
+    return method_class(**json.loads(payload))
+
+
+class Delivery:
+    def __init__(self, bot: Bot, db: Repository):
+        """
+        Инициализация доставки сообщений
+        :param bot: объект бота
+        :param db: хранилище данных (для недоставленных сообщений)
+        """
+        self.bot = bot
+        self.db = db
+
+    async def send(self, method: TelegramMethod, campaign: str) -> DeliveryResult:
+        """
+        Отправка сообщения; при окончательной ошибке сообщение сохраняется как недоставленное
+        :param method: метод Bot API (SendMessage, SendPhoto, ...)
+        :param campaign: кампания (broadcast:ID, referral_reminder, ...)
+        :return: Результат доставки
+        """
+        chat_id = getattr(method, "chat_id", None)
+        try:
+            await self.bot(method)
+        except TelegramAPIError as e:
+            error = f"{type(e).__name__}: {e.message}"
+            if isinstance(chat_id, int) and chat_id > 0 and is_unreachable_error(e):
+                logger.info(f"Пользователь {chat_id} недоступен ({campaign}): {error}")
+                await self._mark_unreachable(chat_id)
+                return DeliveryResult(False, error, unreachable=True)
+
+            logger.error(f"Сообщение ({campaign}) не доставлено в чат {chat_id}: {error}")
+            try:
+                await self.db.add_dead_letter(campaign, chat_id, type(method).__name__, dump_method(method), error)
+            except Exception as db_error:
+                logger.error(f"Ошибка при сохранении недоставленного сообщения ({campaign}): {db_error}")
+            return DeliveryResult(False, error)
+        return DeliveryResult(True)
+
+    async def _mark_unreachable(self, user_id: int):
+        """
+        Отметка пользователя недоступным (ошибка записи не прерывает отправку остальным)
+        """
+        try:
+            await self.db.set_user_reachable(user_id, False)
+        except Exception as e:
+            logger.error(f"Ошибка при отметке пользователя {user_id} недоступным: {e}")
+
+    async def send_message(self, chat_id: int, text: str, campaign: str, **kwargs: Any) -> DeliveryResult:
+        """
+        Отправка текстового сообщения
+        :param chat_id: ID чата
+        :param text: текст
+        :param campaign: кампания
+        :param kwargs: остальные параметры SendMessage (reply_markup, ...)
+        :return: Результат доставки
+        """
+        return await self.send(SendMessage(chat_id=chat_id, text=text, **kwargs), campaign)
+
+    async def redrive(self, campaign: Optional[str] = None, limit: int = 100) -> Dict[str, int]:
+        """
+        Повторная отправка недоставленных сообщений
+        :param campaign: только сообщения этой кампании
+        :param limit: максимальное количество сообщений за вызов
+        :return: Словарь {"delivered": количество, "failed": количество}
+        """
+        delivered = failed = 0
+        for letter in await self.db.get_dead_letters(campaign, limit):
+            try:
+                await self.bot(load_method(letter.method, letter.payload))
+            except TelegramAPIError as e:
+                if isinstance(letter.chat_id, int) and letter.chat_id > 0 and is_unreachable_error(e):
+                    await self._mark_unreachable(letter.chat_id)
+                await self.db.resolve_dead_letter(letter.dead_letter_id, False, f"{type(e).__name__}: {e.message}")
+                failed += 1
+                continue
+            except ValueError as e:
+                error = f"{type(e).__name__}: {getattr(e, 'message', e)}"
+                await self.db.resolve_dead_letter(letter.dead_letter_id, False, error)
+                failed += 1
+                continue
+            await self.db.resolve_dead_letter(letter.dead_letter_id, True)
+            delivered += 1
+
+        logger.info(f"Повторная отправка недоставленных сообщений: доставлено {delivered}, ошибок {failed}")
+        return {"delivered": delivered, "failed": failed}
@@ -3,14 +3,23 @@
 """
 import logging
 import asyncio
+import tempfile
+from pathlib import Path
+from typing import Optional
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from repository import Repository
 from config import Config
+from backup import create_backup
+from maintenance import run_maintenance, format_report
+from broadcast import BroadcastEngine, STATUS_NAMES
+from delivery import Delivery
+from segments import SEGMENT_PRESETS
+from outbound import send_priority, PRIORITY_TRANSACTIONAL
 from keyboards import main_menu_kb, club_access_kb
 from utils import get_user_name, get_payment_description
 
@@ -38,7 +47,11 @@ async def cmd_admin(message: Message, config: Config):
         f"/payments_list - список ожидающих платежей\n"
         f"/user_info [ID пользователя] - информация о пользователе\n"
         f"/stats - статистика бота\n"
+        f"/db_queries [scans|reset] - статистика запросов к БД\n"
+        f"/db_maintenance - обслуживание БД (ANALYZE, очистка, обрезка WAL)\n"
         f"/broadcast - отправить сообщение всем пользователям\n"
+        f"/broadcasts - рассылки (пауза, продолжение, отмена)\n"
+        f"/dead_letters [redrive [кампания]] - недоставленные сообщения и повторная отправка\n"
         f"/export_users - выгрузить список пользователей\n"
         f"/base - скачать базу данных"
     )
@@ -47,7 +60,7 @@ async def cmd_admin(message: Message, config: Config):
 
 
 @router.message(Command("confirm_payment"))
-async def cmd_confirm_payment(message: Message, bot: Bot, db: Database, config: Config):
+async def cmd_confirm_payment(message: Message, bot: Bot, db: Repository, config: Config):
     """
     Команда для подтверждения платежа администратором
     Формат: /confirm_payment ID_платежа
@@ -102,15 +115,16 @@ async def cmd_confirm_payment(message: Message, bot: Bot, db: Database, config:
         payment_info = get_payment_description(product_type, config)
         await db.add_subscription(customer_id, payment_info["days"])
 
-        # Отправляем уведомление пользователю
+        # Отправляем уведомление пользователю (вне очереди рассылок)
         try:
-            await bot.send_message(
-                customer_id,
-                "🎉 Поздравляем! Ваш платеж подтвержден.\n\n"
-                "Доступ к клубу X10 активирован.\n\n"
-                "Теперь вы можете присоединиться к клубу, нажав на кнопку ниже:",
-                reply_markup=club_access_kb()
-            )
+            with send_priority(PRIORITY_TRANSACTIONAL):
+                await bot.send_message(
+                    customer_id,
+                    "🎉 Поздравляем! Ваш платеж подтвержден.\n\n"
+                    "Доступ к клубу X10 активирован.\n\n"
+                    "Теперь вы можете присоединиться к клубу, нажав на кнопку ниже:",
+                    reply_markup=club_access_kb()
+                )
             confirm_status = "✅ Уведомление отправлено пользователю"
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {customer_id}: {e}")
@@ -119,23 +133,26 @@ async def cmd_confirm_payment(message: Message, bot: Bot, db: Database, config:
     else:
         # Для других продуктов (мероприятия)
         try:
-            await bot.send_message(
-                customer_id,
-                f"🎉 Поздравляем! Ваш платеж за {product_type} подтвержден.\n\n"
-                f"Наш менеджер свяжется с вами для предоставления дополнительной информации."
-            )
+            with send_priority(PRIORITY_TRANSACTIONAL):
+                await bot.send_message(
+                    customer_id,
+                    f"🎉 Поздравляем! Ваш платеж за {product_type} подтвержден.\n\n"
+                    f"Наш менеджер свяжется с вами для предоставления дополнительной информации."
+                )
             confirm_status = "✅ Уведомление отправлено пользователю"
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {customer_id}: {e}")
             confirm_status = f"⚠️ Ошибка при отправке уведомления: {e}"
 
     # Уведомление администратору
+    tx_id_line = f"🔗 TxID: {payment.get('tx_id')}\n" if payment.get('tx_id') else ""
     admin_confirm_text = (
         f"✅ Платеж с ID {payment_id} успешно подтвержден\n\n"
         f"👤 Пользователь: {user_name} (ID: {customer_id})\n"
         f"🛒 Продукт: {product_type}\n"
         f"💰 Сумма: {amount} рублей\n"
-        f"💳 Способ оплаты: {payment_method}\n\n"
+        f"💳 Способ оплаты: {payment_method}\n"
+        f"{tx_id_line}\n"
         f"{confirm_status}"
     )
 
@@ -146,7 +163,7 @@ async def cmd_confirm_payment(message: Message, bot: Bot, db: Database, config:
 
 
 @router.message(Command("payments_list"))
-async def cmd_payments_list(message: Message, db: Database, config: Config):
+async def cmd_payments_list(message: Message, db: Repository, config: Config):
     """
     Команда для вывода списка ожидающих платежей
     """
@@ -158,18 +175,7 @@ async def cmd_payments_list(message: Message, db: Database, config: Config):
         return
 
     # Получаем список ожидающих платежей из базы данных
-    async with db.get_conn() as conn:
-        cursor = await conn.execute(
-            """
-            SELECT p.payment_id, p.user_id, u.username, u.first_name, p.product_type, p.amount, p.payment_method, p.created_at
-            FROM payments p
-            LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.status = 'pending'
-            ORDER BY p.created_at DESC
-            LIMIT 15
-            """
-        )
-        payments = await cursor.fetchall()
+    payments = await db.get_pending_payments(limit=15)
 
     if not payments:
         await message.answer("📝 Нет ожидающих платежей")
@@ -186,6 +192,7 @@ async def cmd_payments_list(message: Message, db: Database, config: Config):
         amount = payment['amount']
         payment_method = payment['payment_method']
         created_at = payment['created_at']
+        tx_id_line = f"🔗 TxID: {payment['tx_id']}\n" if payment['tx_id'] else ""
 
         payments_text += (
             f"ID платежа: {payment_id}\n"
@@ -193,6 +200,7 @@ async def cmd_payments_list(message: Message, db: Database, config: Config):
             f"🛒 Продукт: {product_type}\n"
             f"💰 Сумма: {amount} рублей\n"
             f"💳 Метод: {payment_method}\n"
+            f"{tx_id_line}"
             f"📅 Создан: {created_at}\n"
             f"✅ Для подтверждения: /confirm_payment {payment_id}\n\n"
         )
@@ -201,10 +209,11 @@ async def cmd_payments_list(message: Message, db: Database, config: Config):
 
 
 @router.message(Command("user_info"))
-async def cmd_user_info(message: Message, db: Database, config: Config):
+async def cmd_user_info(message: Message, db: Repository, config: Config):
     """
     Команда для получения информации о пользователе
-    Формат: /user_info ID_пользователя
+    Формат: /user_info ID_пользователя [all]
+    С параметром all выводится история подписок и платежей, включая архив
     """
     admin_id = message.from_user.id
 
@@ -215,9 +224,10 @@ async def cmd_user_info(message: Message, db: Database, config: Config):
 
     # Получаем ID пользователя из аргументов команды
     args = message.text.split()
-    if len(args) != 2:
-        await message.answer("Неверный формат команды. Используйте: /user_info ID_пользователя")
+    if len(args) not in (2, 3) or (len(args) == 3 and args[2].lower() != "all"):
+        await message.answer("Неверный формат команды. Используйте: /user_info ID_пользователя [all]")
         return
+    show_history = len(args) == 3
 
     try:
         user_id = int(args[1])
@@ -272,11 +282,33 @@ async def cmd_user_info(message: Message, db: Database, config: Config):
         referrer_username = referrer.get('username') or referrer.get('first_name') or f"ID: {referrer.get('user_id')}"
         user_info_text += f"🔗 Приглашен пользователем: {referrer_username}\n"
 
+    # Добавляем историю подписок и платежей вместе с архивом
+    if show_history:
+        subscriptions = await db.get_user_subscriptions(user_id, include_archive=True)
+        payments = await db.get_user_payments(user_id, include_archive=True)
+
+        user_info_text += "\n🗂 История подписок:\n"
+        for sub in subscriptions:
+            archived = " (архив)" if sub['archived_ts'] else ""
+            user_info_text += f"#{sub['subscription_id']}: {sub['status']}, до {sub['end_date']}{archived}\n"
+        if not subscriptions:
+            user_info_text += "Нет\n"
+
+        user_info_text += "\n💳 История платежей:\n"
+        for payment in payments:
+            archived = " (архив)" if payment['archived_ts'] else ""
+            user_info_text += (
+                f"#{payment['payment_id']}: {payment['product_type']}, {payment['amount']} руб., "
+                f"{payment['status']}, {payment['created_at']}{archived}\n"
+            )
+        if not payments:
+            user_info_text += "Нет\n"
+
     await message.answer(user_info_text)
 
 
 @router.message(Command("stats"))
-async def cmd_stats(message: Message, db: Database, config: Config):
+async def cmd_stats(message: Message, db: Repository, config: Config):
     """
     Команда для вывода статистики бота
     """
@@ -287,50 +319,112 @@ async def cmd_stats(message: Message, db: Database, config: Config):
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
 
-    # Получаем статистику из базы данных
-    async with db.get_conn() as conn:
-        # Общее количество пользователей
-        cursor = await conn.execute("SELECT COUNT(*) FROM users")
-        total_users = (await cursor.fetchone())[0]
+    # Получаем статистику из агрегированных таблиц базы данных
+    stats = await db.get_stats(days=7)
+    unreachable = await db.count_unreachable_users()
 
-        # Количество пользователей с активной подпиской
-        cursor = await conn.execute(
-            "SELECT COUNT(*) FROM subscriptions WHERE status = 'active' AND end_date > datetime('now')"
+    # Формируем сообщение со статистикой
+    stats_text = (
+        f"📊 Статистика бота клуба X10:\n\n"
+        f"👥 Всего пользователей: {stats['users']}\n"
+        f"🚫 Заблокировали бота: {unreachable}\n"
+        f"🔑 Активных подписок: {stats['active_subscriptions']}\n"
+        f"💰 Всего платежей: {stats['payments']}\n"
+        f"💵 Общий доход: {stats['revenue']} руб.\n"
+        f"📈 Платежей за 7 дней: {stats['recent_payments']}\n"
+        f"🔗 Всего рефералов: {stats['referrals']}\n"
+    )
+
+    # Добавляем статистику кэша базы данных
+    stats_text += "\n🗄 Кэш БД:\n"
+    for cache in db.cache_stats():
+        stats_text += (
+            f"{cache['name']}: попаданий {cache['hits'] + cache['coalesced']}, "
+            f"промахов {cache['misses']} ({int(cache['hit_rate'] * 100)}%)\n"
         )
-        active_subscriptions = (await cursor.fetchone())[0]
 
-        # Количество платежей
-        cursor = await conn.execute("SELECT COUNT(*) FROM payments")
-        total_payments = (await cursor.fetchone())[0]
+    await message.answer(stats_text)
 
-        # Сумма подтвержденных платежей
-        cursor = await conn.execute(
-            "SELECT SUM(amount) FROM payments WHERE status = 'confirmed'"
-        )
-        total_revenue = (await cursor.fetchone())[0] or 0
 
-        # Платежи за последние 7 дней
-        cursor = await conn.execute(
-            "SELECT COUNT(*) FROM payments WHERE created_at > datetime('now', '-7 days')"
+@router.message(Command("db_queries"))
+async def cmd_db_queries(message: Message, db: Repository, config: Config):
+    """
+    Команда для вывода статистики запросов к базе данных
+    Формат: /db_queries [scans|reset]
+    Без параметров - самые долгие по суммарному времени запросы,
+    scans - запросы с полным просмотром таблиц, reset - сброс статистики
+    """
+    user_id = message.from_user.id
+
+    # Проверяем, является ли пользователь администратором
+    if user_id not in config.bot.admin_ids:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    args = message.text.split()
+    mode = args[1].lower() if len(args) > 1 else ""
+
+    if mode == "reset":
+        db.query_stats.reset()
+        await message.answer("Статистика запросов сброшена")
+        return
+
+    if mode == "scans":
+        queries = db.query_stats.full_scans()
+        title = "🐢 Запросы с полным просмотром таблиц:"
+    else:
+        queries = db.query_stats.top(limit=10)
+        title = "⏱ Самые долгие запросы (по суммарному времени):"
+
+    if not queries:
+        await message.answer("Нет данных о запросах")
+        return
+
+    text = f"{title}\n\n"
+    for i, query in enumerate(queries, 1):
+        # Длинные запросы укорачиваем, чтобы сообщение поместилось в лимит Telegram
+        sql = query['fingerprint']
+        if len(sql) > 200:
+            sql = sql[:200] + "…"
+        text += (
+            f"{i}. {sql}\n"
+            f"Выполнений: {query['count']}, всего {query['total_ms']:.0f} мс, "
+            f"сред. {query['avg_ms']:.1f} мс, p95 ≤ {query['p95_ms']:.0f} мс, макс. {query['max_ms']:.0f} мс, "
+            f"медленных: {query['slow']}\n"
         )
-        recent_payments = (await cursor.fetchone())[0]
+        if query['full_scan']:
+            text += f"⚠️ План: {'; '.join(query['plan'])}\n"
+        text += "\n"
 
-        # Количество рефералов
-        cursor = await conn.execute("SELECT COUNT(*) FROM referrals")
-        total_referrals = (await cursor.fetchone())[0]
+    await message.answer(text[:4096])
 
-    # Формируем сообщение со статистикой
-    stats_text = (
-        f"📊 Статистика бота клуба X10:\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"🔑 Активных подписок: {active_subscriptions}\n"
-        f"💰 Всего платежей: {total_payments}\n"
-        f"💵 Общий доход: {total_revenue} руб.\n"
-        f"📈 Платежей за 7 дней: {recent_payments}\n"
-        f"🔗 Всего рефералов: {total_referrals}\n"
-    )
 
-    await message.answer(stats_text)
+@router.message(Command("db_maintenance"))
+async def cmd_db_maintenance(message: Message, db: Repository, config: Config):
+    """
+    Команда для запуска обслуживания базы данных вне расписания
+    """
+    user_id = message.from_user.id
+
+    # Проверяем, является ли пользователь администратором
+    if user_id not in config.bot.admin_ids:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    if not db.db_path:
+        await message.answer("Обслуживание недоступно: данные хранятся не в файле базы данных.")
+        return
+
+    status_message = await message.answer("Выполняем обслуживание базы данных... ⏳")
+
+    try:
+        report = await run_maintenance(db.db_path, config.maintenance)
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании базы данных: {e}")
+        await status_message.edit_text(f"❌ Ошибка при обслуживании базы данных: {e}")
+        return
+
+    await status_message.edit_text(f"🧹 Обслуживание базы данных выполнено\n\n{format_report(report)}")
 
 
 # Импортируем необходимые модули для работы с пользователями
@@ -338,6 +432,7 @@ async def cmd_stats(message: Message, db: Database, config: Config):
 class BroadcastStates(StatesGroup):
     """Состояния для рассылки"""
     waiting_for_message = State()  # Ожидание сообщения для рассылки
+    choosing_segment = State()  # Выбор аудитории рассылки
     confirmation = State()  # Подтверждение рассылки
 
 
@@ -349,7 +444,7 @@ from datetime import datetime
 
 
 @router.message(Command("export_users"))
-async def cmd_export_users(message: Message, db: Database, config: Config):
+async def cmd_export_users(message: Message, db: Repository, config: Config):
     """
     Команда для экспорта списка пользователей в CSV-файл
     """
@@ -360,43 +455,33 @@ async def cmd_export_users(message: Message, db: Database, config: Config):
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
 
-    # Получаем всех пользователей из базы данных
-    async with db.get_conn() as conn:
-        cursor = await conn.execute(
-            """
-            SELECT u.user_id, u.username, u.first_name, u.last_name, u.registration_date, u.balance,
-                   (SELECT COUNT(*) FROM referrals r WHERE r.referrer_id = u.user_id) as referrals_count,
-                   (CASE WHEN EXISTS (
-                       SELECT 1 FROM subscriptions s 
-                       WHERE s.user_id = u.user_id AND s.status = 'active' AND s.end_date > datetime('now')
-                   ) THEN 'Активна' ELSE 'Неактивна' END) as subscription_status
-            FROM users u
-            ORDER BY u.registration_date DESC
-            """
-        )
-        users = await cursor.fetchall()
-
-    if not users:
-        await message.answer("Нет пользователей для экспорта.")
-        return
-
     # Создаем CSV в памяти
     output = io.StringIO()
     fieldnames = ['ID', 'Username', 'Имя', 'Фамилия', 'Дата регистрации', 'Баланс', 'Рефералы', 'Статус подписки']
     writer = csv.DictWriter(output, fieldnames=fieldnames)
     writer.writeheader()
 
-    for user in users:
-        writer.writerow({
-            'ID': user['user_id'],
-            'Username': user['username'] or 'Нет',
-            'Имя': user['first_name'] or 'Нет',
-            'Фамилия': user['last_name'] or 'Нет',
-            'Дата регистрации': user['registration_date'] or 'Неизвестно',
-            'Баланс': user['balance'] or 0,
-            'Рефералы': user['referrals_count'],
-            'Статус подписки': user['subscription_status']
-        })
+    # Обходим пользователей постранично, подписки для каждой страницы получаем одним запросом
+    exported = 0
+    async for users in db.iter_user_pages(analytics=True):
+        subscriptions = await db.get_active_subscriptions_bulk((user['user_id'] for user in users), analytics=True)
+
+        for user in users:
+            writer.writerow({
+                'ID': user['user_id'],
+                'Username': user['username'] or 'Нет',
+                'Имя': user['first_name'] or 'Нет',
+                'Фамилия': user['last_name'] or 'Нет',
+                'Дата регистрации': user['registration_date'] or 'Неизвестно',
+                'Баланс': user['balance'] or 0,
+                'Рефералы': user['referral_count'],
+                'Статус подписки': 'Активна' if user['user_id'] in subscriptions else 'Неактивна'
+            })
+        exported += len(users)
+
+    if not exported:
+        await message.answer("Нет пользователей для экспорта.")
+        return
 
     # Готовим CSV-файл для отправки
     csv_bytes = output.getvalue().encode('utf-8-sig')  # UTF-8 с BOM для корректного отображения кириллицы в Excel
@@ -407,7 +492,7 @@ async def cmd_export_users(message: Message, db: Database, config: Config):
     input_file = BufferedInputFile(csv_bytes, filename=file_name)
     await message.answer_document(
         document=input_file,
-        caption=f"📊 Экспорт пользователей ({len(users)})"
+        caption=f"📊 Экспорт пользователей ({exported})"
     )
 
 
@@ -428,7 +513,7 @@ async def cmd_broadcast(message: Message, state: FSMContext, config: Config):
 
     await message.answer(
         "📣 Режим рассылки\n\n"
-        "Отправьте сообщение, которое нужно разослать всем пользователям.\n\n"
+        "Отправьте сообщение для рассылки, аудиторию вы выберете на следующем шаге.\n\n"
         "Поддерживаемые форматы:\n"
         "- Текст\n"
         "- Фото с подписью\n"
@@ -472,30 +557,62 @@ async def process_broadcast_message(message: Message, state: FSMContext):
         document_id=message.document.file_id if message.document else None
     )
 
-    # Переходим в состояние подтверждения
-    await state.set_state(BroadcastStates.confirmation)
+    # Переходим к выбору аудитории
+    await state.set_state(BroadcastStates.choosing_segment)
 
-    # Формируем сообщение для подтверждения
-    content_type = (
-        "Текст" if message.text else
-        "Фото с подписью" if message.photo else
-        "Видео с подписью" if message.video else
-        "Документ с подписью" if message.document else "Неизвестный контент"
+    keyboard = [
+        [InlineKeyboardButton(text=title, callback_data=f"broadcast_segment:{key}")]
+        for key, (title, _) in SEGMENT_PRESETS.items()
+    ]
+    keyboard.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast")])
+    await message.answer(
+        "👥 Кому отправить рассылку?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
     )
 
-    await message.answer(
+
+@router.callback_query(F.data.startswith("broadcast_segment:"), BroadcastStates.choosing_segment)
+async def callback_broadcast_segment(callback: CallbackQuery, state: FSMContext, db: Repository):
+    """
+    Выбор аудитории рассылки и подтверждение с количеством получателей
+    """
+    key = callback.data.split(":", 1)[1]
+    if key not in SEGMENT_PRESETS:
+        await callback.answer("Неизвестная аудитория", show_alert=True)
+        return
+    title, segment = SEGMENT_PRESETS[key]
+
+    # Количество получателей считается одним запросом по тем же условиям, что и отбор при рассылке
+    recipients = await db.count_users(segment)
+
+    await state.update_data(segment=key)
+    await state.set_state(BroadcastStates.confirmation)
+
+    data = await state.get_data()
+    content_type = {
+        "text": "Текст",
+        "photo": "Фото с подписью",
+        "video": "Видео с подписью",
+        "document": "Документ с подписью",
+    }.get(data.get("message_type"), "Неизвестный контент")
+
+    await callback.message.edit_text(
         f"📣 Подтверждение рассылки\n\n"
         f"Тип содержимого: {content_type}\n"
-        f"Текст: {message.text or message.caption or 'Нет'}\n\n"
-        f"Начать рассылку? Это действие нельзя отменить после запуска.",
+        f"Текст: {data.get('message_text') or 'Нет'}\n"
+        f"Аудитория: {title} ({segment.describe()})\n"
+        f"Получателей: {recipients}\n\n"
+        f"Начать рассылку? Ее можно будет приостановить или отменить командами "
+        f"/broadcast_pause и /broadcast_cancel.",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ Да, начать рассылку", callback_data="confirm_broadcast")],
             [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast")]
         ])
     )
+    await callback.answer()
 
 
-@router.callback_query(F.data == "cancel_broadcast", BroadcastStates.confirmation)
+@router.callback_query(F.data == "cancel_broadcast", BroadcastStates)
 async def callback_cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     """
     Отмена рассылки через callback
@@ -506,17 +623,16 @@ async def callback_cancel_broadcast(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "confirm_broadcast", BroadcastStates.confirmation)
-async def callback_confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot, db: Database):
+async def callback_confirm_broadcast(callback: CallbackQuery, state: FSMContext, broadcasts: BroadcastEngine):
     """
-    Подтверждение и начало рассылки
+    Подтверждение и запуск рассылки
+    Рассылка выполняется в фоне, ее ход отображается в этом же сообщении
     """
     # Получаем данные о сообщении для рассылки
     data = await state.get_data()
     message_type = data.get("message_type")
-    message_text = data.get("message_text", "")
-    photo_id = data.get("photo_id")
-    video_id = data.get("video_id")
-    document_id = data.get("document_id")
+    file_id = data.get("photo_id") or data.get("video_id") or data.get("document_id")
+    _, segment = SEGMENT_PRESETS.get(data.get("segment"), SEGMENT_PRESETS["all"])
 
     # Сбрасываем состояние
     await state.clear()
@@ -524,65 +640,119 @@ async def callback_confirm_broadcast(callback: CallbackQuery, state: FSMContext,
     # Уведомляем о начале рассылки
     status_message = await callback.message.edit_text("Начинаем рассылку... ⏳")
 
-    # Получаем всех активных пользователей из базы данных
-    async with db.get_conn() as conn:
-        cursor = await conn.execute("SELECT user_id FROM users WHERE 1=1")  # Можно добавить условие для фильтрации
-        users = await cursor.fetchall()
+    broadcast_id = await broadcasts.create(
+        callback.from_user.id, message_type, data.get("message_text", ""), file_id,
+        status_chat_id=status_message.chat.id, status_message_id=status_message.message_id,
+        segment=segment
+    )
+    await callback.answer(f"Рассылка #{broadcast_id} запущена")
+
 
-    # Счетчики успешных и неуспешных отправок
-    success_count = 0
-    error_count = 0
-    total_users = len(users)
+def _parse_broadcast_id(message: Message) -> Optional[int]:
+    """
+    ID рассылки из аргумента команды
+    """
+    parts = (message.text or "").split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    return int(parts[1])
 
-    # Обновляем статус каждые 10 пользователей
-    update_interval = 10
 
-    # Запускаем рассылку
-    for i, user in enumerate(users, 1):
-        user_id = user["user_id"]
+@router.message(Command("broadcasts"))
+async def cmd_broadcasts(message: Message, config: Config, broadcasts: BroadcastEngine):
+    """
+    Список последних рассылок
+    """
+    if message.from_user.id not in config.bot.admin_ids:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
 
-        try:
-            # Отправляем сообщение в зависимости от типа
-            if message_type == "text":
-                await bot.send_message(user_id, message_text)
-            elif message_type == "photo":
-                await bot.send_photo(user_id, photo_id, caption=message_text)
-            elif message_type == "video":
-                await bot.send_video(user_id, video_id, caption=message_text)
-            elif message_type == "document":
-                await bot.send_document(user_id, document_id, caption=message_text)
-
-            success_count += 1
-        except Exception as e:
-            error_count += 1
-            logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
-
-        # Обновляем статус каждые update_interval пользователей или в конце
-        if i % update_interval == 0 or i == total_users:
-            try:
-                await status_message.edit_text(
-                    f"Рассылка в процессе... ⏳\n\n"
-                    f"Прогресс: {i}/{total_users} ({int(i / total_users * 100)}%)\n"
-                    f"Успешно: {success_count}\n"
-                    f"Ошибок: {error_count}"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении статуса рассылки: {e}")
-
-        # Добавляем небольшую задержку, чтобы избежать ограничений API Telegram
-        await asyncio.sleep(0.05)
-
-    # Отправляем финальный статус
-    final_status = (
-        f"✅ Рассылка завершена!\n\n"
-        f"Всего пользователей: {total_users}\n"
-        f"Успешно отправлено: {success_count}\n"
-        f"Ошибок: {error_count}\n"
-        f"Эффективность: {int(success_count / total_users * 100 if total_users else 0)}%"
+    recent = await broadcasts.recent()
+    if not recent:
+        await message.answer("Рассылок пока не было.")
+        return
+
+    text = "📣 Последние рассылки:\n\n"
+    for broadcast in recent:
+        processed = broadcast.sent + broadcast.failed
+        text += (
+            f"#{broadcast.broadcast_id} - {STATUS_NAMES.get(broadcast.status, broadcast.status)}, "
+            f"{processed}/{max(broadcast.total, processed)} "
+            f"(успешно {broadcast.sent}, ошибок {broadcast.failed})\n"
+        )
+    text += (
+        "\n/broadcast_pause [ID] - приостановить\n"
+        "/broadcast_resume [ID] - продолжить\n"
+        "/broadcast_cancel [ID] - отменить"
     )
+    await message.answer(text)
 
-    await status_message.edit_text(final_status)
-    await callback.answer()
+
+@router.message(Command("broadcast_pause", "broadcast_resume", "broadcast_cancel"))
+async def cmd_broadcast_control(message: Message, command: CommandObject, config: Config,
+                                broadcasts: BroadcastEngine):
+    """
+    Управление рассылкой: пауза, продолжение, отмена
+    Формат: /broadcast_pause ID, /broadcast_resume ID, /broadcast_cancel ID
+    """
+    if message.from_user.id not in config.bot.admin_ids:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    broadcast_id = _parse_broadcast_id(message)
+    if broadcast_id is None:
+        await message.answer(f"Укажите ID рассылки: /{command.command} ID\nСписок рассылок: /broadcasts")
+        return
+
+    if command.command == "broadcast_pause":
+        done = await broadcasts.pause(broadcast_id)
+        success_text, error_text = "приостановлена", "не идет"
+    elif command.command == "broadcast_resume":
+        done = await broadcasts.resume(broadcast_id)
+        success_text, error_text = "продолжена", "не приостановлена"
+    else:
+        done = await broadcasts.cancel(broadcast_id)
+        success_text, error_text = "отменена", "уже завершена или отменена"
+
+    if done:
+        await message.answer(f"Рассылка #{broadcast_id} {success_text}")
+    else:
+        await message.answer(f"Рассылка #{broadcast_id} не найдена или {error_text}")
+
+
+@router.message(Command("dead_letters"))
+async def cmd_dead_letters(message: Message, db: Repository, config: Config, delivery: Delivery):
+    """
+    Недоставленные сообщения рассылок и кампаний
+    Формат: /dead_letters [redrive [кампания]]
+    Без параметров - количество по кампаниям, redrive - повторная отправка (всех или одной кампании)
+    """
+    if message.from_user.id not in config.bot.admin_ids:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    args = message.text.split()
+    if len(args) > 1 and args[1].lower() == "redrive":
+        campaign = args[2] if len(args) > 2 else None
+        status_message = await message.answer("Повторная отправка недоставленных сообщений... ⏳")
+        result = await delivery.redrive(campaign)
+        await status_message.edit_text(
+            f"📬 Повторная отправка{f' ({campaign})' if campaign else ''} завершена\n\n"
+            f"Доставлено: {result['delivered']}\n"
+            f"Снова не доставлено: {result['failed']}"
+        )
+        return
+
+    counts = await db.count_dead_letters()
+    if not counts:
+        await message.answer("Недоставленных сообщений нет.")
+        return
+
+    text = "📭 Недоставленные сообщения:\n\n"
+    for campaign, count in sorted(counts.items(), key=lambda item: -item[1]):
+        text += f"{campaign}: {count}\n"
+    text += "\n/dead_letters redrive [кампания] - отправить повторно"
+    await message.answer(text)
 
 
 # Импортируем необходимые типы в конце файла
@@ -590,7 +760,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 
 @router.message(Command("base"))
-async def cmd_download_database(message: Message, db: Database, config: Config):
+async def cmd_download_database(message: Message, db: Repository, config: Config):
     """
     Команда для скачивания файла базы данных
     Доступно только администраторам
@@ -602,28 +772,26 @@ async def cmd_download_database(message: Message, db: Database, config: Config):
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
 
+    if not db.db_path:
+        await message.answer("Резервное копирование недоступно: данные хранятся не в файле базы данных.")
+        return
+
     try:
-        # Создаем копию базы данных
-        from datetime import datetime
-        import shutil
-        import os
+        status_message = await message.answer("Создаем резервную копию базы данных... ⏳")
 
-        # Формируем имя файла с текущей датой
+        # Копия снимается в отдельном потоке через Backup API во временную папку:
+        # ручные копии не участвуют в ротации и не вытесняют ежедневные
         current_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        backup_filename = f"database_backup_{current_date}.db"
-        
-        # Создаем копию базы данных
-        shutil.copy2(db.db_path, backup_filename)
+        with tempfile.TemporaryDirectory(prefix=f"{config.backup.prefix}_") as temp_dir:
+            backup_path = await create_backup(db.db_path, config.backup, temp_dir)
+            backup_bytes = await asyncio.to_thread(Path(backup_path).read_bytes)
 
         # Отправляем файл
-        with open(backup_filename, 'rb') as file:
-            await message.answer_document(
-                document=file,
-                caption=f"📁 Резервная копия базы данных\n📅 {current_date}"
-            )
-
-        # Удаляем временный файл
-        os.remove(backup_filename)
+        await message.answer_document(
+            document=BufferedInputFile(backup_bytes, filename=os.path.basename(backup_path)),
+            caption=f"📁 Резервная копия базы данных\n📅 {current_date}"
+        )
+        await status_message.delete()
 
         # Логируем действие
         logger.info(f"Администратор {user_id} скачал базу данных")
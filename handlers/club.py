@@ -10,8 +10,10 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from database import now_ts
+from repository import Repository
 from config import Config
+from outbound import send_priority, PRIORITY_TRANSACTIONAL
 from keyboards import (
     club_menu_kb, payment_methods_kb, payment_confirmation_kb, crypto_currency_kb,
     extend_subscription_kb, club_access_kb, main_menu_kb, crypto_payment_confirmation_kb,
@@ -31,35 +33,26 @@ class ClubStates(StatesGroup):
 
 
 @router.callback_query(F.data == "club")
-async def callback_club(callback: CallbackQuery, db: Database):
+async def callback_club(callback: CallbackQuery, db: Repository):
     """
     Обработчик кнопки "Клуб Х10"
     """
     user_id = callback.from_user.id
 
-    # Проверяем наличие активной подписки
-    subscription = await db.check_subscription(user_id)
+    # Проверяем наличие активной подписки (по индексу в памяти, без запроса к БД)
+    end_ts = await db.get_subscription_end_ts(user_id)
 
-    if subscription:
+    if end_ts:
         # У пользователя есть активная подписка
-        from datetime import datetime
-        end_date = subscription.get('end_date')
-        if end_date:
-            end_date_obj = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            days_left = (end_date_obj - datetime.now()).days
+        days_left = (end_ts - now_ts()) // 86400
 
-            await callback.message.edit_text(
-                f"Добро пожаловать в Клуб Х10!\n\n"
-                f"У вас активная подписка.\n"
-                f"Дней осталось: {days_left}\n\n"
-                f"Вы можете войти в клуб, нажав на кнопку ниже:",
-                reply_markup=club_access_kb()
-            )
-        else:
-            await callback.message.edit_text(
-                "Добро пожаловать в Клуб Х10!",
-                reply_markup=club_menu_kb()
-            )
+        await callback.message.edit_text(
+            f"Добро пожаловать в Клуб Х10!\n\n"
+            f"У вас активная подписка.\n"
+            f"Дней осталось: {days_left}\n\n"
+            f"Вы можете войти в клуб, нажав на кнопку ниже:",
+            reply_markup=club_access_kb()
+        )
     else:
         # У пользователя нет активной подписки
         await callback.message.edit_text(
@@ -74,7 +67,7 @@ async def callback_club(callback: CallbackQuery, db: Database):
 
 
 @router.callback_query(F.data == "pay_club")
-async def callback_pay_club(callback: CallbackQuery, db: Database, config: Config):
+async def callback_pay_club(callback: CallbackQuery, db: Repository, config: Config):
     """
     Обработчик кнопки "Оплатить доступ"
     """
@@ -86,7 +79,7 @@ async def callback_pay_club(callback: CallbackQuery, db: Database, config: Confi
 
 
 @router.callback_query(F.data.startswith("pay_method:"))
-async def callback_pay_method(callback: CallbackQuery, db: Database, config: Config):
+async def callback_pay_method(callback: CallbackQuery, db: Repository, config: Config):
     """
     Обработчик выбора способа оплаты
     """
@@ -193,7 +186,7 @@ async def callback_pay_method(callback: CallbackQuery, db: Database, config: Con
 
 
 @router.callback_query(F.data.startswith("crypto:"))
-async def callback_crypto_currency(callback: CallbackQuery, bot: Bot, db: Database, config: Config):
+async def callback_crypto_currency(callback: CallbackQuery, bot: Bot, db: Repository, config: Config):
     """
     Обработчик выбора криптовалюты для оплаты
     """
@@ -285,7 +278,7 @@ async def callback_crypto_currency(callback: CallbackQuery, bot: Bot, db: Databa
 
 
 @router.callback_query(F.data.startswith("confirm_crypto:"))
-async def callback_confirm_crypto(callback: CallbackQuery, state: FSMContext, db: Database, config: Config):
+async def callback_confirm_crypto(callback: CallbackQuery, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик подтверждения оплаты криптовалютой
     """
@@ -317,7 +310,7 @@ async def callback_confirm_crypto(callback: CallbackQuery, state: FSMContext, db
 
 
 @router.message(ClubStates.crypto_confirmation)
-async def process_crypto_confirmation(message: Message, state: FSMContext, db: Database, config: Config):
+async def process_crypto_confirmation(message: Message, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик получения ID транзакции для криптоплатежа
     """
@@ -344,20 +337,32 @@ async def process_crypto_confirmation(message: Message, state: FSMContext, db: D
         await state.clear()
         return
 
-    tx_id = message.text.strip()
-    current_payment_method = payment.get('payment_method', '')
+    # Получаем тип криптовалюты из способа оплаты вида crypto_ETH
+    payment_method = payment.get('payment_method', '')
+    currency = payment_method.split('_')[1] if '_' in payment_method else 'Unknown'
 
-    # Обновляем информацию о платеже, добавляя TxID к значению метода оплаты
-    conn = await db.get_conn()
-    try:
-        new_payment_method = f"{current_payment_method}_TxID:{tx_id}"
-        await conn.execute(
-            "UPDATE payments SET payment_method = ? WHERE payment_id = ?",
-            (new_payment_method, payment_id)
+    # Привязываем TxID к платежу; один и тот же TxID нельзя использовать для двух платежей
+    result = await db.attach_tx_id(payment_id, message.text, currency)
+    tx_id = result["tx_id"]
+
+    if not result["attached"]:
+        if result["duplicate_payment_id"]:
+            # Пользователь может отправить правильный TxID, состояние сохраняется
+            await message.answer(
+                "Этот ID транзакции уже был отправлен для другого платежа.\n\n"
+                "Проверьте TxID и отправьте его еще раз или свяжитесь с менеджером.",
+                reply_markup=need_help_kb()
+            )
+            return
+
+        # Платеж не найден или изменился - повторная отправка TxID не поможет
+        await message.answer(
+            "Не удалось сохранить ID транзакции для этого платежа.\n\n"
+            "Пожалуйста, попробуйте снова или обратитесь к менеджеру.",
+            reply_markup=need_help_kb()
         )
-        await conn.commit()
-    finally:
-        await conn.close()
+        await state.clear()
+        return
 
     # Уведомляем пользователя о получении TxID
     await message.answer(
@@ -367,18 +372,13 @@ async def process_crypto_confirmation(message: Message, state: FSMContext, db: D
         reply_markup=main_menu_kb()
     )
 
+    # Информация о пользователе одна для всех администраторов - получаем ее один раз
+    user_id = payment.get('user_id')
+    user = await db.get_user(user_id)
+
     # Отправляем информацию о платеже администраторам для подтверждения
     for admin_id in config.bot.admin_ids:
         try:
-            # Формируем информацию о платеже
-            payment_method = payment.get('payment_method', '')
-
-            # Получаем тип криптовалюты
-            currency = payment_method.split('_')[1] if '_' in payment_method else 'Unknown'
-
-            # Получаем информацию о пользователе
-            user_id = payment.get('user_id')
-            user = await db.get_user(user_id)
             username = user.get('username', '') if user else ''
             first_name = user.get('first_name', '') if user else ''
             last_name = user.get('last_name', '') if user else ''
@@ -418,7 +418,7 @@ async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
 
 
 @router.message(F.successful_payment)
-async def successful_payment_handler(message: Message, db: Database, config: Config):
+async def successful_payment_handler(message: Message, db: Repository, config: Config):
     """Обработчик успешного платежа звездами"""
     payment_payload = message.successful_payment.invoice_payload
 
@@ -447,27 +447,28 @@ async def successful_payment_handler(message: Message, db: Database, config: Con
             payment_info = get_payment_description(product_type, config)
             await db.add_subscription(user_id, payment_info["days"])
 
-            # Отправляем сообщение об успешной оплате
-            await message.answer(
-                "Спасибо за оплату! 🎉\n\n"
-                "Ваш доступ к клубу X10 активирован.\n\n"
-                "Теперь вы можете присоединиться к клубу, нажав на кнопку ниже:",
-                reply_markup=club_access_kb()
-            )
+            # Отправляем сообщение об успешной оплате (вне очереди рассылок)
+            with send_priority(PRIORITY_TRANSACTIONAL):
+                await message.answer(
+                    "Спасибо за оплату! 🎉\n\n"
+                    "Ваш доступ к клубу X10 активирован.\n\n"
+                    "Теперь вы можете присоединиться к клубу, нажав на кнопку ниже:",
+                    reply_markup=club_access_kb()
+                )
         else:
             # Для мероприятий
-            await message.answer(
-                "Спасибо за оплату! 🎉\n\n"
-                "Ваш платеж успешно обработан.\n"
-                "В ближайшее время с вами свяжется менеджер для предоставления доступа к мероприятию.",
-                reply_markup=main_menu_kb()
-            )
+            with send_priority(PRIORITY_TRANSACTIONAL):
+                await message.answer(
+                    "Спасибо за оплату! 🎉\n\n"
+                    "Ваш платеж успешно обработан.\n"
+                    "В ближайшее время с вами свяжется менеджер для предоставления доступа к мероприятию.",
+                    reply_markup=main_menu_kb()
+                )
 
             # Уведомляем администраторов о новом платеже
+            user = await db.get_user(user_id)
             for admin_id in config.bot.admin_ids:
                 try:
-                    # Получаем информацию о пользователе
-                    user = await db.get_user(user_id)
                     username = user.get('username', '') if user else ''
                     first_name = user.get('first_name', '') if user else ''
                     last_name = user.get('last_name', '') if user else ''
@@ -490,7 +491,7 @@ async def successful_payment_handler(message: Message, db: Database, config: Con
 
 
 @router.callback_query(F.data.startswith("confirm_payment:"))
-async def callback_confirm_payment(callback: CallbackQuery, state: FSMContext, db: Database, config: Config):
+async def callback_confirm_payment(callback: CallbackQuery, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик подтверждения оплаты
     """
@@ -526,7 +527,7 @@ async def callback_confirm_payment(callback: CallbackQuery, state: FSMContext, d
 
 
 @router.message(ClubStates.payment_confirmation)
-async def process_payment_confirmation(message: Message, state: FSMContext, db: Database, config: Config):
+async def process_payment_confirmation(message: Message, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик получения скриншота подтверждения оплаты
     """
@@ -561,12 +562,13 @@ async def process_payment_confirmation(message: Message, state: FSMContext, db:
         reply_markup=main_menu_kb()
     )
 
+    # Информация о пользователе одна для всех администраторов - получаем ее один раз
+    user_id = message.from_user.id
+    user = await db.get_user(user_id)
+
     # Отправляем скриншот и информацию о платеже администраторам для подтверждения
     for admin_id in config.bot.admin_ids:
         try:
-            # Получаем информацию о пользователе
-            user_id = message.from_user.id
-            user = await db.get_user(user_id)
             username = user.get('username', '') if user else message.from_user.username
             first_name = user.get('first_name', '') if user else message.from_user.first_name
             last_name = user.get('last_name', '') if user else message.from_user.last_name
@@ -657,16 +659,14 @@ async def callback_not_now(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "join_club")
-async def callback_join_club(callback: CallbackQuery, bot: Bot, db: Database, config: Config):
+async def callback_join_club(callback: CallbackQuery, bot: Bot, db: Repository, config: Config):
     """
     Обработчик кнопки "Войти" в клуб
     """
     user_id = callback.from_user.id
 
-    # Проверяем наличие активной подписки
-    subscription = await db.check_subscription(user_id)
-
-    if not subscription:
+    # Проверяем наличие активной подписки (по индексу в памяти, без запроса к БД)
+    if not await db.get_subscription_end_ts(user_id):
         await callback.message.edit_text(
             "У вас нет активной подписки на клуб X10.\n"
             "Для доступа необходимо оплатить членство.",
@@ -717,16 +717,14 @@ async def callback_join_club(callback: CallbackQuery, bot: Bot, db: Database, co
 
 
 @router.callback_query(F.data == "access_club")
-async def callback_access_club(callback: CallbackQuery, bot: Bot, db: Database, config: Config):
+async def callback_access_club(callback: CallbackQuery, bot: Bot, db: Repository, config: Config):
     """
     Обработчик кнопки "ВОЙТИ" (доступ к клубу)
     """
     user_id = callback.from_user.id
 
-    # Проверяем наличие активной подписки
-    subscription = await db.check_subscription(user_id)
-
-    if not subscription:
+    # Проверяем наличие активной подписки (по индексу в памяти, без запроса к БД)
+    if not await db.get_subscription_end_ts(user_id):
         await callback.message.edit_text(
             "У вас нет активной подписки на клуб X10.\n"
             "Для доступа необходимо оплатить членство.",
@@ -10,8 +10,9 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database
+from repository import Repository
 from config import Config
+from outbound import send_priority, PRIORITY_TRANSACTIONAL
 from keyboards import (
     events_kb, payment_methods_kb, main_menu_kb, payment_confirmation_kb,
     stars_payment_kb, need_help_kb, crypto_currency_kb, crypto_payment_confirmation_kb
@@ -42,7 +43,7 @@ async def callback_events(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("event:"))
-async def callback_event(callback: CallbackQuery, db: Database, config: Config):
+async def callback_event(callback: CallbackQuery, db: Repository, config: Config):
     """
     Обработчик выбора мероприятия
     """
@@ -100,7 +101,7 @@ async def callback_event(callback: CallbackQuery, db: Database, config: Config):
 
 
 @router.callback_query(F.data.startswith("pay_event:"))
-async def callback_pay_event(callback: CallbackQuery, db: Database, config: Config):
+async def callback_pay_event(callback: CallbackQuery, db: Repository, config: Config):
     """
     Обработчик оплаты мероприятия
     """
@@ -114,7 +115,7 @@ async def callback_pay_event(callback: CallbackQuery, db: Database, config: Conf
 
 
 @router.callback_query(F.data.startswith("pay_method:"))
-async def callback_pay_method_event(callback: CallbackQuery, db: Database, config: Config):
+async def callback_pay_method_event(callback: CallbackQuery, db: Repository, config: Config):
     """
     Обработчик выбора способа оплаты для мероприятий
     """
@@ -209,7 +210,7 @@ async def callback_pay_method_event(callback: CallbackQuery, db: Database, confi
 
 
 @router.callback_query(F.data.startswith("crypto:"))
-async def callback_crypto_currency_event(callback: CallbackQuery, bot: Bot, db: Database, config: Config):
+async def callback_crypto_currency_event(callback: CallbackQuery, bot: Bot, db: Repository, config: Config):
     """
     Обработчик выбора криптовалюты для оплаты мероприятия
     """
@@ -301,7 +302,7 @@ async def callback_crypto_currency_event(callback: CallbackQuery, bot: Bot, db:
 
 
 @router.callback_query(F.data.startswith("confirm_crypto:"))
-async def callback_confirm_crypto_event(callback: CallbackQuery, state: FSMContext, db: Database, config: Config):
+async def callback_confirm_crypto_event(callback: CallbackQuery, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик подтверждения оплаты криптовалютой для мероприятий
     """
@@ -333,7 +334,7 @@ async def callback_confirm_crypto_event(callback: CallbackQuery, state: FSMConte
 
 
 @router.message(EventStates.crypto_confirmation)
-async def process_crypto_confirmation_event(message: Message, state: FSMContext, db: Database, config: Config):
+async def process_crypto_confirmation_event(message: Message, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик получения ID транзакции для криптоплатежа мероприятия
     """
@@ -360,20 +361,32 @@ async def process_crypto_confirmation_event(message: Message, state: FSMContext,
         await state.clear()
         return
 
-    tx_id = message.text.strip()
-    current_payment_method = payment.get('payment_method', '')
+    # Получаем тип криптовалюты из способа оплаты вида crypto_ETH
+    payment_method = payment.get('payment_method', '')
+    currency = payment_method.split('_')[1] if '_' in payment_method else 'Unknown'
 
-    # Обновляем информацию о платеже, добавляя TxID к значению метода оплаты
-    conn = await db.get_conn()
-    try:
-        new_payment_method = f"{current_payment_method}_TxID:{tx_id}"
-        await conn.execute(
-            "UPDATE payments SET payment_method = ? WHERE payment_id = ?",
-            (new_payment_method, payment_id)
+    # Привязываем TxID к платежу; один и тот же TxID нельзя использовать для двух платежей
+    result = await db.attach_tx_id(payment_id, message.text, currency)
+    tx_id = result["tx_id"]
+
+    if not result["attached"]:
+        if result["duplicate_payment_id"]:
+            # Пользователь может отправить правильный TxID, состояние сохраняется
+            await message.answer(
+                "Этот ID транзакции уже был отправлен для другого платежа.\n\n"
+                "Проверьте TxID и отправьте его еще раз или свяжитесь с менеджером.",
+                reply_markup=need_help_kb()
+            )
+            return
+
+        # Платеж не найден или изменился - повторная отправка TxID не поможет
+        await message.answer(
+            "Не удалось сохранить ID транзакции для этого платежа.\n\n"
+            "Пожалуйста, попробуйте снова или обратитесь к менеджеру.",
+            reply_markup=need_help_kb()
         )
-        await conn.commit()
-    finally:
-        await conn.close()
+        await state.clear()
+        return
 
     # Уведомляем пользователя о получении TxID
     await message.answer(
@@ -383,18 +396,13 @@ async def process_crypto_confirmation_event(message: Message, state: FSMContext,
         reply_markup=main_menu_kb()
     )
 
+    # Информация о пользователе одна для всех администраторов - получаем ее один раз
+    user_id = payment.get('user_id')
+    user = await db.get_user(user_id)
+
     # Отправляем информацию о платеже администраторам для подтверждения
     for admin_id in config.bot.admin_ids:
         try:
-            # Формируем информацию о платеже
-            payment_method = payment.get('payment_method', '')
-
-            # Получаем тип криптовалюты
-            currency = payment_method.split('_')[1] if '_' in payment_method else 'Unknown'
-
-            # Получаем информацию о пользователе
-            user_id = payment.get('user_id')
-            user = await db.get_user(user_id)
             username = user.get('username', '') if user else ''
             first_name = user.get('first_name', '') if user else ''
             last_name = user.get('last_name', '') if user else ''
@@ -446,7 +454,7 @@ async def callback_cancel_payment_event(callback: CallbackQuery, state: FSMConte
 
 
 @router.callback_query(F.data.startswith("confirm_payment:"))
-async def callback_confirm_payment_event(callback: CallbackQuery, state: FSMContext, db: Database, config: Config):
+async def callback_confirm_payment_event(callback: CallbackQuery, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик подтверждения оплаты для мероприятий
     """
@@ -486,7 +494,7 @@ async def pre_checkout_handler_event(pre_checkout_query: PreCheckoutQuery):
 
 
 @router.message(F.successful_payment)
-async def successful_payment_handler_event(message: Message, db: Database, config: Config):
+async def successful_payment_handler_event(message: Message, db: Repository, config: Config):
     """
     Обработчик успешного платежа звездами для мероприятий
     """
@@ -512,19 +520,19 @@ async def successful_payment_handler_event(message: Message, db: Database, confi
         # Подтверждаем платеж
         await db.confirm_payment(payment_id)
 
-        # Для мероприятий
-        await message.answer(
-            "Спасибо за оплату! 🎉\n\n"
-            "Ваш платеж успешно обработан.\n"
-            "В ближайшее время с вами свяжется менеджер для предоставления доступа к мероприятию.",
-            reply_markup=main_menu_kb()
-        )
+        # Для мероприятий (сообщение об оплате - вне очереди рассылок)
+        with send_priority(PRIORITY_TRANSACTIONAL):
+            await message.answer(
+                "Спасибо за оплату! 🎉\n\n"
+                "Ваш платеж успешно обработан.\n"
+                "В ближайшее время с вами свяжется менеджер для предоставления доступа к мероприятию.",
+                reply_markup=main_menu_kb()
+            )
 
         # Уведомляем администраторов о новом платеже
+        user = await db.get_user(user_id)
         for admin_id in config.bot.admin_ids:
             try:
-                # Получаем информацию о пользователе
-                user = await db.get_user(user_id)
                 username = user.get('username', '') if user else ''
                 first_name = user.get('first_name', '') if user else ''
                 last_name = user.get('last_name', '') if user else ''
@@ -548,7 +556,7 @@ async def successful_payment_handler_event(message: Message, db: Database, confi
 
 
 @router.message(EventStates.payment_confirmation)
-async def process_event_payment_confirmation(message: Message, state: FSMContext, db: Database, config: Config):
+async def process_event_payment_confirmation(message: Message, state: FSMContext, db: Repository, config: Config):
     """
     Обработчик получения скриншота подтверждения оплаты мероприятия
     """
@@ -583,12 +591,13 @@ async def process_event_payment_confirmation(message: Message, state: FSMContext
         reply_markup=main_menu_kb()
     )
 
+    # Информация о пользователе одна для всех администраторов - получаем ее один раз
+    user_id = message.from_user.id
+    user = await db.get_user(user_id)
+
     # Отправляем скриншот и информацию о платеже администраторам для подтверждения
     for admin_id in config.bot.admin_ids:
         try:
-            # Получаем информацию о пользователе
-            user_id = message.from_user.id
-            user = await db.get_user(user_id)
             username = user.get('username', '') if user else message.from_user.username
             first_name = user.get('first_name', '') if user else message.from_user.first_name
             last_name = user.get('last_name', '') if user else message.from_user.last_name
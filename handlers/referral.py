@@ -7,7 +7,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
-from database import Database
+from repository import Repository
 from config import Config
 from keyboards import referral_kb, main_menu_kb
 from utils import generate_ref_link, get_user_name
@@ -17,7 +17,7 @@ logger = logging.getLogger(__name__)
 
 
 @router.callback_query(F.data == "my_referrals")
-async def callback_my_referrals(callback: CallbackQuery, bot: Bot, db: Database, config: Config):
+async def callback_my_referrals(callback: CallbackQuery, bot: Bot, db: Repository, config: Config):
     """
     Обработчик кнопки "Мои рефералы"
     """
@@ -78,7 +78,7 @@ async def callback_my_referrals(callback: CallbackQuery, bot: Bot, db: Database,
 
 
 @router.callback_query(F.data == "get_ref_link")
-async def callback_get_ref_link(callback: CallbackQuery, bot: Bot, db: Database):
+async def callback_get_ref_link(callback: CallbackQuery, bot: Bot, db: Repository):
     """
     Обработчик кнопки "Реферальная ссылка"
     """
@@ -99,7 +99,7 @@ async def callback_get_ref_link(callback: CallbackQuery, bot: Bot, db: Database)
 
 
 @router.callback_query(F.data == "generate_ref_link")
-async def callback_generate_ref_link(callback: CallbackQuery, bot: Bot, db: Database):
+async def callback_generate_ref_link(callback: CallbackQuery, bot: Bot, db: Repository):
     """
     Обработчик кнопки "Получить ссылку"
     """
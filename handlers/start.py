@@ -2,12 +2,14 @@
 Обработчик команды /start для бота клуба X10.
 """
 import logging
+from typing import Optional
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command, CommandStart
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
+from aiogram.filters import Command, CommandStart, ChatMemberUpdatedFilter, KICKED, MEMBER
 from aiogram.fsm.context import FSMContext
 
-from database import Database
+from database import now_ts
+from repository import Repository
 from config import Config
 from keyboards import main_menu_kb, get_referral_link_kb
 from utils import extract_referrer_id, get_user_name
@@ -17,7 +19,7 @@ logger = logging.getLogger(__name__)
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, bot: Bot, db: Database, config: Config, state: FSMContext):
+async def cmd_start(message: Message, bot: Bot, db: Repository, config: Config, state: FSMContext):
     """
     Обработчик команды /start
     """
@@ -39,47 +41,43 @@ async def cmd_start(message: Message, bot: Bot, db: Database, config: Config, st
         referrer_id = extract_referrer_id(start_param)
 
         if referrer_id and referrer_id != user_id:
-            # Получаем информацию о реферере
-            referrer = await db.get_user(referrer_id)
-
-            if referrer:
-                # Добавляем запись о реферале
-                referral_id = await db.add_referral(user_id, referrer_id)
-
-                if referral_id > 0:
-                    # Начисляем бонусы рефереру
-                    new_balance = await db.update_user_balance(referrer_id, config.referral.points_per_referral)
-
-                    # Выдаем бесплатные дни приглашенному
-                    await db.add_subscription(user_id, config.referral.free_days)
-
-                    # Отправляем уведомление рефереру
-                    referrer_name = get_user_name(message.from_user)
-                    await bot.send_message(
-                        referrer_id,
-                        f"🎉 Поздравляем! Ты пригласил 1 друга! 🎉\n\n"
-                        f"Твой счет пополнен на {config.referral.points_per_referral} баллов "
-                        f"(1 балл = 1 рубль)\n"
-                        f"Спасибо, что помогаешь нам расти!\n\n"
-                        f"Продолжай в том же духе:\n"
-                        f"💎 3 друга – доступ к VIP продукту экскурсия по Вьетнаму\n"
-                        f"🚀 5 друзей – месяц бесплатного членства в Клубе Х10\n"
-                        f"🌟 10 друзей – персональная консультация с основателем Клуба Х10\n\n"
-                        f"👉 Продолжай приглашать друзей и получай еще больше бонусов!"
-                    )
-
-                    # Отправляем приветственное сообщение приглашенному
-                    await message.answer(
-                        f"🎉 Добро пожаловать в нашу реферальную программу!\n\n"
-                        f"Вы получили {config.referral.free_days} дней безоплатного членства в клубе Х10\n"
-                        f"Подробнее о клубе здесь (https://t.me/x10_club_info)",
-                        reply_markup=main_menu_kb()
-                    )
-
-                    # Проверяем достижение бонусных уровней
-                    await check_referrer_bonuses(bot, db, config, referrer_id)
-
-                    return
+            # Добавляем запись о реферале, начисляем бонусы рефереру
+            # и выдаем бесплатные дни приглашенному одной транзакцией
+            referral = await db.apply_referral(
+                user_id,
+                referrer_id,
+                config.referral.points_per_referral,
+                config.referral.free_days
+            )
+
+            if referral:
+                # Отправляем уведомление рефереру
+                referrer_name = get_user_name(message.from_user)
+                await bot.send_message(
+                    referrer_id,
+                    f"🎉 Поздравляем! Ты пригласил 1 друга! 🎉\n\n"
+                    f"Твой счет пополнен на {config.referral.points_per_referral} баллов "
+                    f"(1 балл = 1 рубль)\n"
+                    f"Спасибо, что помогаешь нам расти!\n\n"
+                    f"Продолжай в том же духе:\n"
+                    f"💎 3 друга – доступ к VIP продукту экскурсия по Вьетнаму\n"
+                    f"🚀 5 друзей – месяц бесплатного членства в Клубе Х10\n"
+                    f"🌟 10 друзей – персональная консультация с основателем Клуба Х10\n\n"
+                    f"👉 Продолжай приглашать друзей и получай еще больше бонусов!"
+                )
+
+                # Отправляем приветственное сообщение приглашенному
+                await message.answer(
+                    f"🎉 Добро пожаловать в нашу реферальную программу!\n\n"
+                    f"Вы получили {config.referral.free_days} дней безоплатного членства в клубе Х10\n"
+                    f"Подробнее о клубе здесь (https://t.me/x10_club_info)",
+                    reply_markup=main_menu_kb()
+                )
+
+                # Проверяем достижение бонусных уровней
+                await check_referrer_bonuses(bot, db, config, referrer_id, referral["referrals_count"])
+
+                return
 
     # Обычное приветственное сообщение
     await message.answer(
@@ -119,7 +117,7 @@ async def callback_main_menu(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "my_balance")
-async def callback_my_balance(callback: CallbackQuery, db: Database):
+async def callback_my_balance(callback: CallbackQuery, db: Repository):
     """
     Обработчик нажатия кнопки "Мой баланс"
     """
@@ -128,16 +126,12 @@ async def callback_my_balance(callback: CallbackQuery, db: Database):
 
     if user:
         balance = user.get('balance', 0)
-        subscription = await db.check_subscription(user_id)
+        end_ts = await db.get_subscription_end_ts(user_id)
 
         subscription_text = ""
-        if subscription:
-            end_date = subscription.get('end_date')
-            if end_date:
-                from datetime import datetime
-                end_date_obj = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                days_left = (end_date_obj - datetime.now()).days
-                subscription_text = f"\n\nСтатус подписки: Активна\nДней осталось: {days_left}"
+        if end_ts:
+            days_left = (end_ts - now_ts()) // 86400
+            subscription_text = f"\n\nСтатус подписки: Активна\nДней осталось: {days_left}"
         else:
             subscription_text = "\n\nСтатус подписки: Неактивна"
 
@@ -190,21 +184,24 @@ async def callback_back(callback: CallbackQuery):
     await callback.answer()
 
 
-async def check_referrer_bonuses(bot: Bot, db: Database, config: Config, referrer_id: int):
+async def check_referrer_bonuses(bot: Bot, db: Repository, config: Config, referrer_id: int,
+                                 referrals_count: Optional[int] = None):
     """
     Проверка и выдача бонусов за достижение уровней реферальной программы
     :param bot: Объект бота
     :param db: Объект базы данных
     :param config: Объект конфигурации
     :param referrer_id: ID реферера
+    :param referrals_count: Количество рефералов, если уже известно (например, из db.apply_referral)
     """
-    # Получаем количество рефералов пользователя
-    referrals_count = await db.count_user_referrals(referrer_id)
+    if referrals_count is None:
+        # Получаем информацию о пользователе
+        user = await db.get_user(referrer_id)
+        if not user:
+            return
 
-    # Получаем информацию о пользователе
-    user = await db.get_user(referrer_id)
-    if not user:
-        return
+        # Получаем количество рефералов пользователя
+        referrals_count = await db.count_user_referrals(referrer_id)
 
     # Проверяем достижение уровней
     # Уровень 3 (доступ к VIP продукту)
@@ -253,3 +250,21 @@ async def check_referrer_bonuses(bot: Bot, db: Database, config: Config, referre
             "👉 Если у тебя есть вопросы или пожелания, пиши – мы всегда на связи!",
             reply_markup=get_consultation_kb()
         )
+
+
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def user_blocked_bot(event: ChatMemberUpdated, db: Repository):
+    """
+    Пользователь заблокировал бота: он исключается из рассылок и кампаний
+    """
+    if await db.set_user_reachable(event.from_user.id, False):
+        logger.info(f"Пользователь {event.from_user.id} заблокировал бота")
+
+
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def user_unblocked_bot(event: ChatMemberUpdated, db: Repository):
+    """
+    Пользователь разблокировал бота: рассылки и кампании снова ему отправляются
+    """
+    if await db.set_user_reachable(event.from_user.id, True):
+        logger.info(f"Пользователь {event.from_user.id} разблокировал бота")
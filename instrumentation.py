@@ -0,0 +1,233 @@
+"""
+Инструментирование запросов к базе данных бота клуба X10.
+Замеряет время выполнения каждого запроса по его «отпечатку» (тексту без значений),
+пишет в лог медленные запросы и при первом появлении запроса сохраняет его план
+(EXPLAIN QUERY PLAN), отмечая полные просмотры таблиц.
+"""
+import logging
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Границы интервалов гистограммы времени выполнения (мс)
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+# Запросы, для которых имеет смысл получать план
+_PLANNABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """
+    Отпечаток запроса: текст без значений и лишних пробелов,
+    списки IN (?, ?, ...) любой длины сводятся к IN (...)
+    :param sql: текст запроса
+    :return: Нормализованный текст запроса
+    """
+    text = _STRING_RE.sub("?", sql)
+    text = _NUMBER_RE.sub("?", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    return _IN_LIST_RE.sub("IN (...)", text)
+
+
+class QueryStat:
+    """Статистика одного отпечатка запроса"""
+    __slots__ = ("fingerprint", "count", "total_ms", "max_ms", "slow", "buckets", "plan", "full_scan")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.plan: Optional[List[str]] = None
+        self.full_scan = False
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Оценка перцентиля по гистограмме (верхняя граница интервала)
+        :param fraction: доля (например, 0.95)
+        :return: Время в мс
+        """
+        target = self.count * fraction
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms,
+            "slow": self.slow,
+            "full_scan": self.full_scan,
+            "plan": self.plan or [],
+        }
+
+
+class QueryStats:
+    """Статистика всех запросов одной базы данных"""
+
+    def __init__(self, slow_query_ms: float = 100.0, capture_plans: bool = True):
+        """
+        :param slow_query_ms: порог медленного запроса (мс)
+        :param capture_plans: получать план запроса при его первом появлении
+        """
+        self.slow_query_ms = slow_query_ms
+        self.capture_plans = capture_plans
+        self._stats: Dict[str, QueryStat] = {}
+
+    def get(self, sql: str) -> Tuple[QueryStat, bool]:
+        """
+        Получение статистики запроса
+        :return: Статистика и признак того, что запрос встретился впервые
+        """
+        key = fingerprint(sql)
+        stat = self._stats.get(key)
+        if stat is None:
+            stat = self._stats[key] = QueryStat(key)
+            return stat, True
+        return stat, False
+
+    def record(self, stat: QueryStat, elapsed_ms: float, fetch: bool = False):
+        """
+        Учет времени выполнения запроса
+        :param stat: статистика запроса
+        :param elapsed_ms: время выполнения (мс)
+        :param fetch: время чтения результата (добавляется к общему времени, но не в гистограмму)
+        """
+        stat.total_ms += elapsed_ms
+        if not fetch:
+            stat.count += 1
+            stat.max_ms = max(stat.max_ms, elapsed_ms)
+            stat.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+        if elapsed_ms >= self.slow_query_ms:
+            stat.slow += 1
+            logger.warning(f"Медленный запрос ({elapsed_ms:.1f} мс): {stat.fingerprint}")
+
+    def top(self, limit: int = 10, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """
+        Самые «дорогие» запросы
+        :param limit: количество запросов
+        :param order_by: поле сортировки (total_ms, max_ms, count, slow)
+        :return: Список словарей со статистикой
+        """
+        stats = sorted(self._stats.values(), key=lambda stat: getattr(stat, order_by), reverse=True)
+        return [stat.to_dict() for stat in stats[:limit]]
+
+    def full_scans(self) -> List[Dict[str, Any]]:
+        """
+        Запросы, план которых содержит полный просмотр таблицы
+        """
+        return [stat.to_dict() for stat in self._stats.values() if stat.full_scan]
+
+    def reset(self):
+        """
+        Сброс статистики (планы будут получены заново)
+        """
+        self._stats.clear()
+
+
+class InstrumentedCursor:
+    """Курсор, учитывающий время чтения результата"""
+
+    def __init__(self, cursor: aiosqlite.Cursor, stats: QueryStats, stat: QueryStat):
+        self._cursor = cursor
+        self._stats = stats
+        self._stat = stat
+
+    async def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return await method(*args)
+        finally:
+            self._stats.record(self._stat, (time.perf_counter() - started) * 1000, fetch=True)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone)
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall)
+
+    async def fetchmany(self, size: Optional[int] = None):
+        if size is None:
+            return await self._timed(self._cursor.fetchmany)
+        return await self._timed(self._cursor.fetchmany, size)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Обертка над соединением aiosqlite, замеряющая все вызовы execute"""
+
+    def __init__(self, conn: aiosqlite.Connection, stats: QueryStats):
+        self._conn = conn
+        self._stats = stats
+
+    @property
+    def raw(self) -> aiosqlite.Connection:
+        """
+        Исходное соединение без замеров (для разовых служебных операций)
+        """
+        return self._conn
+
+    async def _capture_plan(self, sql: str, parameters: Any, stat: QueryStat):
+        """
+        Получение плана запроса при его первом появлении
+        """
+        if not sql.lstrip().upper().startswith(_PLANNABLE):
+            return
+        try:
+            cursor = await self._conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+            stat.plan = [row[-1] for row in await cursor.fetchall()]
+            await cursor.close()
+        except Exception as e:
+            logger.debug(f"Не удалось получить план запроса {stat.fingerprint}: {e}")
+            return
+
+        # SCAN без индекса - полный просмотр таблицы (служебная таблица схемы не в счет)
+        stat.full_scan = any(
+            detail.startswith("SCAN ") and "USING" not in detail and "CONSTANT ROW" not in detail
+            and "sqlite_master" not in detail and "sqlite_schema" not in detail
+            for detail in stat.plan
+        )
+        if stat.full_scan:
+            logger.warning(f"Полный просмотр таблицы в запросе: {stat.fingerprint} | план: {'; '.join(stat.plan)}")
+
+    async def execute(self, sql: str, parameters: Any = None) -> InstrumentedCursor:
+        if parameters is None:
+            parameters = ()
+
+        stat, first_seen = self._stats.get(sql)
+        if first_seen and self._stats.capture_plans:
+            await self._capture_plan(sql, parameters, stat)
+
+        started = time.perf_counter()
+        try:
+            cursor = await self._conn.execute(sql, parameters)
+        finally:
+            self._stats.record(stat, (time.perf_counter() - started) * 1000)
+        return InstrumentedCursor(cursor, self._stats, stat)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
@@ -9,7 +9,10 @@ from aiogram.types import BotCommand, LabeledPrice, PreCheckoutQuery
 
 # Импортируем конфигурацию и базу данных
 from config import load_config
-from database import Database
+from repository import create_database
+from outbound import OutboundScheduler
+from broadcast import BroadcastEngine
+from delivery import Delivery
 from scheduled_tasks import ScheduledTasks
 
 # Импортируем обработчики
@@ -59,17 +62,26 @@ async def main():
 
     # Инициализация бота и диспетчера
     bot = Bot(token=config.bot.token)
+
+    # Все запросы к Telegram проходят через планировщик исходящих сообщений
+    outbound = OutboundScheduler(config.outbound, config.bot.admin_ids)
+    bot.session.middleware(outbound)
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
     # Инициализация базы данных
-    db = Database(config.db.db_path)
-    await db.create_tables()
+    db = create_database(config.db)
+    await db.connect()
+    await db.migrate()
+    await db.load_subscription_index()
 
     # Регистрация middlewares
     # ПРИМЕЧАНИЕ: Здесь будет добавлен middleware для передачи конфигурации и БД
-    dp.message.middleware.register(ConfigMiddleware(config, db, bot))
-    dp.callback_query.middleware.register(ConfigMiddleware(config, db, bot))
+    delivery = Delivery(bot, db)
+    broadcasts = BroadcastEngine(bot, db, config.broadcast, delivery)
+    dp.message.middleware.register(ConfigMiddleware(config, db, bot, broadcasts, delivery))
+    dp.callback_query.middleware.register(ConfigMiddleware(config, db, bot, broadcasts, delivery))
+    dp.my_chat_member.middleware.register(ConfigMiddleware(config, db, bot, broadcasts, delivery))
 
     # Регистрация обработчиков
     dp.include_router(start.router)
@@ -85,12 +97,15 @@ async def main():
     await set_commands(bot)
 
     # Инициализация и запуск планировщика задач
-    scheduler = ScheduledTasks(bot, db, config)
+    scheduler = ScheduledTasks(bot, db, config, delivery)
     scheduler.start()
 
     # Запуск стартовых задач
     await scheduler.run_startup_tasks()
 
+    # Продолжение рассылок, прерванных предыдущей остановкой бота
+    await broadcasts.start()
+
     try:
         # Запуск поллинга
         logger.info("Бот клуба X10 запущен")
@@ -99,7 +114,14 @@ async def main():
         # Остановка планировщика при завершении
         scheduler.shutdown()
 
+        # Остановка рассылок (продолжатся после следующего запуска)
+        await broadcasts.close()
+
+        # Закрытие соединений с базой данных
+        await db.close()
+
         # Закрытие сессии бота
+        await outbound.close()
         await bot.session.close()
         logger.info("Бот клуба X10 остановлен")
 
@@ -107,19 +129,23 @@ async def main():
 # Middleware для передачи конфигурации и БД
 class ConfigMiddleware:
     """
-    Middleware для передачи конфигурации, базы данных и бота в хендлеры
+    Middleware для передачи конфигурации, базы данных, бота, движка рассылок и доставки сообщений в хендлеры
     """
 
-    def __init__(self, config, db, bot):
+    def __init__(self, config, db, bot, broadcasts=None, delivery=None):
         self.config = config
         self.db = db
         self.bot = bot
+        self.broadcasts = broadcasts
+        self.delivery = delivery
 
     async def __call__(self, handler, event, data):
         # Добавляем объекты в data
         data["config"] = self.config
         data["db"] = self.db
         data["bot"] = self.bot
+        data["broadcasts"] = self.broadcasts
+        data["delivery"] = self.delivery
 
         # Продолжаем обработку
         return await handler(event, data)
@@ -0,0 +1,113 @@
+"""
+Модуль обслуживания базы данных бота клуба X10.
+Обновляет статистику планировщика запросов, возвращает свободные страницы
+и обрезает WAL. Выполняется в отдельном потоке на отдельном соединении.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict
+
+from config import MaintenanceConfig
+
+logger = logging.getLogger(__name__)
+
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _file_size(path: str) -> int:
+    """
+    Размер файла в байтах (0, если файла нет)
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _snapshot(conn: sqlite3.Connection, db_path: str) -> Dict[str, int]:
+    """
+    Текущие размеры базы данных
+    """
+    return {
+        "file_size": _file_size(db_path),
+        "wal_size": _file_size(f"{db_path}-wal"),
+        "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+        "freelist_count": conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def _run_maintenance(db_path: str, config: MaintenanceConfig) -> Dict[str, Any]:
+    """
+    Обслуживание базы данных (выполняется в отдельном потоке)
+    :param db_path: путь к файлу базы данных
+    :param config: настройки обслуживания
+    :return: Отчет с размерами до и после и временем выполнения
+    """
+    started = time.monotonic()
+    # isolation_level=None - каждая команда выполняется сама по себе, VACUUM нельзя выполнять в транзакции
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=config.busy_timeout / 1000)
+    try:
+        report: Dict[str, Any] = {"before": _snapshot(conn, db_path), "vacuumed": False}
+
+        # Однократный переход на инкрементальную очистку: режим меняется только полным VACUUM
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            logger.info("Перевод базы данных в режим auto_vacuum=INCREMENTAL (полный VACUUM)")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            report["vacuumed"] = True
+
+        # Статистика для планировщика запросов (analysis_limit ограничивает время ANALYZE на больших таблицах)
+        conn.execute(f"PRAGMA analysis_limit = {int(config.analysis_limit)}")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+
+        # Возврат свободных страниц файловой системе (0 - все); execute освобождает
+        # только одну страницу за шаг, executescript выполняет команду до конца
+        conn.executescript(f"PRAGMA incremental_vacuum({int(config.incremental_vacuum_pages)});")
+
+        # Перенос WAL в основной файл и обрезка WAL до нуля
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        report["checkpoint"] = {"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}
+
+        report["after"] = _snapshot(conn, db_path)
+        report["elapsed"] = time.monotonic() - started
+        return report
+    finally:
+        conn.close()
+
+
+async def run_maintenance(db_path: str, config: MaintenanceConfig) -> Dict[str, Any]:
+    """
+    Обслуживание базы данных без блокировки цикла событий
+    :param db_path: путь к файлу базы данных
+    :param config: настройки обслуживания
+    :return: Отчет с размерами до и после
+    """
+    report = await asyncio.to_thread(_run_maintenance, db_path, config)
+    logger.info(f"Обслуживание базы данных выполнено: {format_report(report)}")
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Текст отчета об обслуживании базы данных
+    :param report: отчет run_maintenance
+    :return: Текст отчета
+    """
+    before, after = report["before"], report["after"]
+    text = (
+        f"Файл БД: {before['file_size'] // 1024} КБ → {after['file_size'] // 1024} КБ\n"
+        f"WAL: {before['wal_size'] // 1024} КБ → {after['wal_size'] // 1024} КБ\n"
+        f"Свободных страниц: {before['freelist_count']} → {after['freelist_count']}\n"
+        f"Всего страниц: {before['page_count']} → {after['page_count']}\n"
+    )
+    if report["vacuumed"]:
+        text += "Выполнен полный VACUUM (переход на auto_vacuum=INCREMENTAL)\n"
+    if report["checkpoint"]["busy"]:
+        text += "⚠️ WAL обрезан не полностью: база была занята\n"
+    text += f"Время: {report['elapsed']:.1f} сек"
+    return text
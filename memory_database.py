@@ -0,0 +1,862 @@
+"""
+Хранилище данных бота клуба X10 в памяти процесса.
+Реализует тот же интерфейс repository.Repository, что и хранилище на SQLite,
+включая счетчики, которые в SQLite поддерживают триггеры (рефералы, статистика).
+Данные не сохраняются между запусками: хранилище нужно для тестов обработчиков
+и замеров производительности без дискового ввода-вывода.
+"""
+import datetime
+import itertools
+import logging
+from bisect import bisect_right, insort
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import DbConfig
+from database import now_ts, day_bounds_ts, normalize_tx_id
+from instrumentation import QueryStats
+from migrations import LATEST_VERSION
+from records import User, Subscription, Payment, Referral, Broadcast, DeadLetter
+from repository import Repository, ITER_BATCH_SIZE, ARCHIVE_BATCH_SIZE, broadcast_campaign_id
+from segments import Segment
+from subscription_index import SubscriptionIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _current_timestamp() -> str:
+    """
+    Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _local_day(ts: int) -> str:
+    """
+    Локальная дата для Unix-времени (как date(ts, 'unixepoch', 'localtime'))
+    """
+    return datetime.date.fromtimestamp(ts).isoformat()
+
+
+class MemoryDatabase(Repository):
+    def __init__(self, config: Optional[DbConfig] = None):
+        """
+        Инициализация пустого хранилища
+        :param config: настройки базы данных (путь к файлу не используется)
+        """
+        self.config = config or DbConfig(db_path="", backend="memory")
+        self.db_path = None
+
+        self._users: Dict[int, Dict[str, Any]] = {}
+        # Отсортированные ID пользователей для постраничного обхода
+        self._user_ids: List[int] = []
+
+        self._subscriptions: Dict[int, Dict[str, Any]] = {}
+        self._user_subscriptions: Dict[int, List[int]] = {}
+        self._subscriptions_archive: Dict[int, Dict[str, Any]] = {}
+
+        self._payments: Dict[int, Dict[str, Any]] = {}
+        self._payments_archive: Dict[int, Dict[str, Any]] = {}
+        # TxID → ID платежа (в том числе архивного)
+        self._tx_ids: Dict[str, int] = {}
+
+        self._referrals: Dict[int, Dict[str, Any]] = {}
+        self._referral_by_user: Dict[int, int] = {}
+        self._referrals_by_referrer: Dict[int, List[int]] = {}
+
+        self._broadcasts: Dict[int, Dict[str, Any]] = {}
+        # ID рассылки → {user_id: {"status", "error", "updated_ts"}}
+        self._broadcast_recipients: Dict[int, Dict[int, Dict[str, Any]]] = {}
+
+        self._dead_letters: Dict[int, Dict[str, Any]] = {}
+
+        self._events: Dict[int, Dict[str, Any]] = {}
+        self._event_registrations: Dict[int, Dict[str, Any]] = {}
+
+        self._totals = {
+            "users": 0, "referrals": 0, "payments": 0,
+            "payments_confirmed": 0, "revenue": 0, "active_subscriptions": 0,
+        }
+        self._daily: Dict[str, Dict[str, Any]] = {}
+
+        self._ids = {name: itertools.count(1) for name in
+                     ("subscriptions", "payments", "referrals", "broadcasts", "dead_letters",
+                      "events", "event_registrations")}
+
+        self.subscription_index = SubscriptionIndex()
+        # Запросов нет, статистика остается пустой (нужна для единого интерфейса)
+        self.query_stats = QueryStats()
+
+    # Подключение и схема
+    async def connect(self):
+        """
+        Хранилище в памяти готово к работе сразу после создания
+        """
+        logger.info("Используется хранилище данных в памяти (данные не сохраняются между запусками)")
+
+    async def close(self):
+        """
+        Ресурсы не освобождаются: данные остаются доступными до удаления объекта
+        """
+
+    async def migrate(self) -> int:
+        """
+        Схема хранилища в памяти всегда соответствует последней версии
+        """
+        return LATEST_VERSION
+
+    def _day_stats(self, ts: int) -> Dict[str, Any]:
+        """
+        Дневные счетчики за локальные сутки, содержащие ts (создаются при первом обращении)
+        """
+        day = _local_day(ts)
+        stats = self._daily.get(day)
+        if stats is None:
+            stats = self._daily[day] = {
+                "day": day, "new_users": 0, "new_referrals": 0,
+                "payments_created": 0, "payments_confirmed": 0, "revenue": 0,
+            }
+        return stats
+
+    # Пользователи
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        """
+        Добавление нового пользователя или обновление существующего
+        """
+        user = self._users.get(user_id)
+        if user is not None:
+            user.update(username=username, first_name=first_name, last_name=last_name,
+                        reachable=1, unreachable_ts=None)
+            return True
+
+        self._users[user_id] = {
+            "user_id": user_id, "username": username, "first_name": first_name, "last_name": last_name,
+            "registration_date": _current_timestamp(), "balance": 0, "is_admin": 0, "referral_count": 0,
+            "reachable": 1, "unreachable_ts": None,
+        }
+        insort(self._user_ids, user_id)
+        self._totals["users"] += 1
+        self._day_stats(now_ts())["new_users"] += 1
+        return True
+
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """
+        Получение информации о пользователе
+        """
+        user = self._users.get(user_id)
+        return User(**user) if user else None
+
+    async def update_user_balance(self, user_id: int, amount: int) -> int:
+        """
+        Обновление баланса пользователя
+        """
+        user = self._users.get(user_id)
+        if user is None:
+            return 0
+        user["balance"] += amount
+        return user["balance"]
+
+    async def set_user_reachable(self, user_id: int, reachable: bool) -> bool:
+        """
+        Отметка доступности пользователя для сообщений бота
+        """
+        user = self._users.get(user_id)
+        if user is None or user["reachable"] == int(reachable):
+            return False
+        user.update(reachable=int(reachable), unreachable_ts=None if reachable else now_ts())
+        return True
+
+    async def count_unreachable_users(self) -> int:
+        """
+        Количество пользователей, заблокировавших бота
+        """
+        return sum(1 for user in self._users.values() if not user["reachable"])
+
+    async def get_users_bulk(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """
+        Получение информации о нескольких пользователях
+        """
+        return {user_id: User(**self._users[user_id]) for user_id in user_ids if user_id in self._users}
+
+    def _segment_facts(self) -> Tuple[Set[int], Dict[int, Set[str]]]:
+        """
+        Данные для проверки сегмента: пользователи, у которых были подписки,
+        и продукты подтвержденных платежей по пользователям (вместе с архивом)
+        """
+        subscribed = {
+            subscription["user_id"]
+            for subscription in itertools.chain(self._subscriptions.values(), self._subscriptions_archive.values())
+        }
+        products: Dict[int, Set[str]] = {}
+        for payment in itertools.chain(self._payments.values(), self._payments_archive.values()):
+            if payment["status"] == "confirmed":
+                products.setdefault(payment["user_id"], set()).add(payment["product_type"])
+        return subscribed, products
+
+    def _matches(self, user: Dict[str, Any], segment: Optional[Segment], now: int,
+                 facts: Tuple[Set[int], Dict[int, Set[str]]]) -> bool:
+        """
+        Проверка пользователя по сегменту
+        """
+        if segment is None:
+            return True
+        user_id = user["user_id"]
+        subscribed, products = facts
+        active = self._active_subscription(user_id, now)
+        return segment.matches(
+            User(**user), now, active["end_ts"] if active else None,
+            user_id in subscribed, products.get(user_id, set()),
+            bool(self._referrals_by_referrer.get(user_id))
+        )
+
+    async def count_users(self, segment: Optional[Segment] = None) -> int:
+        """
+        Подсчет количества пользователей
+        """
+        if segment is None:
+            return len(self._users)
+        now = now_ts()
+        facts = self._segment_facts()
+        return sum(1 for user in self._users.values() if self._matches(user, segment, now, facts))
+
+    async def iter_user_pages(self, segment: Optional[Segment] = None,
+                              batch_size: int = ITER_BATCH_SIZE,
+                              analytics: bool = False) -> AsyncIterator[List[User]]:
+        """
+        Постраничный обход пользователей в порядке user_id
+        Как и в SQLite, страница выбирается по ключу, поэтому пользователи, добавленные
+        во время обхода с большим ID, тоже попадают в обход
+        """
+        last_id = None
+        while True:
+            start = 0 if last_id is None else bisect_right(self._user_ids, last_id)
+            now = now_ts()
+            facts = self._segment_facts() if segment is not None else (set(), {})
+            page = []
+            for user_id in itertools.islice(self._user_ids, start, None):
+                last_id = user_id
+                user = self._users[user_id]
+                if self._matches(user, segment, now, facts):
+                    page.append(User(**user))
+                    if len(page) >= batch_size:
+                        break
+            if not page:
+                return
+
+            yield page
+
+            if len(page) < batch_size:
+                return
+
+    # Подписки
+    def _active_subscription(self, user_id: int, now: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Активная подписка пользователя с самым поздним окончанием
+        :param now: если указано, учитываются только подписки, не истекшие к этому времени
+        """
+        best = None
+        for subscription_id in self._user_subscriptions.get(user_id, ()):
+            subscription = self._subscriptions[subscription_id]
+            if subscription["status"] != "active" or subscription["end_ts"] is None:
+                continue
+            if now is not None and subscription["end_ts"] <= now:
+                continue
+            if best is None or subscription["end_ts"] > best["end_ts"]:
+                best = subscription
+        return best
+
+    def _extend_subscription(self, user_id: int, days: int) -> Tuple[int, int]:
+        """
+        Продление активной подписки или создание новой
+        :return: ID подписки и новое время окончания
+        """
+        now = now_ts()
+        period = days * 86400
+
+        subscription = self._active_subscription(user_id)
+        if subscription is not None:
+            # Если дата окончания в прошлом, отсчитываем от текущего момента
+            current_end_ts = subscription["end_ts"]
+            new_end_ts = now + period if current_end_ts < now else current_end_ts + period
+            subscription["end_ts"] = new_end_ts
+            subscription["end_date"] = datetime.datetime.fromtimestamp(new_end_ts).isoformat()
+            return subscription["subscription_id"], new_end_ts
+
+        subscription_id = next(self._ids["subscriptions"])
+        new_end_ts = now + period
+        self._subscriptions[subscription_id] = {
+            "subscription_id": subscription_id, "user_id": user_id,
+            "start_date": _current_timestamp(), "end_date": datetime.datetime.fromtimestamp(new_end_ts).isoformat(),
+            "status": "active", "start_ts": now, "end_ts": new_end_ts,
+        }
+        self._user_subscriptions.setdefault(user_id, []).append(subscription_id)
+        self._totals["active_subscriptions"] += 1
+        return subscription_id, new_end_ts
+
+    async def add_subscription(self, user_id: int, days: int) -> int:
+        """
+        Добавление подписки для пользователя
+        """
+        subscription_id, end_ts = self._extend_subscription(user_id, days)
+        self.subscription_index.set(user_id, subscription_id, end_ts)
+        return subscription_id
+
+    async def check_subscription(self, user_id: int) -> Optional[Subscription]:
+        """
+        Проверка активной подписки пользователя
+        """
+        subscription = self._active_subscription(user_id, now_ts())
+        return Subscription(**subscription) if subscription else None
+
+    async def get_active_subscriptions_bulk(self, user_ids: Iterable[int],
+                                            analytics: bool = False) -> Dict[int, Subscription]:
+        """
+        Получение активных подписок нескольких пользователей
+        """
+        now = now_ts()
+        result = {}
+        for user_id in user_ids:
+            subscription = self._active_subscription(user_id, now)
+            if subscription:
+                result[user_id] = Subscription(**subscription)
+        return result
+
+    def _subscriptions_with_users(self, predicate) -> List[Subscription]:
+        """
+        Активные подписки, подходящие под условие, вместе с данными пользователей
+        """
+        result = []
+        for subscription in self._subscriptions.values():
+            user = self._users.get(subscription["user_id"])
+            if user is None or subscription["status"] != "active" or subscription["end_ts"] is None:
+                continue
+            if predicate(subscription["end_ts"]):
+                result.append(Subscription(
+                    **subscription, username=user["username"],
+                    first_name=user["first_name"], last_name=user["last_name"]
+                ))
+        return result
+
+    async def get_expiring_subscriptions(self, days: int = 3) -> List[Subscription]:
+        """
+        Получение списка подписок, которые истекают через указанное количество дней
+        """
+        target_date = (datetime.datetime.now() + datetime.timedelta(days=days)).date()
+        start_ts, end_ts = day_bounds_ts(target_date)
+        return self._subscriptions_with_users(lambda ts: start_ts <= ts < end_ts)
+
+    async def get_expired_subscriptions(self) -> List[Subscription]:
+        """
+        Получение списка истекших подписок, которые еще активны
+        """
+        now = now_ts()
+        return self._subscriptions_with_users(lambda ts: ts < now)
+
+    async def deactivate_subscription(self, subscription_id: int) -> bool:
+        """
+        Деактивация истекшей подписки (продленная после выборки истекших не деактивируется)
+        """
+        subscription = self._subscriptions.get(subscription_id)
+        if (subscription is None or subscription["status"] != "active"
+                or subscription["end_ts"] is None or subscription["end_ts"] > now_ts()):
+            return False
+        self._totals["active_subscriptions"] -= 1
+        subscription["status"] = "expired"
+        self.subscription_index.remove(subscription["user_id"], subscription_id)
+        return True
+
+    def _active_subscription_rows(self) -> List[Tuple[int, int, int]]:
+        """
+        Активные подписки для индекса: (user_id, subscription_id, end_ts)
+        """
+        return [
+            (subscription["user_id"], subscription["subscription_id"], subscription["end_ts"])
+            for subscription in self._subscriptions.values()
+            if subscription["status"] == "active" and subscription["end_ts"] is not None
+        ]
+
+    async def load_subscription_index(self) -> int:
+        """
+        Заполнение индекса активных подписок
+        """
+        self.subscription_index.load(self._active_subscription_rows())
+        return len(self.subscription_index)
+
+    async def verify_subscription_index(self) -> Dict[str, List[int]]:
+        """
+        Сверка индекса активных подписок с хранилищем и его перестроение при расхождении
+        """
+        rows = self._active_subscription_rows()
+        diff = self.subscription_index.diff(rows)
+        if any(diff.values()):
+            logger.warning(f"Индекс активных подписок расходится с хранилищем: {diff} - индекс перестроен")
+            self.subscription_index.load(rows)
+        return diff
+
+    async def get_user_subscriptions(self, user_id: int, include_archive: bool = False,
+                                     limit: int = 10) -> List[Subscription]:
+        """
+        История подписок пользователя (новые первыми)
+        """
+        rows = [dict(self._subscriptions[sid], archived_ts=None) for sid in self._user_subscriptions.get(user_id, ())]
+        if include_archive:
+            rows += [row for row in self._subscriptions_archive.values() if row["user_id"] == user_id]
+        # Как ORDER BY end_ts DESC в SQLite: подписки без даты окончания - в конце
+        rows.sort(key=lambda row: (row["end_ts"] is not None, row["end_ts"] or 0), reverse=True)
+        return [Subscription(**row) for row in rows[:limit]]
+
+    # Платежи
+    async def create_payment(self, user_id: int, amount: int, product_type: str, payment_method: str) -> int:
+        """
+        Создание новой записи о платеже
+        """
+        payment_id = next(self._ids["payments"])
+        created_ts = now_ts()
+        self._payments[payment_id] = {
+            "payment_id": payment_id, "user_id": user_id, "amount": amount, "product_type": product_type,
+            "payment_method": payment_method, "status": "pending", "created_at": _current_timestamp(),
+            "confirmed_at": None, "created_ts": created_ts, "confirmed_ts": None, "tx_id": None, "currency": None,
+        }
+        self._totals["payments"] += 1
+        self._day_stats(created_ts)["payments_created"] += 1
+        return payment_id
+
+    async def confirm_payment(self, payment_id: int) -> bool:
+        """
+        Подтверждение платежа
+        """
+        payment = self._payments.get(payment_id)
+        if payment is None:
+            return True
+
+        confirmed_ts = now_ts()
+        was_confirmed = payment["status"] == "confirmed"
+        payment.update(
+            status="confirmed", confirmed_ts=confirmed_ts,
+            confirmed_at=datetime.datetime.fromtimestamp(confirmed_ts).isoformat()
+        )
+        if not was_confirmed:
+            amount = payment["amount"] or 0
+            self._totals["payments_confirmed"] += 1
+            self._totals["revenue"] += amount
+            day_stats = self._day_stats(confirmed_ts)
+            day_stats["payments_confirmed"] += 1
+            day_stats["revenue"] += amount
+        return True
+
+    async def get_payment(self, payment_id: int) -> Optional[Payment]:
+        """
+        Получение информации о платеже
+        """
+        payment = self._payments.get(payment_id)
+        return Payment(**payment) if payment else None
+
+    async def get_pending_payments(self, limit: int = 15) -> List[Payment]:
+        """
+        Получение последних ожидающих подтверждения платежей (для администраторов)
+        """
+        pending = [payment for payment in self._payments.values() if payment["status"] == "pending"]
+        pending.sort(key=lambda payment: payment["created_at"], reverse=True)
+
+        result = []
+        for payment in pending[:limit]:
+            user = self._users.get(payment["user_id"], {})
+            result.append(Payment(**payment, username=user.get("username"), first_name=user.get("first_name")))
+        return result
+
+    async def attach_tx_id(self, payment_id: int, tx_id: str, currency: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Привязка уникального ID транзакции (TxID) к криптоплатежу
+        """
+        tx_id = normalize_tx_id(tx_id)
+
+        owner_id = self._tx_ids.get(tx_id)
+        if owner_id is not None and owner_id != payment_id:
+            logger.warning(f"TxID {tx_id} для платежа {payment_id} уже использован в платеже {owner_id}")
+            return {"attached": False, "tx_id": tx_id, "duplicate_payment_id": owner_id}
+
+        payment = self._payments.get(payment_id)
+        if payment is None:
+            return {"attached": False, "tx_id": tx_id, "duplicate_payment_id": None}
+
+        if payment["tx_id"] is not None:
+            self._tx_ids.pop(payment["tx_id"], None)
+        payment["tx_id"] = tx_id
+        if currency is not None:
+            payment["currency"] = currency
+        self._tx_ids[tx_id] = payment_id
+        return {"attached": True, "tx_id": tx_id, "duplicate_payment_id": None}
+
+    async def get_user_payments(self, user_id: int, include_archive: bool = False,
+                                limit: int = 10) -> List[Payment]:
+        """
+        История платежей пользователя (новые первыми)
+        """
+        rows = [dict(payment, archived_ts=None) for payment in self._payments.values() if payment["user_id"] == user_id]
+        if include_archive:
+            rows += [row for row in self._payments_archive.values() if row["user_id"] == user_id]
+        rows.sort(key=lambda row: (row["created_ts"] is not None, row["created_ts"] or 0), reverse=True)
+        return [Payment(**row) for row in rows[:limit]]
+
+    # Рефералы
+    def _insert_referral(self, user_id: int, referrer_id: int) -> int:
+        """
+        Запись о реферале (вместе со счетчиками, которые в SQLite обновляют триггеры)
+        :return: ID записи или 0, если пользователь уже является рефералом
+        """
+        if user_id in self._referral_by_user:
+            return 0
+
+        referral_id = next(self._ids["referrals"])
+        join_ts = now_ts()
+        self._referrals[referral_id] = {
+            "referral_id": referral_id, "user_id": user_id, "referrer_id": referrer_id,
+            "join_date": _current_timestamp(), "is_active": 1, "join_ts": join_ts,
+        }
+        self._referral_by_user[user_id] = referral_id
+        self._referrals_by_referrer.setdefault(referrer_id, []).append(referral_id)
+
+        referrer = self._users.get(referrer_id)
+        if referrer is not None:
+            referrer["referral_count"] += 1
+        self._totals["referrals"] += 1
+        self._day_stats(join_ts)["new_referrals"] += 1
+        return referral_id
+
+    async def add_referral(self, user_id: int, referrer_id: int) -> int:
+        """
+        Добавление записи о реферале
+        """
+        return self._insert_referral(user_id, referrer_id)
+
+    async def apply_referral(self, user_id: int, referrer_id: int, points: int, free_days: int) -> Optional[Dict[str, Any]]:
+        """
+        Начисление за приглашение: запись о реферале, баллы пригласившему и бесплатные дни приглашенному
+        """
+        referrer = self._users.get(referrer_id)
+        if referrer is None:
+            return None
+
+        referral_id = self._insert_referral(user_id, referrer_id)
+        if not referral_id:
+            return None
+
+        referrer["balance"] += points
+        subscription_id, end_ts = self._extend_subscription(user_id, free_days)
+        self.subscription_index.set(user_id, subscription_id, end_ts)
+
+        return {
+            "referral_id": referral_id,
+            "balance": referrer["balance"],
+            "referrals_count": referrer["referral_count"],
+            "subscription_id": subscription_id,
+            "end_ts": end_ts,
+        }
+
+    async def get_user_referrals(self, user_id: int) -> List[Referral]:
+        """
+        Получение списка рефералов пользователя
+        """
+        result = []
+        for referral_id in self._referrals_by_referrer.get(user_id, ()):
+            referral = self._referrals[referral_id]
+            user = self._users.get(referral["user_id"])
+            if user is None or not referral["is_active"]:
+                continue
+            result.append(Referral(
+                **referral, username=user["username"], first_name=user["first_name"], last_name=user["last_name"]
+            ))
+        result.sort(key=lambda referral: referral["join_ts"] or 0, reverse=True)
+        return result
+
+    async def get_user_referrer(self, user_id: int) -> Optional[User]:
+        """
+        Получение информации о пригласившем пользователе
+        """
+        referral_id = self._referral_by_user.get(user_id)
+        if referral_id is None or not self._referrals[referral_id]["is_active"]:
+            return None
+        referrer = self._users.get(self._referrals[referral_id]["referrer_id"])
+        return User(**referrer) if referrer else None
+
+    async def count_referrals_bulk(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        Подсчет количества рефералов нескольких пользователей
+        """
+        return {
+            user_id: self._users[user_id]["referral_count"] if user_id in self._users else 0
+            for user_id in user_ids
+        }
+
+    # Статистика
+    async def get_stats(self, days: int = 7) -> Dict[str, Any]:
+        """
+        Получение общей статистики
+        """
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        stats = dict(self._totals)
+        # Активной считается только неистекшая подписка (истекшие могут быть еще не деактивированы)
+        now = now_ts()
+        stats["active_subscriptions"] -= sum(
+            1 for subscription in self._subscriptions.values()
+            if subscription["status"] == "active" and (subscription["end_ts"] is None or subscription["end_ts"] <= now)
+        )
+        recent = [day_stats for day, day_stats in self._daily.items() if day >= since]
+        stats["recent_users"] = sum(day_stats["new_users"] for day_stats in recent)
+        stats["recent_payments"] = sum(day_stats["payments_created"] for day_stats in recent)
+        stats["recent_payments_confirmed"] = sum(day_stats["payments_confirmed"] for day_stats in recent)
+        stats["recent_revenue"] = sum(day_stats["revenue"] for day_stats in recent)
+        return stats
+
+    async def get_daily_stats(self, day: datetime.date) -> Dict[str, Any]:
+        """
+        Получение статистики за один день
+        """
+        day_stats = self._daily.get(day.isoformat())
+        if day_stats:
+            return dict(day_stats)
+        return {
+            "day": day.isoformat(), "new_users": 0, "new_referrals": 0,
+            "payments_created": 0, "payments_confirmed": 0, "revenue": 0,
+        }
+
+    # Архивация
+    async def archive_subscriptions(self, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """
+        Перенос истекших (деактивированных) подписок в архив
+        """
+        archived_ts = now_ts()
+        expired = [sid for sid, subscription in self._subscriptions.items() if subscription["status"] == "expired"]
+        for subscription_id in expired:
+            subscription = self._subscriptions.pop(subscription_id)
+            self._user_subscriptions[subscription["user_id"]].remove(subscription_id)
+            self._subscriptions_archive[subscription_id] = dict(subscription, archived_ts=archived_ts)
+        if expired:
+            logger.info(f"Перенесено в архив подписок: {len(expired)}")
+        return len(expired)
+
+    async def archive_payments(self, confirmed_days: int, pending_days: int,
+                               batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """
+        Перенос старых подтвержденных и брошенных неоплаченных платежей в архив
+        """
+        now = now_ts()
+        borders = {"confirmed": now - confirmed_days * 86400, "pending": now - pending_days * 86400}
+        old = [
+            payment_id for payment_id, payment in self._payments.items()
+            if payment["status"] in borders and payment["created_ts"] is not None
+            and payment["created_ts"] < borders[payment["status"]]
+        ]
+        for payment_id in old:
+            # TxID остается занятым: повторное использование проверяется и по архиву
+            self._payments_archive[payment_id] = dict(self._payments.pop(payment_id), archived_ts=now)
+        if old:
+            logger.info(f"Перенесено в архив платежей: {len(old)}")
+        return len(old)
+
+    # Рассылки
+    async def create_broadcast(self, created_by: int, message_type: str, text: Optional[str], file_id: Optional[str],
+                               total: int, status_chat_id: Optional[int] = None,
+                               status_message_id: Optional[int] = None, segment: Optional[Segment] = None) -> int:
+        """
+        Создание рассылки в статусе running
+        """
+        broadcast_id = next(self._ids["broadcasts"])
+        now = now_ts()
+        self._broadcasts[broadcast_id] = {
+            "broadcast_id": broadcast_id, "created_by": created_by, "created_ts": now,
+            "message_type": message_type, "text": text, "file_id": file_id,
+            "segment": segment.to_json() if segment is not None and not segment.is_empty else None,
+            "status": "running",
+            "cursor_user_id": None, "total": total, "sent": 0, "failed": 0,
+            "status_chat_id": status_chat_id, "status_message_id": status_message_id,
+            "started_ts": now, "finished_ts": None,
+        }
+        self._broadcast_recipients[broadcast_id] = {}
+        return broadcast_id
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        """
+        Получение рассылки
+        """
+        broadcast = self._broadcasts.get(broadcast_id)
+        return Broadcast(**broadcast) if broadcast else None
+
+    async def get_broadcasts(self, statuses: Optional[Iterable[str]] = None, limit: int = 10) -> List[Broadcast]:
+        """
+        Последние рассылки (новые первыми)
+        """
+        statuses = set(statuses) if statuses is not None else None
+        found = [
+            Broadcast(**broadcast) for broadcast_id, broadcast in sorted(self._broadcasts.items(), reverse=True)
+            if statuses is None or broadcast["status"] in statuses
+        ]
+        return found[:limit]
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str) -> bool:
+        """
+        Изменение статуса рассылки
+        """
+        broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is None:
+            return False
+        now = now_ts()
+        broadcast["status"] = status
+        if broadcast["started_ts"] is None:
+            broadcast["started_ts"] = now
+        broadcast["finished_ts"] = now if status in ("cancelled", "completed") else None
+        return True
+
+    async def reset_broadcast_recipients(self, broadcast_id: int) -> Dict[str, int]:
+        """
+        Подготовка рассылки к продолжению после паузы или перезапуска
+        """
+        now = now_ts()
+        requeued = interrupted = 0
+        for recipient in self._broadcast_recipients.get(broadcast_id, {}).values():
+            if recipient["status"] == "queued":
+                recipient.update(status="pending", updated_ts=now)
+                requeued += 1
+            elif recipient["status"] == "sending":
+                recipient.update(status="failed", error="interrupted", updated_ts=now)
+                interrupted += 1
+        if interrupted:
+            self._broadcasts[broadcast_id]["failed"] += interrupted
+        return {"requeued": requeued, "interrupted": interrupted}
+
+    async def claim_broadcast_recipients(self, broadcast_id: int, limit: int) -> List[int]:
+        """
+        Взятие в работу следующих получателей рассылки
+        """
+        broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is None:
+            return []
+        recipients = self._broadcast_recipients[broadcast_id]
+        now = now_ts()
+
+        user_ids = sorted(user_id for user_id, recipient in recipients.items() if recipient["status"] == "pending")[:limit]
+        for user_id in user_ids:
+            recipients[user_id].update(status="queued", updated_ts=now)
+        if len(user_ids) >= limit:
+            return user_ids
+
+        segment = Segment.from_json(broadcast["segment"])
+        facts = self._segment_facts()
+        cursor = broadcast["cursor_user_id"]
+        start = bisect_right(self._user_ids, cursor) if cursor is not None else 0
+        new_ids = list(itertools.islice(
+            (user_id for user_id in self._user_ids[start:] if self._matches(self._users[user_id], segment, now, facts)),
+            limit - len(user_ids)
+        ))
+        for user_id in new_ids:
+            recipients.setdefault(user_id, {"status": "queued", "error": None, "updated_ts": now})
+        if new_ids:
+            broadcast["cursor_user_id"] = new_ids[-1]
+        return sorted(user_ids + new_ids)
+
+    async def mark_broadcast_sending(self, broadcast_id: int, user_id: int):
+        """
+        Отметка получателя перед отправкой сообщения
+        """
+        recipient = self._broadcast_recipients.get(broadcast_id, {}).get(user_id)
+        if recipient is not None:
+            recipient.update(status="sending", updated_ts=now_ts())
+
+    async def finish_broadcast_recipient(self, broadcast_id: int, user_id: int, sent: bool,
+                                         error: Optional[str] = None):
+        """
+        Сохранение результата отправки получателю и счетчиков рассылки
+        """
+        recipient = self._broadcast_recipients.get(broadcast_id, {}).get(user_id)
+        if recipient is None or recipient["status"] in ("sent", "failed"):
+            return
+        status = "sent" if sent else "failed"
+        recipient.update(status=status, error=error, updated_ts=now_ts())
+        self._broadcasts[broadcast_id][status] += 1
+
+    # Недоставленные сообщения
+    async def add_dead_letter(self, campaign: str, chat_id: Optional[int], method: str, payload: str,
+                              error: Optional[str]) -> int:
+        """
+        Сохранение недоставленного сообщения для повторной отправки
+        """
+        dead_letter_id = next(self._ids["dead_letters"])
+        now = now_ts()
+        self._dead_letters[dead_letter_id] = {
+            "dead_letter_id": dead_letter_id, "created_ts": now, "campaign": campaign, "chat_id": chat_id,
+            "method": method, "payload": payload, "error": error, "attempts": 1,
+            "status": "pending", "updated_ts": now,
+        }
+        return dead_letter_id
+
+    async def get_dead_letters(self, campaign: Optional[str] = None, limit: int = 100) -> List[DeadLetter]:
+        """
+        Недоставленные сообщения, ожидающие повторной отправки (старые первыми)
+        """
+        found = [
+            DeadLetter(**letter) for letter in self._dead_letters.values()
+            if letter["status"] == "pending" and (campaign is None or letter["campaign"] == campaign)
+        ]
+        return found[:limit]
+
+    async def count_dead_letters(self) -> Dict[str, int]:
+        """
+        Количество ожидающих повторной отправки сообщений по кампаниям
+        """
+        counts: Dict[str, int] = {}
+        for letter in self._dead_letters.values():
+            if letter["status"] == "pending":
+                counts[letter["campaign"]] = counts.get(letter["campaign"], 0) + 1
+        return counts
+
+    async def resolve_dead_letter(self, dead_letter_id: int, delivered: bool, error: Optional[str] = None):
+        """
+        Сохранение результата повторной отправки
+        """
+        letter = self._dead_letters.get(dead_letter_id)
+        if letter is None:
+            return
+        if delivered:
+            if letter["status"] != "pending":
+                return
+            letter["status"] = "redriven"
+            broadcast_id = broadcast_campaign_id(letter["campaign"])
+            recipient = self._broadcast_recipients.get(broadcast_id, {}).get(letter["chat_id"])
+            if recipient is not None and recipient["status"] == "failed":
+                recipient.update(status="sent", error=None, updated_ts=now_ts())
+                self._broadcasts[broadcast_id]["sent"] += 1
+                self._broadcasts[broadcast_id]["failed"] -= 1
+        else:
+            letter["attempts"] += 1
+            letter["error"] = error
+        letter["updated_ts"] = now_ts()
+
+    # Мероприятия
+    async def add_event(self, name: str, description: str, event_date: datetime.datetime, price: int,
+                        max_participants: int = None) -> int:
+        """
+        Добавление нового мероприятия
+        """
+        event_id = next(self._ids["events"])
+        self._events[event_id] = {
+            "event_id": event_id, "name": name, "description": description,
+            "event_date": event_date.isoformat(), "price": price, "max_participants": max_participants,
+        }
+        return event_id
+
+    async def get_event(self, event_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получение информации о мероприятии
+        """
+        event = self._events.get(event_id)
+        return dict(event) if event else None
+
+    async def register_for_event(self, event_id: int, user_id: int, payment_id: int = None) -> int:
+        """
+        Регистрация пользователя на мероприятие
+        """
+        registration_id = next(self._ids["event_registrations"])
+        self._event_registrations[registration_id] = {
+            "registration_id": registration_id, "event_id": event_id, "user_id": user_id,
+            "payment_id": payment_id, "registration_date": _current_timestamp(), "status": "registered",
+        }
+        return registration_id
@@ -0,0 +1,518 @@
+"""
+Миграции схемы базы данных бота клуба X10.
+Каждая миграция имеет номер, описание и список шагов: SQL-выражений или
+асинхронных функций для преобразований, которые нельзя выразить на SQL.
+Примененные миграции записываются в таблицу schema_version.
+"""
+import logging
+import datetime
+from typing import Awaitable, Callable, List, Tuple, Union
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+# Шаг миграции: SQL-выражение или функция, получающая соединение
+MigrationStep = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+
+async def _backfill_tx_ids(db: aiosqlite.Connection):
+    """
+    Перенос TxID из способа оплаты вида crypto_ETH_TxID:... в столбец tx_id
+    Нормализация та же, что при привязке TxID (normalize_tx_id), иначе старые и новые
+    значения могут не совпасть и повтор пройдет мимо уникального индекса.
+    Из повторяющихся TxID остается первый, у остальных он остается в payment_method для ручной проверки
+    """
+    # Импорт здесь: модуль database сам импортирует миграции
+    from database import normalize_tx_id
+
+    seen = set()
+    for table in ("payments", "payments_archive"):
+        cursor = await db.execute(
+            f"SELECT payment_id, payment_method FROM {table} "
+            f"WHERE instr(payment_method, '_TxID:') > 0 ORDER BY payment_id"
+        )
+        for payment_id, payment_method in await cursor.fetchall():
+            method, _, raw_tx_id = payment_method.partition('_TxID:')
+            tx_id = normalize_tx_id(raw_tx_id)
+            # Уникальность TxID требуется только среди текущих платежей
+            if not tx_id or (table == "payments" and tx_id in seen):
+                continue
+            seen.add(tx_id)
+            await db.execute(
+                f"UPDATE {table} SET tx_id = ?, payment_method = ? WHERE payment_id = ?",
+                (tx_id, method, payment_id)
+            )
+
+
+# Список миграций: (номер, описание, шаги)
+# Новые миграции добавляются только в конец списка с увеличением номера
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (1, "Начальная схема", [
+        # Пользователи
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            balance INTEGER DEFAULT 0,
+            is_admin BOOLEAN DEFAULT 0
+        )
+        ''',
+        # Подписки на клуб
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Платежи
+        '''
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            product_type TEXT,
+            payment_method TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            confirmed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Реферальная система
+        '''
+        CREATE TABLE IF NOT EXISTS referrals (
+            referral_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            referrer_id INTEGER,
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (referrer_id) REFERENCES users (user_id)
+        )
+        ''',
+        # Мероприятия и регистрации
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            description TEXT,
+            event_date TIMESTAMP,
+            price INTEGER,
+            max_participants INTEGER DEFAULT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS event_registrations (
+            registration_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            user_id INTEGER,
+            payment_id INTEGER,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'registered',
+            FOREIGN KEY (event_id) REFERENCES events (event_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (payment_id) REFERENCES payments (payment_id)
+        )
+        ''',
+    ]),
+    (2, "Индексы для поиска подписок, рефералов и платежей", [
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status_end ON subscriptions (user_id, status, end_date)",
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer_active ON referrals (referrer_id, is_active)",
+        "CREATE INDEX IF NOT EXISTS idx_referrals_user ON referrals (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments (status, created_at)",
+    ]),
+    (3, "Частичный индекс ожидающих платежей", [
+        "CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments (created_at) WHERE status = 'pending'",
+    ]),
+    (4, "Целочисленные метки времени (Unix epoch, UTC) и индексы по ним", [
+        "ALTER TABLE subscriptions ADD COLUMN start_ts INTEGER",
+        "ALTER TABLE subscriptions ADD COLUMN end_ts INTEGER",
+        "ALTER TABLE payments ADD COLUMN created_ts INTEGER",
+        "ALTER TABLE payments ADD COLUMN confirmed_ts INTEGER",
+        "ALTER TABLE referrals ADD COLUMN join_ts INTEGER",
+        # Значения по умолчанию CURRENT_TIMESTAMP записаны в UTC,
+        # а end_date и confirmed_at - в локальном времени сервера
+        "UPDATE subscriptions SET start_ts = CAST(strftime('%s', start_date) AS INTEGER) WHERE start_date IS NOT NULL",
+        "UPDATE subscriptions SET end_ts = CAST(strftime('%s', end_date, 'utc') AS INTEGER) WHERE end_date IS NOT NULL",
+        "UPDATE payments SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) WHERE created_at IS NOT NULL",
+        "UPDATE payments SET confirmed_ts = CAST(strftime('%s', confirmed_at, 'utc') AS INTEGER) WHERE confirmed_at IS NOT NULL",
+        "UPDATE referrals SET join_ts = CAST(strftime('%s', join_date) AS INTEGER) WHERE join_date IS NOT NULL",
+        "DROP INDEX IF EXISTS idx_subscriptions_user_status_end",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user_status_end_ts ON subscriptions (user_id, status, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_status_end_ts ON subscriptions (status, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_created_ts ON payments (created_ts)",
+    ]),
+    (5, "Уникальность реферала для пользователя", [
+        # Оставляем только первую запись о реферале для каждого пользователя
+        """
+        DELETE FROM referrals
+        WHERE referral_id NOT IN (SELECT MIN(referral_id) FROM referrals GROUP BY user_id)
+        """,
+        "DROP INDEX IF EXISTS idx_referrals_user",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_user_unique ON referrals (user_id)",
+    ]),
+    (6, "Счетчик активных рефералов в users, поддерживаемый триггерами", [
+        "ALTER TABLE users ADD COLUMN referral_count INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE users SET referral_count = (
+            SELECT COUNT(*) FROM referrals r
+            WHERE r.referrer_id = users.user_id AND r.is_active = 1
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_referrals_count_insert
+        AFTER INSERT ON referrals
+        WHEN NEW.is_active = 1
+        BEGIN
+            UPDATE users SET referral_count = referral_count + 1 WHERE user_id = NEW.referrer_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_referrals_count_update
+        AFTER UPDATE OF is_active, referrer_id ON referrals
+        BEGIN
+            UPDATE users SET referral_count = referral_count - 1
+            WHERE user_id = OLD.referrer_id AND OLD.is_active = 1;
+            UPDATE users SET referral_count = referral_count + 1
+            WHERE user_id = NEW.referrer_id AND NEW.is_active = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_referrals_count_delete
+        AFTER DELETE ON referrals
+        WHEN OLD.is_active = 1
+        BEGIN
+            UPDATE users SET referral_count = referral_count - 1 WHERE user_id = OLD.referrer_id;
+        END
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_users_referral_count ON users (referral_count)",
+    ]),
+    (7, "Агрегированная статистика: по дням и нарастающим итогом", [
+        # Дни - локальные даты сервера (как в ежедневном отчете администраторам)
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            new_referrals INTEGER NOT NULL DEFAULT 0,
+            payments_created INTEGER NOT NULL DEFAULT 0,
+            payments_confirmed INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL DEFAULT 0,
+            referrals INTEGER NOT NULL DEFAULT 0,
+            payments INTEGER NOT NULL DEFAULT 0,
+            payments_confirmed INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            active_subscriptions INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Заполнение по уже накопленным данным
+        """
+        INSERT OR REPLACE INTO stats_totals (id, users, referrals, payments, payments_confirmed, revenue, active_subscriptions)
+        SELECT 1,
+               (SELECT COUNT(*) FROM users),
+               (SELECT COUNT(*) FROM referrals),
+               (SELECT COUNT(*) FROM payments),
+               (SELECT COUNT(*) FROM payments WHERE status = 'confirmed'),
+               (SELECT COALESCE(SUM(amount), 0) FROM payments WHERE status = 'confirmed'),
+               (SELECT COUNT(*) FROM subscriptions WHERE status = 'active')
+        """,
+        """
+        INSERT OR REPLACE INTO stats_daily (day, new_users, new_referrals, payments_created, payments_confirmed, revenue)
+        SELECT day, SUM(new_users), SUM(new_referrals), SUM(payments_created), SUM(payments_confirmed), SUM(revenue)
+        FROM (
+            SELECT date(registration_date, 'localtime') AS day,
+                   1 AS new_users, 0 AS new_referrals, 0 AS payments_created, 0 AS payments_confirmed, 0 AS revenue
+            FROM users WHERE registration_date IS NOT NULL
+            UNION ALL
+            SELECT date(join_ts, 'unixepoch', 'localtime'), 0, 1, 0, 0, 0
+            FROM referrals WHERE join_ts IS NOT NULL
+            UNION ALL
+            SELECT date(created_ts, 'unixepoch', 'localtime'), 0, 0, 1, 0, 0
+            FROM payments WHERE created_ts IS NOT NULL
+            UNION ALL
+            SELECT date(confirmed_ts, 'unixepoch', 'localtime'), 0, 0, 0, 1, amount
+            FROM payments WHERE status = 'confirmed' AND confirmed_ts IS NOT NULL
+        )
+        GROUP BY day
+        """,
+        # Триггеры, обновляющие статистику при изменении данных
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_totals SET users = users + 1 WHERE id = 1;
+            INSERT OR IGNORE INTO stats_daily (day) VALUES (date('now', 'localtime'));
+            UPDATE stats_daily SET new_users = new_users + 1 WHERE day = date('now', 'localtime');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_referrals_insert
+        AFTER INSERT ON referrals
+        BEGIN
+            UPDATE stats_totals SET referrals = referrals + 1 WHERE id = 1;
+            INSERT OR IGNORE INTO stats_daily (day)
+            VALUES (date(COALESCE(NEW.join_ts, strftime('%s', 'now')), 'unixepoch', 'localtime'));
+            UPDATE stats_daily SET new_referrals = new_referrals + 1
+            WHERE day = date(COALESCE(NEW.join_ts, strftime('%s', 'now')), 'unixepoch', 'localtime');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_payments_insert
+        AFTER INSERT ON payments
+        BEGIN
+            UPDATE stats_totals SET payments = payments + 1 WHERE id = 1;
+            INSERT OR IGNORE INTO stats_daily (day)
+            VALUES (date(COALESCE(NEW.created_ts, strftime('%s', 'now')), 'unixepoch', 'localtime'));
+            UPDATE stats_daily SET payments_created = payments_created + 1
+            WHERE day = date(COALESCE(NEW.created_ts, strftime('%s', 'now')), 'unixepoch', 'localtime');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_payments_confirm
+        AFTER UPDATE OF status ON payments
+        WHEN NEW.status = 'confirmed' AND OLD.status IS NOT 'confirmed'
+        BEGIN
+            UPDATE stats_totals SET
+                payments_confirmed = payments_confirmed + 1,
+                revenue = revenue + COALESCE(NEW.amount, 0)
+            WHERE id = 1;
+            INSERT OR IGNORE INTO stats_daily (day)
+            VALUES (date(COALESCE(NEW.confirmed_ts, strftime('%s', 'now')), 'unixepoch', 'localtime'));
+            UPDATE stats_daily SET
+                payments_confirmed = payments_confirmed + 1,
+                revenue = revenue + COALESCE(NEW.amount, 0)
+            WHERE day = date(COALESCE(NEW.confirmed_ts, strftime('%s', 'now')), 'unixepoch', 'localtime');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_subscriptions_insert
+        AFTER INSERT ON subscriptions
+        WHEN NEW.status = 'active'
+        BEGIN
+            UPDATE stats_totals SET active_subscriptions = active_subscriptions + 1 WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_subscriptions_status
+        AFTER UPDATE OF status ON subscriptions
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE stats_totals SET active_subscriptions = active_subscriptions
+                - (OLD.status = 'active') + (NEW.status = 'active')
+            WHERE id = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_subscriptions_delete
+        AFTER DELETE ON subscriptions
+        WHEN OLD.status = 'active'
+        BEGIN
+            UPDATE stats_totals SET active_subscriptions = active_subscriptions - 1 WHERE id = 1;
+        END
+        """,
+    ]),
+    (8, "Архивные таблицы для истекших подписок и завершенных платежей", [
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions_archive (
+            subscription_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            start_date TIMESTAMP,
+            end_date TIMESTAMP,
+            status TEXT,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            archived_ts INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payments_archive (
+            payment_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            amount INTEGER,
+            product_type TEXT,
+            payment_method TEXT,
+            status TEXT,
+            created_at TIMESTAMP,
+            confirmed_at TIMESTAMP,
+            created_ts INTEGER,
+            confirmed_ts INTEGER,
+            archived_ts INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_archive_user ON subscriptions_archive (user_id, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_archive_user ON payments_archive (user_id, created_ts)",
+        # Отбор завершенных платежей для архивации и история платежей пользователя
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_created_ts ON payments (status, created_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_created_ts ON payments (user_id, created_ts)",
+    ]),
+    (9, "Отдельные столбцы для TxID и криптовалюты платежа", [
+        "ALTER TABLE payments ADD COLUMN tx_id TEXT",
+        "ALTER TABLE payments ADD COLUMN currency TEXT",
+        "ALTER TABLE payments_archive ADD COLUMN tx_id TEXT",
+        "ALTER TABLE payments_archive ADD COLUMN currency TEXT",
+        # Криптовалюта - вторая часть способа оплаты вида crypto_ETH[_TxID:...]
+        """
+        UPDATE payments SET currency = CASE
+            WHEN instr(substr(payment_method, 8), '_') > 0
+            THEN substr(payment_method, 8, instr(substr(payment_method, 8), '_') - 1)
+            ELSE substr(payment_method, 8)
+        END
+        WHERE payment_method LIKE 'crypto\\_%' ESCAPE '\\'
+        """,
+        _backfill_tx_ids,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_tx_id ON payments (tx_id) WHERE tx_id IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_payments_archive_tx_id ON payments_archive (tx_id) WHERE tx_id IS NOT NULL",
+    ]),
+    (10, "Рассылки с сохраняемым состоянием и получатели рассылок", [
+        # cursor_user_id - последний пользователь, взятый в работу (получатели выбираются по возрастанию user_id)
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_by INTEGER,
+            created_ts INTEGER NOT NULL,
+            message_type TEXT NOT NULL,
+            text TEXT,
+            file_id TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor_user_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            started_ts INTEGER,
+            finished_ts INTEGER
+        )
+        """,
+        # Статусы получателя: queued (взят в работу), pending (возвращен в очередь после паузы),
+        # sending (отправляется), sent, failed
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            error TEXT,
+            updated_ts INTEGER,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients (broadcast_id, status, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+    ]),
+    (11, "Сегмент аудитории рассылки и индекс по дате регистрации", [
+        # Условия сегмента в JSON (segments.Segment.to_json); NULL - все пользователи
+        "ALTER TABLE broadcasts ADD COLUMN segment TEXT",
+        # Отбор и подсчет пользователей по дате регистрации
+        "CREATE INDEX IF NOT EXISTS idx_users_registration_date ON users (registration_date)",
+    ]),
+    (12, "Недоставленные сообщения для повторной отправки", [
+        # method и payload - название метода Bot API и его параметры в JSON;
+        # status: pending (ждет повторной отправки) или redriven (доставлено повторно)
+        """
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            dead_letter_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_ts INTEGER NOT NULL,
+            campaign TEXT NOT NULL,
+            chat_id INTEGER,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'pending',
+            updated_ts INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_dead_letters_status_campaign ON dead_letters (status, campaign, dead_letter_id)",
+    ]),
+    (13, "Доступность пользователя для сообщений бота", [
+        # reachable = 0 - пользователь заблокировал бота или чат не найден (с unreachable_ts)
+        "ALTER TABLE users ADD COLUMN reachable INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE users ADD COLUMN unreachable_ts INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_users_unreachable ON users (unreachable_ts) WHERE reachable = 0",
+    ]),
+    (14, "Не больше одной активной подписки на пользователя", [
+        # Индекс активных подписок хранит одну подписку на пользователя: из повторов (старые версии
+        # бота создавали новую подписку при каждой оплате) оставляем самую позднюю, остальные завершаем
+        """
+        UPDATE subscriptions SET status = 'expired'
+        WHERE status = 'active' AND EXISTS (
+            SELECT 1 FROM subscriptions s
+            WHERE s.user_id = subscriptions.user_id AND s.status = 'active'
+            AND (COALESCE(s.end_ts, 0) > COALESCE(subscriptions.end_ts, 0)
+                 OR (COALESCE(s.end_ts, 0) = COALESCE(subscriptions.end_ts, 0)
+                     AND s.subscription_id > subscriptions.subscription_id))
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_one_active ON subscriptions (user_id) WHERE status = 'active'",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """
+    Получение текущей версии схемы
+    :param db: Соединение с базой данных
+    :return: Номер последней примененной миграции (0, если миграций не было)
+    """
+    cursor = await db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )
+    if not await cursor.fetchone():
+        return 0
+
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+    row = await cursor.fetchone()
+    return row[0] or 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """
+    Применение недостающих миграций
+    Вызывается внутри транзакции соединения для записи
+    :param db: Соединение с базой данных
+    :return: Номер версии схемы после применения миграций
+    """
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP
+    )
+    ''')
+
+    current_version = await get_schema_version(db)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        for statement in statements:
+            if callable(statement):
+                await statement(db)
+            else:
+                await db.execute(statement)
+
+        await db.execute(
+            "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+            (version, description, datetime.datetime.now().isoformat())
+        )
+        current_version = version
+        logger.info(f"Применена миграция {version}: {description}")
+
+    return current_version
@@ -0,0 +1,398 @@
+"""
+Планировщик исходящих сообщений бота клуба X10.
+Все запросы к Telegram проходят через middleware сессии бота, поэтому ограничения
+действуют для обработчиков, задач планировщика и рассылок одинаково:
+- общее «ведро токенов» на все отправки (лимит Telegram около 30 сообщений в секунду);
+- отдельное ведро на каждый чат (около 1 сообщения в секунду в личный чат, 20 в минуту в группу);
+- очереди приоритетов: транзакционные сообщения (подтверждения платежей, уведомления
+  администраторам) получают токен раньше интерактивных ответов, а те - раньше рассылок.
+Приоритет задается контекстной переменной (send_priority), поэтому вызовы bot.send_message не меняются.
+Ответ 429 (TelegramRetryAfter) не считается ошибкой доставки: запрос повторяется после retry_after,
+а при серии 429 общая скорость снижается вдвое и затем плавно восстанавливается (AIMD), поэтому
+темп устанавливается около реального лимита Telegram. Общую паузу вызывают только 429 на отправки
+сообщений. Сетевые ошибки и ответы 5xx повторяются с экспоненциальной задержкой со случайным
+разбросом только для идемпотентных запросов: отправка сообщения могла дойти до Telegram, поэтому
+не повторяется, чтобы сообщение не пришло дважды (ошибку получает вызывающий).
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import OutboundConfig
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше - раньше)
+PRIORITY_TRANSACTIONAL = 0  # Подтверждения платежей, уведомления администраторам
+PRIORITY_INTERACTIVE = 1  # Ответы пользователю в обработчиках
+PRIORITY_BULK = 2  # Рассылки и напоминания планировщика
+
+PRIORITY_NAMES = {
+    PRIORITY_TRANSACTIONAL: "transactional",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK: "bulk",
+}
+
+# Приоритет отправок в текущем контексте (обработчике, задаче планировщика)
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+# Сколько ведер чатов хранить, прежде чем удалять заполненные (неактивные) ведра
+CHAT_BUCKETS_PRUNE_SIZE = 10000
+
+# Методы, создающие новое сообщение: ограничиваются по скорости и не повторяются после сетевой ошибки
+SEND_METHOD_PREFIXES = ("Send", "Copy", "Forward")
+
+
+@contextmanager
+def send_priority(priority: int) -> Iterator[None]:
+    """
+    Приоритет всех отправок внутри блока with
+    :param priority: PRIORITY_TRANSACTIONAL, PRIORITY_INTERACTIVE или PRIORITY_BULK
+    """
+    token = outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+def with_priority(priority: int) -> Callable:
+    """
+    Декоратор корутины: все отправки внутри нее выполняются с указанным приоритетом
+    :param priority: PRIORITY_TRANSACTIONAL, PRIORITY_INTERACTIVE или PRIORITY_BULK
+    """
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with send_priority(priority):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Сколько ждать до появления токена (0 - токен есть)
+        """
+        now = time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """
+        Взятие токена (после delay() == 0)
+        """
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        """
+        Резервирование токена с ожиданием: ведро может уйти в минус,
+        следующий вызывающий будет ждать дольше
+        :return: Сколько ждать до отправки
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии бота, выдающий разрешения на отправку по ведрам токенов и приоритетам"""
+
+    def __init__(self, config: OutboundConfig, admin_ids: Optional[List[int]] = None):
+        """
+        :param config: настройки ограничений
+        :param admin_ids: ID администраторов - сообщения им всегда транзакционные
+        """
+        self.config = config
+        self.admin_ids = frozenset(admin_ids or ())
+
+        self._global = TokenBucket(config.global_rate, config.global_burst)
+        self._chats: Dict[int, TokenBucket] = {}
+
+        # Очередь ожидающих глобальный токен: (приоритет, порядковый номер, future)
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # Ответы 429 за последние flood_window секунд, пауза всех отправок и время последнего изменения скорости
+        self._floods: deque = deque()
+        self._paused_until = 0.0
+        self._rate_changed = time.monotonic()
+        # До этого времени повторная серия 429 не снижает скорость
+        self._backoff_until = 0.0
+
+        # Статистика по приоритетам: отправлено и суммарное ожидание
+        self.sent = {priority: 0 for priority in PRIORITY_NAMES}
+        self.waited = {priority: 0.0 for priority in PRIORITY_NAMES}
+        # Статистика повторов: ответы 429, снижения общей скорости, повторы после сетевых ошибок
+        self.retry_after_count = 0
+        self.backoff_count = 0
+        self.network_retry_count = 0
+
+    @staticmethod
+    def _is_limited(method: TelegramMethod) -> bool:
+        """
+        Ограничиваются только отправки новых сообщений (send*, copy, forward)
+        """
+        return type(method).__name__.startswith(SEND_METHOD_PREFIXES) and getattr(method, "chat_id", None) is not None
+
+    @staticmethod
+    def _is_idempotent(method: TelegramMethod) -> bool:
+        """
+        Повтор запроса не создает второго сообщения (редактирование, ответы на callback, запросы данных)
+        """
+        return not type(method).__name__.startswith(SEND_METHOD_PREFIXES)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        """
+        Ведро токенов чата (группы и каналы - с отрицательным ID или @username - ограничены строже)
+        """
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_PRUNE_SIZE:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full()}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.config.group_rate, self.config.group_burst)
+            else:
+                bucket = TokenBucket(self.config.chat_rate, self.config.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        """
+        Выдача глобальных токенов ожидающим в порядке приоритета
+        """
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Общая пауза после серии ответов 429
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self._global.delay()
+            if delay > 0:
+                # За время ожидания мог прийти запрос с более высоким приоритетом - он встанет в начало очереди
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                # Вызывающий отменил ожидание
+                continue
+            self._global.take()
+            future.set_result(None)
+
+    async def acquire(self, chat_id: Any, priority: int):
+        """
+        Ожидание разрешения на отправку в чат
+        :param chat_id: ID чата
+        :param priority: приоритет отправки
+        """
+        # Сначала ограничение чата: ожидание одного чата не задерживает остальные
+        chat_delay = self._chat_bucket(chat_id).reserve()
+        if chat_delay > 0:
+            await asyncio.sleep(chat_delay)
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound_dispatcher")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), future))
+        self._wakeup.set()
+        await future
+
+    def _on_retry_after(self, chat_id: Any, retry_after: float):
+        """
+        Учет ответа 429: чат ждет retry_after, при серии ответов общая скорость снижается
+        :param chat_id: ID чата (None - запрос без ограничения чата)
+        :param retry_after: сколько секунд ждать по ответу Telegram
+        """
+        now = time.monotonic()
+        self.retry_after_count += 1
+
+        if chat_id is not None:
+            # Следующая отправка в этот чат (в том числе повтор) подождет retry_after
+            bucket = self._chat_bucket(chat_id)
+            bucket.tokens = min(bucket.tokens, 1 - retry_after * bucket.rate)
+            bucket.updated = now
+
+        self._floods.append(now)
+        while self._floods and self._floods[0] < now - self.config.flood_window:
+            self._floods.popleft()
+        if len(self._floods) < self.config.flood_cluster:
+            return
+
+        # Серия ответов 429 - превышен общий лимит: пауза всех отправок
+        self._floods.clear()
+        self._paused_until = max(self._paused_until, now + retry_after)
+        if now < self._backoff_until:
+            # Ответы на запросы, отправленные до прошлого снижения, скорость повторно не снижают
+            return
+
+        # Мультипликативное снижение скорости; запас без ожидания уменьшается пропорционально,
+        # иначе после паузы запас снова ушел бы одной пачкой
+        self._set_rate(max(self.config.min_rate, self._global.rate * self.config.rate_decrease))
+        self._global.tokens = min(self._global.tokens, 0)
+        self._rate_changed = self._paused_until
+        self._backoff_until = self._paused_until + self.config.flood_window
+        self.backoff_count += 1
+        logger.warning(
+            f"Серия ответов 429: отправки приостановлены на {retry_after} сек, "
+            f"скорость снижена до {self._global.rate:.1f} сообщений в секунду"
+        )
+
+    def _on_success(self):
+        """
+        Аддитивное восстановление общей скорости после успешной отправки (не чаще раза в секунду)
+        """
+        if self._global.rate >= self.config.global_rate:
+            return
+        now = time.monotonic()
+        if now - self._rate_changed >= 1.0:
+            self._set_rate(min(self.config.global_rate, self._global.rate + self.config.rate_increase))
+            self._rate_changed = now
+
+    def _set_rate(self, rate: float):
+        """
+        Изменение общей скорости (запас без ожидания меняется пропорционально)
+        """
+        self._global.rate = rate
+        self._global.capacity = max(1.0, self.config.global_burst * rate / self.config.global_rate)
+        self._global.tokens = min(self._global.tokens, self._global.capacity)
+
+    def _network_retry_delay(self, attempt: int) -> float:
+        """
+        Задержка перед повтором после сетевой ошибки: экспоненциальная, со случайным разбросом
+        (разброс не дает всем ожидающим запросам повториться одновременно)
+        :param attempt: номер повтора (с нуля)
+        """
+        return random.uniform(0, min(self.config.retry_max_delay, self.config.retry_base_delay * 2 ** attempt))
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self.config.enabled:
+            return await make_request(bot, method)
+
+        limited = self._is_limited(method)
+        chat_id = method.chat_id if limited else None
+        priority = PRIORITY_TRANSACTIONAL if chat_id in self.admin_ids else outbound_priority.get()
+
+        attempt = 0
+        while True:
+            if limited:
+                started = time.monotonic()
+                await self.acquire(chat_id, priority)
+                if attempt == 0:
+                    # Статистика по логическим отправкам: повторы не учитываются
+                    self.sent[priority] += 1
+                    self.waited[priority] += time.monotonic() - started
+
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if limited:
+                    self._on_retry_after(chat_id, e.retry_after)
+                else:
+                    # 429 на запрос без ограничения скорости не говорит о превышении общего лимита отправок
+                    self.retry_after_count += 1
+                if attempt >= self.config.max_retries:
+                    raise
+                attempt += 1
+                if not limited:
+                    # Отправки с ограничением подождут через ведра токенов, остальные ждут здесь
+                    await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                # Запрос мог быть выполнен: отправку сообщения не повторяем, чтобы не отправить его дважды
+                if attempt >= self.config.max_retries or not self._is_idempotent(method):
+                    raise
+                delay = self._network_retry_delay(attempt)
+                attempt += 1
+                self.network_retry_count += 1
+                logger.warning(f"Ошибка запроса {type(method).__name__}: {e}. Повтор {attempt} через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+                continue
+
+            if limited:
+                self._on_success()
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика отправок по приоритетам и повторов
+        :return: Словарь с lanes ({название приоритета: {"sent", "avg_wait"}}), размером очереди,
+                 текущей общей скоростью и счетчиками повторов
+        """
+        lanes = {
+            name: {
+                "sent": self.sent[priority],
+                "avg_wait": self.waited[priority] / self.sent[priority] if self.sent[priority] else 0.0,
+            }
+            for priority, name in PRIORITY_NAMES.items()
+        }
+        return {
+            "lanes": lanes,
+            "queued": len(self._queue),
+            "chats": len(self._chats),
+            "rate": self._global.rate,
+            "retry_after": self.retry_after_count,
+            "backoffs": self.backoff_count,
+            "network_retries": self.network_retry_count,
+        }
+
+    async def close(self):
+        """
+        Остановка задачи выдачи токенов (при остановке бота)
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
@@ -0,0 +1,125 @@
+"""
+Компактные записи для строк базы данных бота клуба X10.
+Записи хранят значения в __slots__ и поддерживают доступ как к словарю
+(record['user_id'], record.get('username')), поэтому обработчики работают с ними
+так же, как раньше со словарями.
+"""
+from typing import Any, Dict, Iterator, Tuple
+import sqlite3
+
+
+class Record:
+    """Базовый класс записи"""
+    __slots__ = ()
+
+    # Названия полей (заполняются автоматически из __slots__ наследника)
+    _fields: Tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(cls.__slots__)
+        cls._field_set = frozenset(cls._fields)
+
+    def __init__(self, **values: Any):
+        """
+        Создание записи из именованных значений (отсутствующие поля равны None)
+        """
+        for name in self._fields:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Record":
+        """
+        Создание записи из строки результата запроса
+        Столбцы, которых нет среди полей записи, пропускаются
+        :param row: строка sqlite3.Row
+        :return: Запись
+        """
+        record = cls.__new__(cls)
+        for name in cls._fields:
+            setattr(record, name, None)
+        for name, value in zip(row.keys(), row):
+            if name in cls._field_set:
+                setattr(record, name, value)
+        return record
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Получение значения поля (как dict.get)
+        """
+        if key in self._field_set:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._field_set
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Преобразование записи в словарь
+        """
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+class User(Record):
+    """Пользователь"""
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'registration_date',
+                 'balance', 'is_admin', 'referral_count', 'reachable', 'unreachable_ts')
+
+
+class Subscription(Record):
+    """Подписка (поля username/first_name/last_name заполняются при выборке вместе с пользователем,
+    archived_ts - у подписок из архива)"""
+    __slots__ = ('subscription_id', 'user_id', 'start_date', 'end_date', 'status', 'start_ts', 'end_ts',
+                 'username', 'first_name', 'last_name', 'archived_ts')
+
+
+class Payment(Record):
+    """Платеж (поля username/first_name заполняются при выборке вместе с пользователем,
+    archived_ts - у платежей из архива)"""
+    __slots__ = ('payment_id', 'user_id', 'amount', 'product_type', 'payment_method', 'status',
+                 'created_at', 'confirmed_at', 'created_ts', 'confirmed_ts', 'tx_id', 'currency',
+                 'username', 'first_name', 'archived_ts')
+
+
+class Broadcast(Record):
+    """Рассылка (счетчики sent/failed и курсор cursor_user_id сохраняются по ходу отправки)"""
+    __slots__ = ('broadcast_id', 'created_by', 'created_ts', 'message_type', 'text', 'file_id', 'segment', 'status',
+                 'cursor_user_id', 'total', 'sent', 'failed', 'status_chat_id', 'status_message_id',
+                 'started_ts', 'finished_ts')
+
+
+class DeadLetter(Record):
+    """Недоставленное сообщение (метод Bot API и параметры в JSON)"""
+    __slots__ = ('dead_letter_id', 'created_ts', 'campaign', 'chat_id', 'method', 'payload', 'error',
+                 'attempts', 'status', 'updated_ts')
+
+
+class Referral(Record):
+    """Реферал (поля username/first_name/last_name - данные приглашенного пользователя)"""
+    __slots__ = ('referral_id', 'user_id', 'referrer_id', 'join_date', 'is_active', 'join_ts',
+                 'username', 'first_name', 'last_name')
@@ -0,0 +1,335 @@
+"""
+Интерфейс хранилища данных бота клуба X10.
+Обработчики и задачи планировщика работают только с методами Repository,
+поэтому хранилище можно заменить: SQLite (database.Database) для работы бота
+и хранилище в памяти (memory_database.MemoryDatabase) для тестов и замеров.
+"""
+import datetime
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from config import DbConfig
+from instrumentation import QueryStats
+from records import User, Subscription, Payment, Referral, Broadcast, DeadLetter
+from segments import Segment
+from subscription_index import SubscriptionIndex
+
+# Размер страницы при постраничном обходе пользователей
+ITER_BATCH_SIZE = 500
+
+# Размер пачки при архивации
+ARCHIVE_BATCH_SIZE = 500
+
+# Префикс кампании недоставленных сообщений рассылки (broadcast:ID)
+BROADCAST_CAMPAIGN_PREFIX = "broadcast:"
+
+
+def broadcast_campaign_id(campaign: Optional[str]) -> Optional[int]:
+    """
+    ID рассылки из названия кампании вида broadcast:ID
+    :return: ID рассылки или None, если кампания - не рассылка
+    """
+    if not campaign or not campaign.startswith(BROADCAST_CAMPAIGN_PREFIX):
+        return None
+    value = campaign[len(BROADCAST_CAMPAIGN_PREFIX):]
+    return int(value) if value.isdigit() else None
+
+
+class Repository(ABC):
+    """Хранилище данных бота: пользователи, подписки, платежи, рефералы, статистика и мероприятия"""
+
+    # Путь к файлу базы данных (None у хранилищ без файла - резервное копирование и обслуживание недоступны)
+    db_path: Optional[str] = None
+
+    # Индекс активных подписок в памяти
+    subscription_index: SubscriptionIndex
+
+    # Статистика времени выполнения запросов
+    query_stats: QueryStats
+
+    # Подключение и схема
+    @abstractmethod
+    async def connect(self):
+        """Подготовка хранилища к работе (вызывается один раз при запуске)"""
+
+    @abstractmethod
+    async def close(self):
+        """Освобождение ресурсов хранилища (вызывается при остановке бота)"""
+
+    @abstractmethod
+    async def migrate(self) -> int:
+        """Приведение схемы к последней версии; возвращает текущую версию схемы"""
+
+    async def create_tables(self):
+        """Создание необходимых таблиц (через миграции схемы)"""
+        await self.migrate()
+
+    def cache_stats(self) -> List[Dict[str, Any]]:
+        """Статистика кэшей хранилища"""
+        return []
+
+    # Пользователи
+    @abstractmethod
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        """Добавление нового пользователя или обновление существующего"""
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """Получение информации о пользователе"""
+
+    @abstractmethod
+    async def update_user_balance(self, user_id: int, amount: int) -> int:
+        """Изменение баланса пользователя; возвращает новый баланс"""
+
+    @abstractmethod
+    async def set_user_reachable(self, user_id: int, reachable: bool) -> bool:
+        """Отметка доступности пользователя для сообщений бота; возвращает True, если отметка изменилась"""
+
+    @abstractmethod
+    async def count_unreachable_users(self) -> int:
+        """Количество пользователей, заблокировавших бота"""
+
+    @abstractmethod
+    async def get_users_bulk(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """Получение нескольких пользователей: {user_id: пользователь}"""
+
+    @abstractmethod
+    async def count_users(self, segment: Optional[Segment] = None) -> int:
+        """Количество пользователей в сегменте"""
+
+    @abstractmethod
+    def iter_user_pages(self, segment: Optional[Segment] = None, batch_size: int = ITER_BATCH_SIZE,
+                        analytics: bool = False) -> AsyncIterator[List[User]]:
+        """Постраничный обход пользователей в порядке user_id"""
+
+    async def iter_users(self, segment: Optional[Segment] = None,
+                         batch_size: int = ITER_BATCH_SIZE) -> AsyncIterator[User]:
+        """
+        Обход пользователей по одному (страницами по batch_size)
+        :param segment: сегмент пользователей (None - все пользователи)
+        :param batch_size: размер страницы
+        :return: Асинхронный генератор пользователей
+        """
+        async for page in self.iter_user_pages(segment, batch_size):
+            for user in page:
+                yield user
+
+    # Подписки
+    @abstractmethod
+    async def add_subscription(self, user_id: int, days: int) -> int:
+        """Продление активной подписки или создание новой; возвращает ID подписки"""
+
+    @abstractmethod
+    async def check_subscription(self, user_id: int) -> Optional[Subscription]:
+        """Активная подписка пользователя или None"""
+
+    @abstractmethod
+    async def get_active_subscriptions_bulk(self, user_ids: Iterable[int],
+                                            analytics: bool = False) -> Dict[int, Subscription]:
+        """Активные подписки нескольких пользователей: {user_id: подписка}"""
+
+    @abstractmethod
+    async def get_expiring_subscriptions(self, days: int = 3) -> List[Subscription]:
+        """Подписки, истекающие в течение локальных суток через days дней"""
+
+    @abstractmethod
+    async def get_expired_subscriptions(self) -> List[Subscription]:
+        """Истекшие, но еще активные подписки"""
+
+    @abstractmethod
+    async def deactivate_subscription(self, subscription_id: int) -> bool:
+        """Деактивация подписки, если она истекла; возвращает False, если подписка уже продлена или деактивирована"""
+
+    @abstractmethod
+    async def load_subscription_index(self) -> int:
+        """Заполнение индекса активных подписок; возвращает количество пользователей с подпиской"""
+
+    @abstractmethod
+    async def verify_subscription_index(self) -> Dict[str, List[int]]:
+        """Сверка индекса активных подписок с хранилищем; возвращает расхождения"""
+
+    async def get_subscription_end_ts(self, user_id: int) -> Optional[int]:
+        """
+        Время окончания активной подписки пользователя (из индекса, без обращения к хранилищу)
+        :param user_id: ID пользователя
+        :return: Unix-время окончания или None, если активной подписки нет
+        """
+        if self.subscription_index.loaded:
+            return self.subscription_index.end_ts(user_id, int(time.time()))
+
+        # Индекс еще не загружен - проверяем по хранилищу
+        subscription = await self.check_subscription(user_id)
+        return subscription['end_ts'] if subscription else None
+
+    @abstractmethod
+    async def get_user_subscriptions(self, user_id: int, include_archive: bool = False,
+                                     limit: int = 10) -> List[Subscription]:
+        """История подписок пользователя (новые первыми)"""
+
+    # Платежи
+    @abstractmethod
+    async def create_payment(self, user_id: int, amount: int, product_type: str, payment_method: str) -> int:
+        """Создание записи о платеже; возвращает ID платежа"""
+
+    @abstractmethod
+    async def confirm_payment(self, payment_id: int) -> bool:
+        """Подтверждение платежа"""
+
+    @abstractmethod
+    async def get_payment(self, payment_id: int) -> Optional[Payment]:
+        """Получение информации о платеже"""
+
+    @abstractmethod
+    async def get_pending_payments(self, limit: int = 15) -> List[Payment]:
+        """Последние ожидающие подтверждения платежи с данными пользователей"""
+
+    @abstractmethod
+    async def attach_tx_id(self, payment_id: int, tx_id: str, currency: Optional[str] = None) -> Dict[str, Any]:
+        """Привязка уникального TxID к криптоплатежу: {"attached", "tx_id", "duplicate_payment_id"}"""
+
+    @abstractmethod
+    async def get_user_payments(self, user_id: int, include_archive: bool = False,
+                                limit: int = 10) -> List[Payment]:
+        """История платежей пользователя (новые первыми)"""
+
+    # Рефералы
+    @abstractmethod
+    async def add_referral(self, user_id: int, referrer_id: int) -> int:
+        """Добавление записи о реферале; возвращает ID записи или 0, если пользователь уже реферал"""
+
+    @abstractmethod
+    async def apply_referral(self, user_id: int, referrer_id: int, points: int, free_days: int) -> Optional[Dict[str, Any]]:
+        """Начисление за приглашение одной операцией: реферал, баллы и бесплатные дни"""
+
+    @abstractmethod
+    async def get_user_referrals(self, user_id: int) -> List[Referral]:
+        """Рефералы пользователя"""
+
+    @abstractmethod
+    async def get_user_referrer(self, user_id: int) -> Optional[User]:
+        """Пригласивший пользователь"""
+
+    async def count_user_referrals(self, user_id: int) -> int:
+        """
+        Подсчет количества рефералов пользователя (по счетчику в данных пользователя)
+        """
+        user = await self.get_user(user_id)
+        return user['referral_count'] if user else 0
+
+    @abstractmethod
+    async def count_referrals_bulk(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        """Количество рефералов нескольких пользователей: {user_id: количество}"""
+
+    # Статистика
+    @abstractmethod
+    async def get_stats(self, days: int = 7) -> Dict[str, Any]:
+        """Итоги и суммы за последние days дней"""
+
+    @abstractmethod
+    async def get_daily_stats(self, day: datetime.date) -> Dict[str, Any]:
+        """Счетчики за один локальный день"""
+
+    # Архивация
+    @abstractmethod
+    async def archive_subscriptions(self, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """Перенос деактивированных подписок в архив; возвращает количество"""
+
+    @abstractmethod
+    async def archive_payments(self, confirmed_days: int, pending_days: int,
+                               batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """Перенос старых подтвержденных и брошенных платежей в архив; возвращает количество"""
+
+    # Рассылки
+    @abstractmethod
+    async def create_broadcast(self, created_by: int, message_type: str, text: Optional[str], file_id: Optional[str],
+                               total: int, status_chat_id: Optional[int] = None,
+                               status_message_id: Optional[int] = None, segment: Optional[Segment] = None) -> int:
+        """Создание рассылки в статусе running для сегмента пользователей; возвращает ID рассылки"""
+
+    @abstractmethod
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        """Получение рассылки"""
+
+    @abstractmethod
+    async def get_broadcasts(self, statuses: Optional[Iterable[str]] = None, limit: int = 10) -> List[Broadcast]:
+        """Последние рассылки (новые первыми), при необходимости только с указанными статусами"""
+
+    @abstractmethod
+    async def set_broadcast_status(self, broadcast_id: int, status: str) -> bool:
+        """Изменение статуса рассылки (время начала и завершения проставляется автоматически)"""
+
+    @abstractmethod
+    async def reset_broadcast_recipients(self, broadcast_id: int) -> Dict[str, int]:
+        """
+        Подготовка рассылки к продолжению: взятые в работу получатели возвращаются в очередь,
+        а прерванные во время отправки считаются неудачными (чтобы не отправить сообщение дважды)
+        Возвращает {"requeued": количество, "interrupted": количество}
+        """
+
+    @abstractmethod
+    async def claim_broadcast_recipients(self, broadcast_id: int, limit: int) -> List[int]:
+        """
+        Взятие в работу следующих получателей: сначала возвращенные в очередь,
+        затем пользователи сегмента рассылки после курсора (курсор сдвигается)
+        """
+
+    @abstractmethod
+    async def mark_broadcast_sending(self, broadcast_id: int, user_id: int):
+        """Отметка получателя перед отправкой сообщения"""
+
+    @abstractmethod
+    async def finish_broadcast_recipient(self, broadcast_id: int, user_id: int, sent: bool,
+                                         error: Optional[str] = None):
+        """Результат отправки получателю (вместе со счетчиками рассылки)"""
+
+    # Недоставленные сообщения
+    @abstractmethod
+    async def add_dead_letter(self, campaign: str, chat_id: Optional[int], method: str, payload: str,
+                              error: Optional[str]) -> int:
+        """Сохранение недоставленного сообщения; возвращает его ID"""
+
+    @abstractmethod
+    async def get_dead_letters(self, campaign: Optional[str] = None, limit: int = 100) -> List[DeadLetter]:
+        """Недоставленные сообщения, ожидающие повторной отправки (старые первыми)"""
+
+    @abstractmethod
+    async def count_dead_letters(self) -> Dict[str, int]:
+        """Количество ожидающих повторной отправки сообщений по кампаниям"""
+
+    @abstractmethod
+    async def resolve_dead_letter(self, dead_letter_id: int, delivered: bool, error: Optional[str] = None):
+        """
+        Результат повторной отправки: доставлено (redriven) или еще одна неудачная попытка
+        Для сообщения рассылки доставка отмечается и у получателя, а счетчики рассылки пересчитываются
+        """
+
+    # Мероприятия
+    @abstractmethod
+    async def add_event(self, name: str, description: str, event_date: datetime.datetime, price: int,
+                        max_participants: int = None) -> int:
+        """Добавление мероприятия; возвращает ID мероприятия"""
+
+    @abstractmethod
+    async def get_event(self, event_id: int) -> Optional[Dict[str, Any]]:
+        """Получение информации о мероприятии"""
+
+    @abstractmethod
+    async def register_for_event(self, event_id: int, user_id: int, payment_id: int = None) -> int:
+        """Регистрация пользователя на мероприятие; возвращает ID регистрации"""
+
+
+def create_database(config: DbConfig) -> Repository:
+    """
+    Создание хранилища по настройкам
+    :param config: настройки базы данных (config.backend - sqlite или memory)
+    :return: Хранилище
+    """
+    if config.backend == "memory":
+        from memory_database import MemoryDatabase
+        return MemoryDatabase(config)
+    if config.backend != "sqlite":
+        raise ValueError(f"Неизвестное хранилище данных: {config.backend}")
+
+    from database import Database
+    return Database(config.db_path, config)
@@ -3,30 +3,44 @@
 """
 import asyncio
 import logging
+from typing import Optional
 from datetime import datetime, timedelta
 from aiogram import Bot
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
-from database import Database
+from database import now_ts, day_bounds_ts
+from repository import Repository
+from segments import Segment
+from backup import create_backup, rotate_backups
+from maintenance import run_maintenance, format_report
+from outbound import with_priority, PRIORITY_BULK
+from delivery import Delivery
 from config import Config
-from utils import kick_user_from_group, get_subscription_end_text, get_user_name
+from utils import kick_user_from_group, get_subscription_end_text, get_user_name, generate_ref_link
 from keyboards import extend_subscription_kb, club_menu_kb
 
 logger = logging.getLogger(__name__)
 
+# Аудитории кампаний планировщика (отбираются одним запросом по индексам)
+LIMITED_OFFER_SEGMENT = Segment().with_any_referral()  # Пригласили хотя бы одного друга (в том числе неактивного)
+ACTIVITY_REMINDER_SEGMENT = Segment().active()  # С активной подпиской
+
+
 class ScheduledTasks:
-    def __init__(self, bot: Bot, db: Database, config: Config):
+    def __init__(self, bot: Bot, db: Repository, config: Config, delivery: Optional[Delivery] = None):
         """
         Инициализация планировщика задач
         :param bot: Объект бота
         :param db: Объект базы данных
         :param config: Объект конфигурации
+        :param delivery: Доставка сообщений кампаний (общая с рассылками)
         """
         self.bot = bot
         self.db = db
         self.config = config
+        self.delivery = delivery or Delivery(bot, db)
         self.scheduler = AsyncIOScheduler()
 
         # Инициализация задач
@@ -71,6 +85,34 @@ class ScheduledTasks:
             name="update_statistics"
         )
 
+        # Перенос старых подписок и платежей в архив (каждый день в ARCHIVE_HOUR:00)
+        self.scheduler.add_job(
+            self._archive_old_records,
+            CronTrigger(hour=self.config.archive.hour, minute=0),
+            name="archive_old_records"
+        )
+
+        # Резервное копирование базы данных (каждый день в BACKUP_HOUR:30)
+        self.scheduler.add_job(
+            self._backup_database,
+            CronTrigger(hour=self.config.backup.hour, minute=30),
+            name="backup_database"
+        )
+
+        # Обслуживание базы данных (каждые MAINTENANCE_INTERVAL_HOURS часов)
+        self.scheduler.add_job(
+            self._maintain_database,
+            IntervalTrigger(hours=self.config.maintenance.interval_hours),
+            name="maintain_database"
+        )
+
+        # Сверка индекса активных подписок с таблицей
+        self.scheduler.add_job(
+            self._verify_subscription_index,
+            IntervalTrigger(minutes=self.config.db.subscription_index_check_minutes),
+            name="verify_subscription_index"
+        )
+
         # Проверка активности пользователей (каждую неделю в понедельник в 09:00)
         self.scheduler.add_job(
             self._check_user_activity,
@@ -93,6 +135,7 @@ class ScheduledTasks:
             self.scheduler.shutdown()
             logger.info("Планировщик задач остановлен")
 
+    @with_priority(PRIORITY_BULK)
     async def _check_expiring_subscriptions(self):
         """
         Проверка подписок, истекающих через 3 и 1 день
@@ -100,56 +143,78 @@ class ScheduledTasks:
         logger.info("Запуск проверки истекающих подписок")
 
         for days in [3, 1]:
-            expiring = await self.db.get_expiring_subscriptions(days)
+            # Подписки, истекающие в течение локальных суток через days дней, берем из индекса
+            target_date = (datetime.now() + timedelta(days=days)).date()
+            expiring = self.db.subscription_index.expiring_between(*day_bounds_ts(target_date))
             logger.info(f"Найдено {len(expiring)} подписок, истекающих через {days} дней")
 
-            for sub in expiring:
-                user_id = sub['user_id']
-                try:
-                    # Отправка уведомления пользователю
-                    await self.bot.send_message(
-                        user_id,
-                        get_subscription_end_text(user_id, days),
-                        reply_markup=extend_subscription_kb()
-                    )
+            # Пользователям, заблокировавшим бота, уведомление не отправляется
+            users = await self.db.get_users_bulk(user_id for _, user_id, _ in expiring)
+            for _, user_id, _ in expiring:
+                user = users.get(user_id)
+                if user is not None and not user['reachable']:
+                    continue
+                # Отправка уведомления пользователю (недоставленные сохраняются для повторной отправки)
+                if await self.delivery.send_message(
+                    user_id,
+                    get_subscription_end_text(user_id, days),
+                    campaign="expiring_subscription",
+                    reply_markup=extend_subscription_kb()
+                ):
                     logger.info(f"Отправлено уведомление об истечении подписки пользователю {user_id} (осталось {days} дней)")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
 
+    @with_priority(PRIORITY_BULK)
     async def _check_expired_subscriptions(self):
         """
         Проверка и обработка истекших подписок
         """
         logger.info("Запуск проверки истекших подписок")
 
-        expired = await self.db.get_expired_subscriptions()
-        logger.info(f"Найдено {len(expired)} истекших подписок")
+        # Вершина кучи индекса - ближайшее окончание; если оно в будущем, обходить нечего
+        next_expiry = self.db.subscription_index.next_expiry()
+        if next_expiry is None or next_expiry > now_ts():
+            logger.info("Истекших подписок нет")
+            return
 
-        for sub in expired:
-            user_id = sub['user_id']
-            subscription_id = sub['subscription_id']
+        expired = self.db.subscription_index.expired(now_ts())
+        logger.info(f"Найдено {len(expired)} истекших подписок")
 
+        # Сначала деактивируем и исключаем всех: уведомления идут в очереди рассылок и ждут токенов,
+        # а пока они ждут, пользователь мог бы продлить подписку, которую мы еще не деактивировали
+        deactivated = []
+        for _, user_id, subscription_id in expired:
             try:
-                # Деактивация подписки
-                await self.db.deactivate_subscription(subscription_id)
+                # Деактивация подписки (пользователь мог продлить ее после выборки - тогда она остается активной)
+                if not await self.db.deactivate_subscription(subscription_id):
+                    logger.info(f"Подписка {subscription_id} пользователя {user_id} продлена или уже деактивирована")
+                    continue
+                deactivated.append(user_id)
 
                 # Исключение пользователя из группы
-                kick_result = await kick_user_from_group(self.bot, self.config, user_id)
+                if await kick_user_from_group(self.bot, self.config, user_id):
+                    logger.info(f"Подписка {subscription_id} пользователя {user_id} истекла. Пользователь исключен из группы.")
+                else:
+                    logger.warning(f"Подписка {subscription_id} пользователя {user_id} истекла, но не удалось исключить из группы.")
+            except Exception as e:
+                logger.error(f"Ошибка при обработке истекшей подписки {subscription_id} пользователя {user_id}: {e}")
 
-                # Отправка уведомления пользователю
-                await self.bot.send_message(
+        # Уведомления об окончании подписки (пользователям, не заблокировавшим бота)
+        users = await self.db.get_users_bulk(deactivated)
+        for user_id in deactivated:
+            user = users.get(user_id)
+            if user is not None and not user['reachable']:
+                continue
+            try:
+                await self.delivery.send_message(
                     user_id,
                     get_subscription_end_text(user_id, 0),
+                    campaign="expired_subscription",
                     reply_markup=club_menu_kb()
                 )
-
-                if kick_result:
-                    logger.info(f"Подписка {subscription_id} пользователя {user_id} истекла. Пользователь исключен из группы.")
-                else:
-                    logger.warning(f"Подписка {subscription_id} пользователя {user_id} истекла, но не удалось исключить из группы.")
             except Exception as e:
-                logger.error(f"Ошибка при обработке истекшей подписки {subscription_id} пользователя {user_id}: {e}")
+                logger.error(f"Ошибка при отправке уведомления об истечении подписки пользователю {user_id}: {e}")
 
+    @with_priority(PRIORITY_BULK)
     async def _send_referral_reminders(self):
         """
         Отправка напоминаний по реферальной программе
@@ -157,51 +222,41 @@ class ScheduledTasks:
         logger.info("Запуск отправки напоминаний по реферальной программе")
 
         try:
-            # Получаем всех пользователей
-            async with self.db.get_conn() as conn:
-                cursor = await conn.execute("SELECT user_id FROM users WHERE registration_date < datetime('now', '-3 day')")
-                users = await cursor.fetchall()
-
             bot_info = await self.bot.get_me()
 
-            for user in users:
-                user_id = user[0]
-
-                # Проверяем количество рефералов
-                referrals_count = await self.db.count_user_referrals(user_id)
-
-                # Если у пользователя менее 5 рефералов и прошло 3 дня с момента регистрации
-                if referrals_count < 5:
-                    # Генерируем реферальную ссылку
-                    from utils import generate_ref_link
-                    ref_link = generate_ref_link(bot_info.username, user_id)
-
-                    # Получаем имя пользователя
-                    user_data = await self.db.get_user(user_id)
-                    user_name = user_data.get('first_name', 'Пользователь')
-
-                    # Отправляем напоминание
-                    try:
-                        await self.bot.send_message(
-                            user_id,
-                            f"👋 Добрый день, {user_name}\n\n"
-                            f"Не забыли о своей реферальной ссылке?\n\n"
-                            f"Вот она: {ref_link}\n\n"
-                            f"💡 Совет: Добавьте ссылку в подпись Telegram или делитесь в чатах с друзьями.\n\n"
-                            f"За каждого приглашенного друга ты получаешь:\n"
-                            f"🎯 1 друг – 1000 баллов (1 балл = 1 рубль)\n"
-                            f"🎯 3 друга – доступ к VIP продукту экскурсия по Вьетнаму\n"
-                            f"🎯 5 друзей – месяц бесплатного членства в Клубе Х10\n"
-                            f"🎯 10 друзей – персональная консультация с основателем Клуба Х10",
-                            reply_markup=None  # Здесь можно добавить клавиатуру
-                        )
-                        logger.info(f"Отправлено напоминание о реферальной программе пользователю {user_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке напоминания пользователю {user_id}: {e}")
+            # Обходим пользователей, у которых менее 5 рефералов и прошло 3 дня с момента регистрации
+            async for user in self.db.iter_users(
+                Segment().registered_before(now_ts() - 3 * 86400).referrals(max_count=4)
+            ):
+                user_id = user['user_id']
+
+                # Генерируем реферальную ссылку
+                ref_link = generate_ref_link(bot_info.username, user_id)
+
+                # Получаем имя пользователя
+                user_name = user['first_name'] or 'Пользователь'
+
+                # Отправляем напоминание
+                if await self.delivery.send_message(
+                    user_id,
+                    f"👋 Добрый день, {user_name}\n\n"
+                    f"Не забыли о своей реферальной ссылке?\n\n"
+                    f"Вот она: {ref_link}\n\n"
+                    f"💡 Совет: Добавьте ссылку в подпись Telegram или делитесь в чатах с друзьями.\n\n"
+                    f"За каждого приглашенного друга ты получаешь:\n"
+                    f"🎯 1 друг – 1000 баллов (1 балл = 1 рубль)\n"
+                    f"🎯 3 друга – доступ к VIP продукту экскурсия по Вьетнаму\n"
+                    f"🎯 5 друзей – месяц бесплатного членства в Клубе Х10\n"
+                    f"🎯 10 друзей – персональная консультация с основателем Клуба Х10",
+                    campaign="referral_reminder",
+                    reply_markup=None  # Здесь можно добавить клавиатуру
+                ):
+                    logger.info(f"Отправлено напоминание о реферальной программе пользователю {user_id}")
 
         except Exception as e:
             logger.error(f"Ошибка при отправке напоминаний о реферальной программе: {e}")
 
+    @with_priority(PRIORITY_BULK)
     async def _send_limited_offers(self):
         """
         Отправка ограниченных предложений по реферальной программе
@@ -209,41 +264,28 @@ class ScheduledTasks:
         logger.info("Запуск отправки ограниченных предложений")
 
         try:
-            # Получаем активных пользователей с хотя бы одним рефералом
-            async with self.db.get_conn() as conn:
-                cursor = await conn.execute("""
-                    SELECT u.user_id, u.first_name 
-                    FROM users u
-                    JOIN referrals r ON u.user_id = r.referrer_id
-                    GROUP BY u.user_id
-                    HAVING COUNT(r.user_id) >= 1
-                """)
-                users = await cursor.fetchall()
-
             bot_info = await self.bot.get_me()
 
-            for user in users:
-                user_id = user[0]
-                user_name = user[1] or "Пользователь"
+            # Обходим пользователей, пригласивших хотя бы одного друга
+            async for user in self.db.iter_users(LIMITED_OFFER_SEGMENT):
+                user_id = user['user_id']
+                user_name = user['first_name'] or "Пользователь"
 
                 # Генерируем реферальную ссылку
-                from utils import generate_ref_link
                 ref_link = generate_ref_link(bot_info.username, user_id)
 
                 # Отправляем ограниченное предложение
-                try:
-                    await self.bot.send_message(
-                        user_id,
-                        f"⏳ Только 24 часа!\n\n"
-                        f"За каждого нового друга по вашей ссылке вы получите\n"
-                        f"в 2 раза больше баллов (2000 вместо 1000).\n"
-                        f"(1 балл = 1 рубль)\n\n"
-                        f"Успейте пригласить: {ref_link}",
-                        reply_markup=None  # Здесь можно добавить клавиатуру
-                    )
+                if await self.delivery.send_message(
+                    user_id,
+                    f"⏳ Только 24 часа!\n\n"
+                    f"За каждого нового друга по вашей ссылке вы получите\n"
+                    f"в 2 раза больше баллов (2000 вместо 1000).\n"
+                    f"(1 балл = 1 рубль)\n\n"
+                    f"Успейте пригласить: {ref_link}",
+                    campaign="limited_offer",
+                    reply_markup=None  # Здесь можно добавить клавиатуру
+                ):
                     logger.info(f"Отправлено ограниченное предложение пользователю {user_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке ограниченного предложения пользователю {user_id}: {e}")
 
         except Exception as e:
             logger.error(f"Ошибка при отправке ограниченных предложений: {e}")
@@ -255,34 +297,18 @@ class ScheduledTasks:
         logger.info("Запуск обновления статистики")
 
         try:
-            # Получаем общее количество пользователей
-            async with self.db.get_conn() as conn:
-                cursor = await conn.execute("SELECT COUNT(*) FROM users")
-                total_users = (await cursor.fetchone())[0]
-
-                # Получаем количество активных подписок
-                cursor = await conn.execute(
-                    "SELECT COUNT(*) FROM subscriptions WHERE status = 'active' AND end_date > datetime('now')"
-                )
-                active_subscriptions = (await cursor.fetchone())[0]
-
-                # Получаем количество рефералов
-                cursor = await conn.execute("SELECT COUNT(*) FROM referrals")
-                total_referrals = (await cursor.fetchone())[0]
-
-                # Получаем количество платежей за день
-                cursor = await conn.execute(
-                    "SELECT COUNT(*) FROM payments WHERE date(created_at) = date('now', '-1 day')"
-                )
-                daily_payments = (await cursor.fetchone())[0]
+            # Итоги и счетчики за вчерашний день берем из агрегированных таблиц
+            yesterday = (datetime.now() - timedelta(days=1)).date()
+            totals = await self.db.get_stats()
+            daily = await self.db.get_daily_stats(yesterday)
 
             # Отправляем статистику администраторам
             stats_message = (
-                f"📊 Статистика бота за {(datetime.now() - timedelta(days=1)).strftime('%d.%m.%Y')}:\n\n"
-                f"👥 Всего пользователей: {total_users}\n"
-                f"🔑 Активных подписок: {active_subscriptions}\n"
-                f"👨‍👩‍👧‍👦 Всего рефералов: {total_referrals}\n"
-                f"💰 Платежей за день: {daily_payments}"
+                f"📊 Статистика бота за {yesterday.strftime('%d.%m.%Y')}:\n\n"
+                f"👥 Всего пользователей: {totals['users']}\n"
+                f"🔑 Активных подписок: {totals['active_subscriptions']}\n"
+                f"👨‍👩‍👧‍👦 Всего рефералов: {totals['referrals']}\n"
+                f"💰 Платежей за день: {daily['payments_created']}"
             )
 
             for admin_id in self.config.bot.admin_ids:
@@ -294,6 +320,73 @@ class ScheduledTasks:
         except Exception as e:
             logger.error(f"Ошибка при обновлении статистики: {e}")
 
+    async def _archive_old_records(self):
+        """
+        Перенос истекших подписок и завершенных платежей в архивные таблицы
+        """
+        logger.info("Запуск архивации старых подписок и платежей")
+
+        archive = self.config.archive
+        try:
+            await self.db.archive_subscriptions(archive.batch_size)
+            await self.db.archive_payments(
+                archive.confirmed_payment_days,
+                archive.pending_payment_days,
+                archive.batch_size
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при архивации старых записей: {e}")
+
+    async def _backup_database(self):
+        """
+        Создание резервной копии базы данных и удаление старых копий
+        """
+        if not self.db.db_path:
+            return
+        logger.info("Запуск резервного копирования базы данных")
+
+        try:
+            await create_backup(self.db.db_path, self.config.backup)
+            rotate_backups(self.config.backup)
+        except Exception as e:
+            logger.error(f"Ошибка при резервном копировании базы данных: {e}")
+
+    async def _verify_subscription_index(self):
+        """
+        Сверка индекса активных подписок с таблицей подписок
+        """
+        try:
+            diff = await self.db.verify_subscription_index()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке индекса активных подписок: {e}")
+            return
+
+        if not any(diff.values()):
+            logger.info(f"Индекс активных подписок совпадает с таблицей ({len(self.db.subscription_index)} подписок)")
+
+    async def _maintain_database(self):
+        """
+        Обслуживание базы данных: ANALYZE, optimize, incremental_vacuum и обрезка WAL
+        """
+        if not self.db.db_path:
+            return
+        logger.info("Запуск обслуживания базы данных")
+
+        try:
+            report = await run_maintenance(self.db.db_path, self.config.maintenance)
+        except Exception as e:
+            logger.error(f"Ошибка при обслуживании базы данных: {e}")
+            return
+
+        # Полный VACUUM выполняется один раз - сообщаем о нем администраторам
+        if report["vacuumed"]:
+            for admin_id in self.config.bot.admin_ids:
+                try:
+                    await self.bot.send_message(admin_id, f"🧹 Обслуживание базы данных\n\n{format_report(report)}")
+                except Exception as e:
+                    logger.error(f"Ошибка при отправке отчета об обслуживании администратору {admin_id}: {e}")
+
+    @with_priority(PRIORITY_BULK)
     async def _check_user_activity(self):
         """
         Проверка активности пользователей и отправка напоминаний неактивным
@@ -303,34 +396,23 @@ class ScheduledTasks:
         try:
             # Получаем пользователей с активной подпиской, которые не взаимодействовали с ботом более 7 дней
             # В данном примере мы не отслеживаем последнюю активность, поэтому просто выбираем всех с активной подпиской
-            async with self.db.get_conn() as conn:
-                cursor = await conn.execute("""
-                    SELECT u.user_id, u.first_name 
-                    FROM users u
-                    JOIN subscriptions s ON u.user_id = s.user_id
-                    WHERE s.status = 'active' AND s.end_date > datetime('now')
-                """)
-                users = await cursor.fetchall()
-
-            for user in users:
-                user_id = user[0]
-                user_name = user[1] or "Пользователь"
+            async for user in self.db.iter_users(ACTIVITY_REMINDER_SEGMENT):
+                user_id = user['user_id']
+                user_name = user['first_name'] or "Пользователь"
 
                 # Отправляем напоминание об активности
-                try:
-                    await self.bot.send_message(
-                        user_id,
-                        f"Привет, {user_name}!\n\n"
-                        f"Давно не виделись в нашем клубе. Загляните к нам, у нас много интересного:\n\n"
-                        f"- Новые материалы в закрытом чате\n"
-                        f"- Актуальные темы для обсуждения\n"
-                        f"- Возможность общения с экспертами\n\n"
-                        f"Не забывайте, что ваша подписка активна, используйте её возможности по максимуму!",
-                        reply_markup=None  # Здесь можно добавить клавиатуру
-                    )
+                if await self.delivery.send_message(
+                    user_id,
+                    f"Привет, {user_name}!\n\n"
+                    f"Давно не виделись в нашем клубе. Загляните к нам, у нас много интересного:\n\n"
+                    f"- Новые материалы в закрытом чате\n"
+                    f"- Актуальные темы для обсуждения\n"
+                    f"- Возможность общения с экспертами\n\n"
+                    f"Не забывайте, что ваша подписка активна, используйте её возможности по максимуму!",
+                    campaign="activity_reminder",
+                    reply_markup=None  # Здесь можно добавить клавиатуру
+                ):
                     logger.info(f"Отправлено напоминание об активности пользователю {user_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке напоминания об активности пользователю {user_id}: {e}")
 
         except Exception as e:
             logger.error(f"Ошибка при проверке активности пользователей: {e}")
@@ -345,10 +427,3 @@ class ScheduledTasks:
         await self._check_expired_subscriptions()
 
         logger.info("Стартовые задачи выполнены")
-
-    async def get_conn(self):
-        """
-        Получение соединения с базой данных
-        Этот метод нужен для прямого выполнения SQL-запросов
-        """
-        return await self.db.get_conn()
\ No newline at end of file
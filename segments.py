@@ -0,0 +1,277 @@
+"""
+Сегменты аудитории бота клуба X10.
+Сегмент - набор условий отбора пользователей для рассылок и кампаний планировщика.
+Условия компилируются в одно SQL-условие на таблицу users (подзапросы EXISTS
+идут по индексам подписок и платежей по user_id), а для хранилища в памяти
+проверяются той же логикой на Python.
+Сегмент неизменяемый: методы построения возвращают новый сегмент, например
+Segment().expired().without_payments() или Segment().expiring_within(3).
+Пользователи, заблокировавшие бота (users.reachable = 0), в сегмент по умолчанию не входят.
+"""
+import datetime
+import json
+from dataclasses import dataclass, asdict, fields, replace
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from records import User
+
+# Состояния подписки в сегменте
+SUBSCRIPTION_ACTIVE = "active"  # Есть активная подписка
+SUBSCRIPTION_INACTIVE = "inactive"  # Нет активной подписки (в том числе никогда не было)
+SUBSCRIPTION_EXPIRED = "expired"  # Подписка была, но закончилась
+
+# Активная подписка пользователя
+_ACTIVE_SUBSCRIPTION_SQL = (
+    "EXISTS (SELECT 1 FROM subscriptions s "
+    "WHERE s.user_id = users.user_id AND s.status = 'active' AND s.end_ts > ?)"
+)
+
+# Любая подписка пользователя, в том числе архивная
+_ANY_SUBSCRIPTION_SQL = (
+    "(EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = users.user_id) "
+    "OR EXISTS (SELECT 1 FROM subscriptions_archive sa WHERE sa.user_id = users.user_id))"
+)
+
+# Подтвержденный платеж пользователя, в том числе архивный ({product} - дополнительное условие на продукт)
+_CONFIRMED_PAYMENT_SQL = (
+    "(EXISTS (SELECT 1 FROM payments p "
+    "WHERE p.user_id = users.user_id AND p.status = 'confirmed'{product}) "
+    "OR EXISTS (SELECT 1 FROM payments_archive pa "
+    "WHERE pa.user_id = users.user_id AND pa.status = 'confirmed'{archive_product}))"
+)
+
+
+def _utc_timestamp(ts: int) -> str:
+    """
+    Unix-время в формате registration_date (CURRENT_TIMESTAMP SQLite, UTC)
+    """
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Условия отбора пользователей (незаданные поля не проверяются)"""
+    registered_before_ts: Optional[int] = None  # Зарегистрирован раньше этого Unix-времени
+    registered_after_ts: Optional[int] = None  # Зарегистрирован не раньше этого Unix-времени
+    min_referrals: Optional[int] = None  # Не меньше стольких рефералов
+    max_referrals: Optional[int] = None  # Не больше стольких рефералов
+    invited_anyone: bool = False  # Пригласил хотя бы одного пользователя (в том числе неактивного реферала)
+    subscription: Optional[str] = None  # SUBSCRIPTION_ACTIVE, SUBSCRIPTION_INACTIVE или SUBSCRIPTION_EXPIRED
+    expiring_within_days: Optional[int] = None  # Активная подписка заканчивается в ближайшие N дней
+    paid_product: Optional[str] = None  # Есть подтвержденный платеж за продукт (club, vietnam, ...)
+    never_paid: bool = False  # Нет ни одного подтвержденного платежа
+    include_unreachable: bool = False  # Включать пользователей, заблокировавших бота
+
+    # Построение сегмента
+    def active(self) -> "Segment":
+        """Пользователи с активной подпиской"""
+        return replace(self, subscription=SUBSCRIPTION_ACTIVE)
+
+    def inactive(self) -> "Segment":
+        """Пользователи без активной подписки"""
+        return replace(self, subscription=SUBSCRIPTION_INACTIVE)
+
+    def expired(self) -> "Segment":
+        """Пользователи, у которых подписка была, но закончилась"""
+        return replace(self, subscription=SUBSCRIPTION_EXPIRED)
+
+    def expiring_within(self, days: int) -> "Segment":
+        """Пользователи, чья активная подписка заканчивается в ближайшие days дней"""
+        return replace(self, subscription=SUBSCRIPTION_ACTIVE, expiring_within_days=days)
+
+    def referrals(self, min_count: Optional[int] = None, max_count: Optional[int] = None) -> "Segment":
+        """Пользователи с количеством рефералов в диапазоне [min_count, max_count]"""
+        return replace(self, min_referrals=min_count, max_referrals=max_count)
+
+    def with_any_referral(self) -> "Segment":
+        """Пользователи, пригласившие хотя бы одного пользователя (referrals, min_count - только активные рефералы)"""
+        return replace(self, invited_anyone=True)
+
+    def registered_before(self, ts: int) -> "Segment":
+        """Пользователи, зарегистрированные раньше ts"""
+        return replace(self, registered_before_ts=ts)
+
+    def registered_after(self, ts: int) -> "Segment":
+        """Пользователи, зарегистрированные не раньше ts"""
+        return replace(self, registered_after_ts=ts)
+
+    def paid_for(self, product: str) -> "Segment":
+        """Пользователи, оплатившие продукт"""
+        return replace(self, paid_product=product, never_paid=False)
+
+    def without_payments(self) -> "Segment":
+        """Пользователи без подтвержденных платежей"""
+        return replace(self, never_paid=True, paid_product=None)
+
+    def with_unreachable(self) -> "Segment":
+        """Включая пользователей, заблокировавших бота"""
+        return replace(self, include_unreachable=True)
+
+    @property
+    def is_empty(self) -> bool:
+        """Сегмент без условий (все пользователи, которым бот может писать)"""
+        return self == Segment()
+
+    def to_sql(self, now: int) -> Tuple[str, Tuple[Any, ...]]:
+        """
+        SQL-условие на таблицу users
+        :param now: текущее Unix-время (для проверки подписки)
+        :return: Условие без WHERE (пустая строка, если отбора нет) и его параметры
+        """
+        conditions = []
+        params: List[Any] = []
+        if not self.include_unreachable:
+            conditions.append("reachable = 1")
+        # registration_date хранится как CURRENT_TIMESTAMP (UTC, 'YYYY-MM-DD HH:MM:SS')
+        if self.registered_before_ts is not None:
+            conditions.append("registration_date < datetime(?, 'unixepoch')")
+            params.append(self.registered_before_ts)
+        if self.registered_after_ts is not None:
+            conditions.append("registration_date >= datetime(?, 'unixepoch')")
+            params.append(self.registered_after_ts)
+        if self.min_referrals is not None:
+            conditions.append("referral_count >= ?")
+            params.append(self.min_referrals)
+        if self.max_referrals is not None:
+            conditions.append("referral_count <= ?")
+            params.append(self.max_referrals)
+        if self.invited_anyone:
+            conditions.append("EXISTS (SELECT 1 FROM referrals r WHERE r.referrer_id = users.user_id)")
+
+        if self.expiring_within_days is not None:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM subscriptions s "
+                "WHERE s.user_id = users.user_id AND s.status = 'active' AND s.end_ts > ? AND s.end_ts <= ?)"
+            )
+            params.extend((now, now + self.expiring_within_days * 86400))
+        elif self.subscription == SUBSCRIPTION_ACTIVE:
+            conditions.append(_ACTIVE_SUBSCRIPTION_SQL)
+            params.append(now)
+        elif self.subscription == SUBSCRIPTION_INACTIVE:
+            conditions.append(f"NOT {_ACTIVE_SUBSCRIPTION_SQL}")
+            params.append(now)
+        elif self.subscription == SUBSCRIPTION_EXPIRED:
+            conditions.append(f"NOT {_ACTIVE_SUBSCRIPTION_SQL} AND {_ANY_SUBSCRIPTION_SQL}")
+            params.append(now)
+
+        if self.paid_product is not None:
+            conditions.append(_CONFIRMED_PAYMENT_SQL.format(
+                product=" AND p.product_type = ?", archive_product=" AND pa.product_type = ?"
+            ))
+            params.extend((self.paid_product, self.paid_product))
+        if self.never_paid:
+            conditions.append("NOT " + _CONFIRMED_PAYMENT_SQL.format(product="", archive_product=""))
+        return " AND ".join(conditions), tuple(params)
+
+    def matches(self, user: User, now: int, active_end_ts: Optional[int], had_subscription: bool,
+                paid_products: Set[str], invited_anyone: bool = False) -> bool:
+        """
+        Проверка пользователя без SQL (для хранилища в памяти)
+        :param user: пользователь
+        :param now: текущее Unix-время
+        :param active_end_ts: время окончания активной подписки (None - активной подписки нет)
+        :param had_subscription: была ли у пользователя хоть одна подписка (в том числе архивная)
+        :param paid_products: продукты подтвержденных платежей пользователя (в том числе архивных)
+        :param invited_anyone: есть ли у пользователя рефералы (в том числе неактивные)
+        :return: True, если пользователь входит в сегмент
+        """
+        if not self.include_unreachable and user['reachable'] == 0:
+            return False
+        registration_date = user['registration_date']
+        if self.registered_before_ts is not None:
+            if not registration_date or registration_date >= _utc_timestamp(self.registered_before_ts):
+                return False
+        if self.registered_after_ts is not None:
+            if not registration_date or registration_date < _utc_timestamp(self.registered_after_ts):
+                return False
+        referral_count = user['referral_count'] or 0
+        if self.min_referrals is not None and referral_count < self.min_referrals:
+            return False
+        if self.max_referrals is not None and referral_count > self.max_referrals:
+            return False
+        if self.invited_anyone and not invited_anyone:
+            return False
+
+        is_active = active_end_ts is not None and active_end_ts > now
+        if self.expiring_within_days is not None:
+            if not is_active or active_end_ts > now + self.expiring_within_days * 86400:
+                return False
+        elif self.subscription == SUBSCRIPTION_ACTIVE and not is_active:
+            return False
+        elif self.subscription == SUBSCRIPTION_INACTIVE and is_active:
+            return False
+        elif self.subscription == SUBSCRIPTION_EXPIRED and (is_active or not had_subscription):
+            return False
+
+        if self.paid_product is not None and self.paid_product not in paid_products:
+            return False
+        if self.never_paid and paid_products:
+            return False
+        return True
+
+    def to_json(self) -> str:
+        """
+        Сегмент в JSON для хранения в базе (только заданные условия)
+        """
+        defaults = Segment()
+        return json.dumps(
+            {key: value for key, value in asdict(self).items() if value != getattr(defaults, key)},
+            sort_keys=True
+        )
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> "Segment":
+        """
+        Сегмент из JSON (пустое значение - все пользователи; неизвестные поля пропускаются)
+        """
+        if not text:
+            return cls()
+        data: Dict[str, Any] = json.loads(text)
+        known = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def describe(self) -> str:
+        """
+        Описание сегмента для администратора
+        """
+        parts = []
+        if self.expiring_within_days is not None:
+            parts.append(f"подписка заканчивается в ближайшие {self.expiring_within_days} дн.")
+        elif self.subscription == SUBSCRIPTION_ACTIVE:
+            parts.append("с активной подпиской")
+        elif self.subscription == SUBSCRIPTION_INACTIVE:
+            parts.append("без активной подписки")
+        elif self.subscription == SUBSCRIPTION_EXPIRED:
+            parts.append("подписка закончилась")
+        if self.min_referrals is not None and self.max_referrals is not None:
+            parts.append(f"рефералов от {self.min_referrals} до {self.max_referrals}")
+        elif self.min_referrals is not None:
+            parts.append(f"рефералов не меньше {self.min_referrals}")
+        elif self.max_referrals is not None:
+            parts.append(f"рефералов не больше {self.max_referrals}")
+        if self.invited_anyone:
+            parts.append("пригласили хотя бы одного пользователя")
+        if self.registered_after_ts is not None:
+            parts.append(f"зарегистрированы с {_utc_timestamp(self.registered_after_ts)[:10]}")
+        if self.registered_before_ts is not None:
+            parts.append(f"зарегистрированы до {_utc_timestamp(self.registered_before_ts)[:10]}")
+        if self.paid_product is not None:
+            parts.append(f"оплатили {self.paid_product}")
+        if self.never_paid:
+            parts.append("ни разу не платили")
+        if self.include_unreachable:
+            parts.append("включая заблокировавших бота")
+        return ", ".join(parts) if parts else "все пользователи"
+
+
+# Готовые сегменты для выбора аудитории рассылки (ключ используется в callback_data)
+SEGMENT_PRESETS: Dict[str, Tuple[str, Segment]] = {
+    "all": ("Все пользователи", Segment()),
+    "active": ("С активной подпиской", Segment().active()),
+    "expiring": ("Подписка заканчивается за 7 дней", Segment().expiring_within(7)),
+    "expired": ("Подписка закончилась", Segment().expired()),
+    "inactive": ("Без активной подписки", Segment().inactive()),
+    "never_paid": ("Ни разу не платили", Segment().without_payments()),
+    "paid_club": ("Оплачивали Клуб Х10", Segment().paid_for("club")),
+    "referrers": ("Пригласили хотя бы одного друга", Segment().referrals(min_count=1)),
+}
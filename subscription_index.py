@@ -0,0 +1,165 @@
+"""
+Индекс активных подписок бота клуба X10.
+Хранит в памяти процесса user_id → (subscription_id, end_ts) для всех активных подписок,
+поэтому проверка доступа не обращается к базе данных. Ближайшие окончания подписок
+хранятся в min-куче для планировщика. Устаревшие элементы кучи не удаляются сразу,
+а пропускаются при чтении (ленивое удаление).
+"""
+import heapq
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Во сколько раз куча может превысить количество подписок, прежде чем ее перестроят
+HEAP_COMPACT_FACTOR = 2
+
+
+class SubscriptionIndex:
+    def __init__(self):
+        """
+        Инициализация пустого индекса (заполняется методом load при запуске)
+        """
+        self._active: Dict[int, Tuple[int, int]] = {}
+        self._heap: List[Tuple[int, int, int]] = []
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def load(self, rows: Iterable[Tuple[int, int, int]]):
+        """
+        Заполнение индекса (предыдущее содержимое заменяется)
+        :param rows: строки (user_id, subscription_id, end_ts) активных подписок
+        """
+        self._active = {}
+        for user_id, subscription_id, end_ts in rows:
+            # Активная подписка у пользователя одна (миграция 14), но на всякий случай учитываем самую позднюю
+            current = self._active.get(user_id)
+            if current is None or end_ts > current[1]:
+                self._active[user_id] = (subscription_id, end_ts)
+        self._rebuild_heap()
+        self.loaded = True
+
+    def _rebuild_heap(self):
+        """
+        Построение кучи заново по актуальным подпискам
+        """
+        self._heap = [(end_ts, user_id, subscription_id) for user_id, (subscription_id, end_ts) in self._active.items()]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, entry: Tuple[int, int, int]) -> bool:
+        """
+        Соответствует ли элемент кучи текущему состоянию подписки
+        """
+        end_ts, user_id, subscription_id = entry
+        return self._active.get(user_id) == (subscription_id, end_ts)
+
+    def set(self, user_id: int, subscription_id: int, end_ts: int):
+        """
+        Добавление или продление подписки
+        :param user_id: ID пользователя
+        :param subscription_id: ID подписки
+        :param end_ts: время окончания подписки (Unix-время)
+        """
+        self._active[user_id] = (subscription_id, end_ts)
+        heapq.heappush(self._heap, (end_ts, user_id, subscription_id))
+        if len(self._heap) > HEAP_COMPACT_FACTOR * len(self._active) + 64:
+            self._rebuild_heap()
+
+    def remove(self, user_id: int, subscription_id: Optional[int] = None):
+        """
+        Удаление подписки из индекса (элемент кучи станет устаревшим)
+        :param user_id: ID пользователя
+        :param subscription_id: ID подписки (если указан, удаляется только эта подписка)
+        """
+        current = self._active.get(user_id)
+        if current is not None and (subscription_id is None or current[0] == subscription_id):
+            del self._active[user_id]
+
+    def get(self, user_id: int, now: int) -> Optional[Tuple[int, int]]:
+        """
+        Активная подписка пользователя
+        :param user_id: ID пользователя
+        :param now: текущее Unix-время
+        :return: (subscription_id, end_ts) или None, если подписки нет или она уже истекла
+        """
+        current = self._active.get(user_id)
+        if current is None or current[1] <= now:
+            return None
+        return current
+
+    def end_ts(self, user_id: int, now: int) -> Optional[int]:
+        """
+        Время окончания активной подписки пользователя
+        :param user_id: ID пользователя
+        :param now: текущее Unix-время
+        :return: Unix-время окончания или None
+        """
+        current = self.get(user_id, now)
+        return current[1] if current else None
+
+    def next_expiry(self) -> Optional[int]:
+        """
+        Ближайшее окончание подписки
+        :return: Unix-время или None, если активных подписок нет
+        """
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def expiring_between(self, start_ts: int, end_ts: int) -> List[Tuple[int, int, int]]:
+        """
+        Подписки, заканчивающиеся в интервале [start_ts, end_ts)
+        Обходятся только вершины кучи меньше end_ts, остальные поддеревья пропускаются
+        :return: Список (end_ts, user_id, subscription_id), упорядоченный по времени окончания
+        """
+        found = []
+        stack = [0] if self._heap else []
+        while stack:
+            i = stack.pop()
+            entry = self._heap[i]
+            if entry[0] >= end_ts:
+                continue
+            if entry[0] >= start_ts and self._is_current(entry):
+                found.append(entry)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap):
+                    stack.append(child)
+        return sorted(found)
+
+    def expired(self, now: int) -> List[Tuple[int, int, int]]:
+        """
+        Истекшие, но еще не деактивированные подписки
+        (из индекса не удаляются - это делает деактивация подписки)
+        :param now: текущее Unix-время
+        :return: Список (end_ts, user_id, subscription_id)
+        """
+        self.next_expiry()
+        return self.expiring_between(0, now + 1)
+
+    def diff(self, rows: Iterable[Tuple[int, int, int]]) -> Dict[str, List[int]]:
+        """
+        Сравнение индекса с данными таблицы подписок
+        :param rows: строки (user_id, subscription_id, end_ts) активных подписок
+        :return: Словарь со списками user_id: missing (нет в индексе), stale (нет в таблице),
+                 changed (другая подписка или время окончания)
+        """
+        expected = SubscriptionIndex()
+        expected.load(rows)
+
+        missing = [user_id for user_id in expected._active if user_id not in self._active]
+        stale = [user_id for user_id in self._active if user_id not in expected._active]
+        changed = [
+            user_id for user_id, value in expected._active.items()
+            if user_id in self._active and self._active[user_id] != value
+        ]
+        return {"missing": missing, "stale": stale, "changed": changed}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика индекса
+        :return: Словарь с количеством подписок и размером кучи
+        """
+        return {
+            "active": len(self._active),
+            "heap_size": len(self._heap),
+            "next_expiry": self.next_expiry(),
+        }
@@ -0,0 +1,122 @@
+"""
+Общие фикстуры тестов бота клуба X10.
+Асинхронные тесты (async def test_...) запускаются через asyncio.run, без дополнительных плагинов pytest.
+Тесты с фикстурой repo выполняются на обоих хранилищах (SQLite и в памяти), с фикстурой db - только на SQLite.
+"""
+import asyncio
+import inspect
+import sys
+from contextlib import contextmanager
+from dataclasses import replace
+from pathlib import Path
+
+import aiosqlite
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import memory_database  # noqa: E402
+import migrations  # noqa: E402
+import scheduled_tasks  # noqa: E402
+from config import DbConfig  # noqa: E402
+from repository import Repository, create_database  # noqa: E402
+
+
+class DatabaseFactory:
+    """
+    Отложенное открытие хранилища: соединения aiosqlite привязаны к циклу событий,
+    поэтому хранилище открывается уже внутри цикла, в котором выполняется тест
+    """
+
+    def __init__(self, config: DbConfig):
+        self.config = config
+
+    async def open(self) -> Repository:
+        db = create_database(self.config)
+        await db.connect()
+        await db.migrate()
+        return db
+
+
+async def _run_async_test(test, kwargs: dict):
+    """
+    Выполнение асинхронного теста: фабрики баз данных заменяются открытыми базами и закрываются после теста
+    """
+    opened = []
+    try:
+        for name, value in kwargs.items():
+            if isinstance(value, DatabaseFactory):
+                kwargs[name] = await value.open()
+                opened.append(kwargs[name])
+        await test(**kwargs)
+    finally:
+        for db in opened:
+            await db.close()
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """
+    Запуск асинхронных тестов через asyncio.run
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(_run_async_test(pyfuncitem.obj, kwargs))
+    return True
+
+
+@pytest.fixture
+def db_config(tmp_path):
+    """
+    Настройки временной базы данных SQLite
+    """
+    return DbConfig(db_path=str(tmp_path / "x10_club.db"), read_pool_size=2, write_flush_interval=0)
+
+
+@pytest.fixture
+def db(db_config):
+    """
+    База данных во временном файле с примененными миграциями
+    """
+    return DatabaseFactory(db_config)
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def repo(request, db_config):
+    """
+    Хранилище данных: каждый тест выполняется и на SQLite, и в памяти
+    """
+    return DatabaseFactory(replace(db_config, backend=request.param))
+
+
+@pytest.fixture
+def shift_time(monkeypatch):
+    """
+    Сдвиг текущего времени хранилищ и планировщика задач (now_ts) на указанное число секунд внутри блока with
+    """
+    real_now_ts = database.now_ts
+
+    @contextmanager
+    def shift(seconds: int):
+        with monkeypatch.context() as patch:
+            for module in (database, memory_database, scheduled_tasks):
+                patch.setattr(module, "now_ts", lambda: real_now_ts() + seconds)
+            yield
+
+    return shift
+
+
+@pytest.fixture
+def migrate_up_to(db_config, monkeypatch):
+    """
+    Применение миграций до указанной версии включительно (база старой версии бота)
+    """
+    async def apply(version: int):
+        with monkeypatch.context() as patch:
+            patch.setattr(migrations, "MIGRATIONS", [m for m in migrations.MIGRATIONS if m[0] <= version])
+            async with aiosqlite.connect(db_config.db_path) as conn:
+                assert await migrations.apply_migrations(conn) == version
+                await conn.commit()
+
+    return apply
@@ -0,0 +1,61 @@
+"""
+Тесты отдельного соединения для отчетов администраторов
+"""
+import asyncio
+import sqlite3
+from contextlib import AsyncExitStack
+
+import pytest
+
+
+async def _collect(pages):
+    return [page async for page in pages]
+
+
+async def test_analytics_connection_is_read_only(db):
+    with pytest.raises(sqlite3.OperationalError):
+        async with db._read(analytics=True) as conn:
+            await conn.execute("INSERT INTO users (user_id) VALUES (1)")
+    assert db._analytics is not None
+    assert db._analytics not in db._reader_conns
+
+
+async def test_reports_do_not_use_reader_pool(db):
+    await db.add_user(1, "member")
+    await db.confirm_payment(await db.create_payment(1, 1000, "club", "card"))
+
+    async with AsyncExitStack() as stack:
+        # Все соединения пула заняты обработчиками пользователей
+        for _ in range(db.config.read_pool_size):
+            await stack.enter_async_context(db._read())
+        stats = await asyncio.wait_for(db.get_stats(), timeout=1)
+        pending = await asyncio.wait_for(db.get_pending_payments(), timeout=1)
+        pages = await asyncio.wait_for(_collect(db.iter_user_pages(analytics=True)), timeout=1)
+
+    assert stats["revenue"] == 1000
+    assert pending == []
+    assert [user['user_id'] for page in pages for user in page] == [1]
+
+
+async def test_pending_payments_report(db):
+    await db.add_user(1, "member", "Иван")
+    payment_ids = [await db.create_payment(1, 1000 * i, "club", "card") for i in range(1, 5)]
+    await db.confirm_payment(payment_ids[1])
+
+    pending = await db.get_pending_payments(limit=2)
+    assert len(pending) == 2
+    assert {p['payment_id'] for p in pending} <= {payment_ids[0], payment_ids[2], payment_ids[3]}
+    assert pending[0]['first_name'] == "Иван"
+
+    # Отчет видит данные, записанные после открытия соединения
+    await db.confirm_payment(payment_ids[0])
+    await db.confirm_payment(payment_ids[2])
+    assert [p['payment_id'] for p in await db.get_pending_payments()] == [payment_ids[3]]
+
+
+async def test_close_releases_analytics_connection(db):
+    await db.get_stats()
+    await db.close()
+    assert db._analytics is None
+    # После повторного открытия отчеты снова работают
+    assert (await db.get_stats())["users"] == 0
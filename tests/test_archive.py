@@ -0,0 +1,96 @@
+"""
+Тесты переноса истекших подписок и завершенных платежей в архив
+"""
+from database import now_ts
+
+
+async def _backdate_payment(db, payment_id: int, days: int):
+    async def operation(conn):
+        await conn.execute(
+            "UPDATE payments SET created_ts = ? WHERE payment_id = ?", (now_ts() - days * 86400, payment_id)
+        )
+
+    await db._submit(operation)
+
+
+async def _populate(db, shift_time):
+    """
+    Пользователь 1: истекшая и активная подписки, платежи разного возраста и статуса
+    :return: ID платежей по названиям
+    """
+    await db.add_user(1, "member")
+    expired_id = await db.add_subscription(1, 5)
+    with shift_time(6 * 86400):
+        await db.deactivate_subscription(expired_id)
+    await db.add_subscription(1, 30)
+
+    payments = {}
+    for name, status, days in (("old_confirmed", "confirmed", 100), ("new_confirmed", "confirmed", 10),
+                               ("old_pending", "pending", 40), ("new_pending", "pending", 5)):
+        payments[name] = await db.create_payment(1, 1000, "club", "card")
+        if status == "confirmed":
+            await db.confirm_payment(payments[name])
+        await _backdate_payment(db, payments[name], days)
+    return expired_id, payments
+
+
+async def test_archive_moves_only_settled_rows(db, shift_time):
+    _, payments = await _populate(db, shift_time)
+    stats = await db.get_stats()
+
+    assert await db.archive_subscriptions() == 1
+    assert await db.archive_payments(confirmed_days=90, pending_days=30) == 2
+    # Повторный запуск ничего не переносит
+    assert await db.archive_subscriptions() == 0
+    assert await db.archive_payments(confirmed_days=90, pending_days=30) == 0
+
+    hot_subscriptions = await db.get_user_subscriptions(1)
+    assert [s['status'] for s in hot_subscriptions] == ["active"]
+    assert await db.check_subscription(1) is not None
+    hot_payments = {p['payment_id'] for p in await db.get_user_payments(1)}
+    assert hot_payments == {payments["new_confirmed"], payments["new_pending"]}
+    assert await db.get_payment(payments["old_confirmed"]) is None
+
+    # Архивные строки по-прежнему учитываются в статистике
+    assert await db.get_stats() == stats
+
+
+async def test_history_includes_archived_rows(db, shift_time):
+    expired_id, payments = await _populate(db, shift_time)
+    await db.archive_subscriptions()
+    await db.archive_payments(confirmed_days=90, pending_days=30)
+
+    subscriptions = await db.get_user_subscriptions(1, include_archive=True)
+    assert [(s['status'], s['archived_ts'] is not None) for s in subscriptions] == [("active", False), ("expired", True)]
+    assert subscriptions[1]['subscription_id'] == expired_id
+
+    history = await db.get_user_payments(1, include_archive=True)
+    assert [p['payment_id'] for p in history] == [
+        payments["new_pending"], payments["new_confirmed"], payments["old_pending"], payments["old_confirmed"]
+    ]
+    archived = {p['payment_id']: p for p in history if p['archived_ts'] is not None}
+    assert sorted(archived) == [payments["old_confirmed"], payments["old_pending"]]
+    assert archived[payments["old_confirmed"]]['status'] == "confirmed"
+    assert archived[payments["old_confirmed"]]['confirmed_ts'] is not None
+    assert len(await db.get_user_payments(1, include_archive=True, limit=3)) == 3
+
+
+async def test_archive_runs_in_batches(db, monkeypatch, shift_time):
+    await db.add_user(1, "member")
+    for _ in range(5):
+        subscription_id = await db.add_subscription(1, 5)
+        with shift_time(6 * 86400):
+            await db.deactivate_subscription(subscription_id)
+
+    batches = []
+    archive_batch = db._archive_batch
+
+    async def counting_batch(table, where, params, batch_size):
+        moved = await archive_batch(table, where, params, batch_size)
+        batches.append(moved)
+        return moved
+
+    monkeypatch.setattr(db, "_archive_batch", counting_batch)
+    assert await db.archive_subscriptions(batch_size=2) == 5
+    assert batches == [2, 2, 1]
+    assert len(await db.get_user_subscriptions(1, include_archive=True)) == 5
@@ -0,0 +1,102 @@
+"""
+Тесты резервного копирования базы данных
+"""
+import asyncio
+import gzip
+import os
+import sqlite3
+from dataclasses import replace
+
+import pytest
+
+import backup
+from backup import create_backup, list_backups, rotate_backups
+from config import BackupConfig
+
+
+def _make_source(path: str):
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO users VALUES (?)", [(i,) for i in range(100)])
+
+
+def _restore(backup_path: str, target) -> sqlite3.Connection:
+    target.write_bytes(gzip.decompress(open(backup_path, "rb").read()))
+    return sqlite3.connect(target)
+
+
+def test_backup_is_consistent_copy(tmp_path):
+    source = str(tmp_path / "x10_club.db")
+    _make_source(source)
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"), compression="gzip")
+
+    backup_path = asyncio.run(create_backup(source, config))
+    assert backup_path.endswith(".db.gz")
+    with _restore(backup_path, tmp_path / "restored.db") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 100
+    # Временные файлы удалены
+    assert os.listdir(config.backup_dir) == [os.path.basename(backup_path)]
+
+
+async def test_backup_includes_data_in_wal(db, tmp_path):
+    for user_id in range(1, 51):
+        await db.add_user(user_id, f"user{user_id}")
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"))
+
+    # Бот продолжает писать во время снятия копии
+    backup_path, _ = await asyncio.gather(create_backup(db.db_path, config), db.add_user(51, "late"))
+    with _restore(backup_path, tmp_path / "restored.db") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] in (50, 51)
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+
+def test_rotation_keeps_latest(tmp_path):
+    source = str(tmp_path / "x10_club.db")
+    _make_source(source)
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"), compression="none", keep=2)
+
+    async def scenario():
+        return [await create_backup(source, config) for _ in range(3)]
+
+    created = asyncio.run(scenario())
+    assert len(set(created)) == 3
+    assert rotate_backups(config) == created[:1]
+    assert list_backups(config) == created[1:]
+    assert rotate_backups(config, keep=0) == created[1:]
+
+
+def test_manual_backup_is_kept_out_of_rotation(tmp_path):
+    source = str(tmp_path / "x10_club.db")
+    _make_source(source)
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"), compression="none", keep=2)
+
+    async def scenario():
+        nightly = [await create_backup(source, config) for _ in range(2)]
+        # Копия в другую папку (ручная выгрузка /base)
+        return nightly, await create_backup(source, config, str(tmp_path / "manual"))
+
+    nightly, manual = asyncio.run(scenario())
+    assert os.path.dirname(manual) == str(tmp_path / "manual")
+    assert list_backups(config) == nightly
+    assert rotate_backups(config) == []
+    assert list_backups(replace(config, backup_dir=str(tmp_path / "manual"))) == [manual]
+
+
+def test_zstd_falls_back_to_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "zstandard", None)
+    source = str(tmp_path / "x10_club.db")
+    _make_source(source)
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"), compression="zstd")
+    assert asyncio.run(create_backup(source, config)).endswith(".db.gz")
+
+
+def test_failed_backup_leaves_no_files(tmp_path, monkeypatch):
+    def failing_copy(db_path, target_path, pages_per_step):
+        open(target_path, "wb").close()
+        raise sqlite3.OperationalError("unable to open database file")
+
+    monkeypatch.setattr(backup, "_copy_database", failing_copy)
+    config = BackupConfig(backup_dir=str(tmp_path / "backups"))
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(create_backup(str(tmp_path / "x10_club.db"), config))
+    assert os.listdir(config.backup_dir) == []
@@ -0,0 +1,135 @@
+"""
+Тесты рассылок: пауза, продолжение, перезапуск бота и отмена
+"""
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest
+
+from broadcast import BroadcastEngine, format_progress
+from config import BroadcastConfig
+from delivery import Delivery
+from segments import Segment
+
+
+class SlowBot:
+    """Бот с задержкой отправки, запоминающий получателей (отправка пользователям из failing завершается ошибкой)"""
+
+    def __init__(self, failing=()):
+        self.sent = []
+        self.failing = set(failing)
+
+    async def __call__(self, method):
+        await asyncio.sleep(0.01)
+        if method.chat_id in self.failing:
+            raise TelegramBadRequest(method=method, message="Bad Request: message can't be sent")
+        self.sent.append(method.chat_id)
+        return True
+
+    async def edit_message_text(self, *args, **kwargs):
+        return True
+
+
+async def _add_users(repo, user_ids):
+    for user_id in user_ids:
+        await repo.add_user(user_id, f"user{user_id}")
+
+
+async def _wait_status(repo, broadcast_id, status):
+    for _ in range(1000):
+        broadcast = await repo.get_broadcast(broadcast_id)
+        if broadcast.status == status:
+            return broadcast
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"рассылка не перешла в статус {status}")
+
+
+async def test_pause_resume_and_restart_send_each_message_once(repo):
+    await _add_users(repo, range(1, 121))
+    bot = SlowBot()
+    config = BroadcastConfig(workers=4, claim_batch=10, progress_interval=1)
+    engine = BroadcastEngine(bot, repo, config, Delivery(bot, repo))
+
+    broadcast_id = await engine.create(1, "text", "Новости клуба", None)
+    await asyncio.sleep(0.05)
+    assert await engine.pause(broadcast_id)
+    paused_count = len(bot.sent)
+    assert paused_count < 120
+    await asyncio.sleep(0.05)
+    assert len(bot.sent) == paused_count
+    assert not await engine.pause(broadcast_id)
+
+    assert await engine.resume(broadcast_id)
+    await asyncio.sleep(0.05)
+    # Остановка бота: рассылка остается running и продолжается новым движком
+    await engine.close()
+    assert (await repo.get_broadcast(broadcast_id)).status == "running"
+
+    # Пользователи, зарегистрированные во время рассылки, тоже получают сообщение
+    await _add_users(repo, range(121, 131))
+
+    restarted = BroadcastEngine(bot, repo, config, Delivery(bot, repo))
+    await restarted.start()
+    broadcast = await _wait_status(repo, broadcast_id, "completed")
+    await restarted.close()
+
+    assert sorted(bot.sent) == list(range(1, 131))
+    assert (broadcast.sent, broadcast.failed) == (130, 0)
+    assert "завершена" in format_progress(broadcast)
+
+
+async def test_failed_sends_are_counted(repo):
+    await _add_users(repo, range(1, 11))
+    bot = SlowBot(failing=(3, 7))
+    engine = BroadcastEngine(bot, repo, BroadcastConfig(workers=3, claim_batch=4))
+
+    broadcast = await _wait_status(repo, await engine.create(1, "text", "x", None), "completed")
+    await engine.close()
+    assert sorted(bot.sent) == [1, 2, 4, 5, 6, 8, 9, 10]
+    assert (broadcast.total, broadcast.sent, broadcast.failed) == (10, 8, 2)
+
+
+async def test_interrupted_sends_are_not_repeated(repo):
+    await _add_users(repo, range(1, 6))
+    broadcast_id = await repo.create_broadcast(1, "text", "x", None, 5)
+    assert await repo.claim_broadcast_recipients(broadcast_id, 3) == [1, 2, 3]
+    # Бот остановился во время отправки пользователю 1: доставлено ли сообщение - неизвестно
+    await repo.mark_broadcast_sending(broadcast_id, 1)
+
+    reset = await repo.reset_broadcast_recipients(broadcast_id)
+    assert reset["interrupted"] == 1
+    assert await repo.claim_broadcast_recipients(broadcast_id, 10) == [2, 3, 4, 5]
+    broadcast = await repo.get_broadcast(broadcast_id)
+    assert (broadcast.sent, broadcast.failed) == (0, 1)
+
+
+async def test_cancel(repo):
+    await _add_users(repo, range(1, 6))
+    bot = SlowBot()
+    engine = BroadcastEngine(bot, repo, BroadcastConfig(workers=2, claim_batch=2))
+
+    broadcast_id = await engine.create(1, "text", "x", None)
+    await _wait_status(repo, broadcast_id, "completed")
+    assert not await engine.cancel(broadcast_id)
+
+    await engine.pause(await engine.create(1, "text", "x", None))
+    paused = (await engine.recent(limit=1))[0]
+    assert await engine.cancel(paused.broadcast_id)
+    assert not await engine.resume(paused.broadcast_id)
+    assert (await repo.get_broadcast(paused.broadcast_id)).status == "cancelled"
+    await engine.close()
+
+
+async def test_segment_limits_recipients(repo):
+    await _add_users(repo, range(1, 6))
+    await repo.add_subscription(2, 30)
+    await repo.add_subscription(4, 30)
+    await repo.load_subscription_index()
+    bot = SlowBot()
+    engine = BroadcastEngine(bot, repo, BroadcastConfig(workers=2, claim_batch=2))
+
+    broadcast_id = await engine.create(1, "text", "Только подписчикам", None, segment=Segment().active())
+    broadcast = await _wait_status(repo, broadcast_id, "completed")
+    await engine.close()
+    assert sorted(bot.sent) == [2, 4]
+    assert broadcast.total == 2
+    assert Segment.from_json(broadcast.segment) == Segment().active()
@@ -0,0 +1,44 @@
+"""
+Тесты выборок по набору пользователей
+"""
+import database
+from database import now_ts
+
+
+async def _populate(db):
+    for user_id in range(1, 8):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.add_referral(5, 1)
+    await db.add_referral(6, 1)
+    await db.add_referral(7, 2)
+    await db.add_subscription(1, 30)
+    await db.add_subscription(3, 5)
+    expired_id = await db.add_subscription(4, 5)
+
+    async def expire(conn):
+        await conn.execute("UPDATE subscriptions SET end_ts = ? WHERE subscription_id = ?", (now_ts() - 1, expired_id))
+
+    await db._submit(expire)
+
+
+async def test_bulk_lookups_span_chunks(db, monkeypatch):
+    monkeypatch.setattr(database, "BULK_CHUNK_SIZE", 2)
+    await _populate(db)
+    user_ids = [1, 2, 3, 4, 99, 1, 7]
+
+    users = await db.get_users_bulk(user_ids)
+    assert sorted(users) == [1, 2, 3, 4, 7]
+    assert users[7]['username'] == "user7"
+
+    counts = await db.count_referrals_bulk(user_ids)
+    assert counts == {1: 2, 2: 1, 3: 0, 4: 0, 99: 0, 7: 0}
+
+    subscriptions = await db.get_active_subscriptions_bulk(user_ids)
+    assert sorted(subscriptions) == [1, 3]
+    assert subscriptions[1] == await db.check_subscription(1)
+
+
+async def test_bulk_lookups_accept_empty_input(repo):
+    assert await repo.get_users_bulk([]) == {}
+    assert await repo.count_referrals_bulk(iter(())) == {}
+    assert await repo.get_active_subscriptions_bulk(set()) == {}
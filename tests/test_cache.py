@@ -0,0 +1,144 @@
+"""
+Тесты кэша чтения (TTLCache) и его инвалидации в Database
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+import cache
+import database
+from cache import TTLCache
+
+
+def _loader(values, calls, delay=0.0):
+    """
+    Загрузчик, возвращающий значения из списка по очереди и запоминающий вызовы
+    """
+    async def load():
+        calls.append(len(calls))
+        if delay:
+            await asyncio.sleep(delay)
+        return values[len(calls) - 1]
+
+    return load
+
+
+async def test_hit_miss_and_lru_eviction():
+    users = TTLCache("test", maxsize=2, ttl=60)
+    calls = []
+    load = _loader(["a", "b", "c", "b2"], calls)
+    assert await users.get_or_load(1, load) == "a"
+    assert await users.get_or_load(1, load) == "a"
+    assert await users.get_or_load(2, load) == "b"
+    # Ключ 1 использовался позже, чем 2, поэтому при добавлении ключа 3 вытесняется ключ 2
+    assert await users.get_or_load(1, load) == "a"
+    assert await users.get_or_load(3, load) == "c"
+    assert await users.get_or_load(2, load) == "b2"
+    assert len(calls) == 4
+
+    stats = users.stats()
+    assert (stats["size"], stats["hits"], stats["misses"]) == (2, 2, 4)
+
+
+async def test_entries_expire_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: clock[0])
+    users = TTLCache("test", ttl=10)
+    calls = []
+    await users.get_or_load(1, _loader(["old", "new"], calls))
+    clock[0] += 9
+    assert await users.get_or_load(1, _loader(["old", "new"], calls)) == "old"
+    clock[0] += 2
+    assert await users.get_or_load(1, _loader(["old", "new"], calls)) == "new"
+
+
+async def test_concurrent_misses_share_one_load():
+    users = TTLCache("test")
+    calls = []
+    load = _loader(["value"], calls, delay=0.01)
+    results = await asyncio.gather(*(users.get_or_load(1, load) for _ in range(5)))
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert users.stats()["coalesced"] == 4
+
+
+async def test_invalidation_during_load_discards_value():
+    users = TTLCache("test")
+    calls = []
+    load = _loader(["stale", "fresh"], calls, delay=0.01)
+    pending = asyncio.ensure_future(users.get_or_load(1, load))
+    await asyncio.sleep(0)
+    users.invalidate(1)
+    assert await pending == "stale"
+    # Загруженное до изменения значение не сохранено
+    assert await users.get_or_load(1, load) == "fresh"
+    assert len(calls) == 2
+
+
+async def test_failed_load_is_not_cached():
+    users = TTLCache("test")
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("ошибка чтения")
+
+    results = await asyncio.gather(*(users.get_or_load(1, failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await users.get_or_load(1, _loader(["value"], [])) == "value"
+
+
+async def test_user_writes_invalidate_cached_user(db):
+    await db.add_user(1, "member")
+    assert (await db.get_user(1))['username'] == "member"
+    assert (await db.get_user(1))['username'] == "member"
+    user_stats = db.cache_stats()[0]
+    assert (user_stats["misses"], user_stats["hits"]) == (1, 1)
+
+    await db.add_user(1, "renamed")
+    assert (await db.get_user(1))['username'] == "renamed"
+    await db.update_user_balance(1, 100)
+    assert (await db.get_user(1))['balance'] == 100
+
+
+async def test_subscription_writes_invalidate_cached_subscription(db, shift_time):
+    await db.add_user(1, "referrer")
+    await db.add_user(2, "invitee")
+    assert await db.check_subscription(2) is None
+
+    await db.apply_referral(2, 1, 100, 7)
+    subscription = await db.check_subscription(2)
+    assert subscription is not None
+    assert (await db.get_user(1))['balance'] == 100
+
+    await db.add_subscription(2, 30)
+    assert (await db.check_subscription(2))['end_ts'] == subscription['end_ts'] + 30 * 86400
+
+    with shift_time(40 * 86400):
+        await db.deactivate_subscription(subscription['subscription_id'])
+    assert await db.check_subscription(2) is None
+
+
+async def test_cached_subscription_expires_without_invalidation(db, monkeypatch):
+    await db.add_user(1, "member")
+    await db.add_subscription(1, 1)
+    subscription = await db.check_subscription(1)
+    assert subscription is not None
+
+    monkeypatch.setattr(database, "now_ts", lambda: subscription['end_ts'])
+    assert await db.check_subscription(1) is None
+
+
+@pytest.mark.parametrize("method", ["get_user", "check_subscription"])
+async def test_cache_serves_repeated_reads_without_queries(db, method):
+    await db.add_user(1, "member")
+    await db.add_subscription(1, 30)
+    expected = await getattr(db, method)(1)
+
+    @asynccontextmanager
+    async def no_reads():
+        raise AssertionError("запрос к базе при попадании в кэш")
+        yield
+
+    db._read = no_reads
+    assert await getattr(db, method)(1) == expected
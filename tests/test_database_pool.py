@@ -0,0 +1,49 @@
+"""
+Тесты пула соединений Database
+"""
+import asyncio
+import sqlite3
+
+import pytest
+
+
+async def test_pool_reuses_connections(db):
+    readers = list(db._reader_conns)
+    writer = db._writer
+    assert len(readers) == 2
+
+    await db.add_user(1, "member")
+    users = await asyncio.gather(*(db.get_user(1) for _ in range(10)))
+    assert all(user['username'] == "member" for user in users)
+
+    # Соединения не открываются на каждый запрос
+    assert db._reader_conns == readers
+    assert db._writer is writer
+    assert db._readers.qsize() == 2
+
+
+async def test_connections_use_configured_pragmas(db):
+    async with db._read() as conn:
+        cursor = await conn.execute("PRAGMA journal_mode")
+        assert (await cursor.fetchone())[0] == "wal"
+        cursor = await conn.execute("PRAGMA busy_timeout")
+        assert (await cursor.fetchone())[0] == db.config.busy_timeout
+
+
+async def test_reader_connections_are_read_only(db):
+    with pytest.raises(sqlite3.OperationalError):
+        async with db._read() as conn:
+            await conn.execute("INSERT INTO users (user_id) VALUES (1)")
+    # Соединение вернулось в пул после ошибки
+    assert db._readers.qsize() == 2
+    assert await db.get_user(1) is None
+
+
+async def test_pool_reopens_after_close(db):
+    await db.add_user(1, "member")
+    await db.close()
+    assert db._writer is None
+
+    # Первый запрос после закрытия снова открывает пул
+    assert (await db.get_user(1))['username'] == "member"
+    assert len(db._reader_conns) == 2
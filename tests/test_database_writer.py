@@ -0,0 +1,131 @@
+"""
+Тесты задачи-писателя Database (group commit)
+"""
+import asyncio
+
+import pytest
+
+from database import Database
+
+
+async def test_batch_operations_commit_independently(db):
+    async def failing(conn):
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (9, 'rolled_back')")
+        raise ValueError("ошибка операции")
+
+    results = await asyncio.gather(
+        db.add_user(1, "first"), db._submit(failing), db.add_user(2, "second"),
+        return_exceptions=True
+    )
+    assert isinstance(results[1], ValueError)
+    assert (await db.get_user(1))['username'] == "first"
+    assert (await db.get_user(2))['username'] == "second"
+    assert await db.get_user(9) is None
+
+
+async def test_concurrent_writes_share_one_commit(db_config):
+    db_config.write_flush_interval = 0.05
+    db = Database(db_config.db_path, db_config)
+    await db.connect()
+    await db.migrate()
+    execute = db._writer.execute
+    commits = []
+
+    async def counting_execute(sql, *args, **kwargs):
+        if sql == "COMMIT":
+            commits.append(sql)
+        return await execute(sql, *args, **kwargs)
+
+    db._writer.execute = counting_execute
+    try:
+        payment_ids = await asyncio.gather(
+            *(db.create_payment(user_id, 1000, "club", "card") for user_id in range(1, 51))
+        )
+        # Каждый вызывающий получает свой результат, а транзакция одна на весь пакет
+        assert sorted(payment_ids) == list(range(1, 51))
+        assert len(commits) == 1
+    finally:
+        db._writer.execute = execute
+        await db.close()
+
+
+async def test_batch_size_limits_transaction(db_config):
+    db_config.write_flush_interval = 0.05
+    db_config.write_batch_size = 10
+    db = Database(db_config.db_path, db_config)
+    await db.connect()
+    await db.migrate()
+    execute = db._writer.execute
+    commits = []
+
+    async def counting_execute(sql, *args, **kwargs):
+        if sql == "COMMIT":
+            commits.append(sql)
+        return await execute(sql, *args, **kwargs)
+
+    db._writer.execute = counting_execute
+    try:
+        await asyncio.gather(*(db.add_user(user_id) for user_id in range(1, 26)))
+        assert len(commits) == 3
+    finally:
+        db._writer.execute = execute
+        await db.close()
+
+
+async def test_close_drains_queued_writes(db_config):
+    db = Database(db_config.db_path, db_config)
+    await db.connect()
+    await db.migrate()
+    pending = [asyncio.ensure_future(db.add_user(user_id, f"user{user_id}")) for user_id in range(1, 21)]
+    await asyncio.sleep(0)
+    await db.close()
+    assert all(task.done() and task.exception() is None for task in pending)
+
+    reopened = Database(db_config.db_path, db_config)
+    try:
+        users = await asyncio.gather(*(reopened.get_user(user_id) for user_id in range(1, 21)))
+        assert [user['username'] for user in users] == [f"user{user_id}" for user_id in range(1, 21)]
+    finally:
+        await reopened.close()
+
+
+async def test_write_error_reaches_caller(db):
+    async def failing(conn):
+        await conn.execute("INSERT INTO missing_table VALUES (1)")
+
+    with pytest.raises(Exception, match="missing_table"):
+        await db._submit(failing)
+    await db.add_user(1, "after")
+    assert (await db.get_user(1))['username'] == "after"
+
+
+async def test_writer_survives_failed_rollback(db):
+    writer = db._writer
+    execute = writer.execute
+    failures = {"COMMIT", "ROLLBACK"}
+
+    async def flaky_execute(sql, *args, **kwargs):
+        if sql in failures:
+            failures.discard(sql)
+            raise RuntimeError(f"сбой {sql}")
+        return await execute(sql, *args, **kwargs)
+
+    writer.execute = flaky_execute
+    try:
+        with pytest.raises(RuntimeError, match="COMMIT"):
+            await db.add_user(1, "lost")
+    finally:
+        writer.execute = execute
+
+    # Транзакция осталась открытой после неудачного отката, но задача-писатель жива
+    assert not db._writer_task.done()
+    await db.add_user(2, "after")
+    assert await db.get_user(1) is None
+    assert (await db.get_user(2))['username'] == "after"
+
+
+async def test_dead_writer_task_is_restarted(db):
+    db._writer_task.cancel()
+    await asyncio.gather(db._writer_task, return_exceptions=True)
+    await db.add_user(3, "restarted")
+    assert (await db.get_user(3))['username'] == "restarted"
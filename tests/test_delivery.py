@@ -0,0 +1,120 @@
+"""
+Тесты доставки сообщений и недоставленных сообщений
+"""
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendMessage, SendPhoto
+
+from broadcast import BroadcastEngine
+from config import BroadcastConfig
+from delivery import Delivery, dump_method, load_method
+from repository import broadcast_campaign_id
+from segments import Segment
+
+
+class FakeBot:
+    """Бот, отклоняющий отправку в чаты из failing и blocked"""
+
+    def __init__(self, failing=(), blocked=()):
+        self.failing = set(failing)
+        self.blocked = set(blocked)
+        self.sent = []
+
+    async def __call__(self, method):
+        if method.chat_id in self.blocked:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if method.chat_id in self.failing:
+            raise TelegramBadRequest(method=method, message="Bad Request: message can't be sent")
+        self.sent.append(method.chat_id)
+        return True
+
+    async def edit_message_text(self, *args, **kwargs):
+        return True
+
+
+def test_method_round_trip():
+    method = SendPhoto(chat_id=5, photo="file-id", caption="Фото")
+    restored = load_method("SendPhoto", dump_method(method))
+    assert restored == method
+    with pytest.raises(ValueError):
+        load_method("Delivery", "{}")
+
+
+async def test_failed_message_is_stored_and_redriven(repo):
+    bot = FakeBot(failing={2})
+    delivery = Delivery(bot, repo)
+
+    assert await delivery.send_message(1, "hi", "referral_reminder")
+    result = await delivery.send_message(2, "Напоминание", "referral_reminder")
+    assert not result and "message can't be sent" in result.error
+    await delivery.send_message(2, "Предложение", "limited_offer")
+    assert await repo.count_dead_letters() == {"referral_reminder": 1, "limited_offer": 1}
+
+    letter = (await repo.get_dead_letters("referral_reminder"))[0]
+    assert (letter.chat_id, letter.method, letter.attempts) == (2, "SendMessage", 1)
+    assert load_method(letter.method, letter.payload) == SendMessage(chat_id=2, text="Напоминание")
+
+    # Ошибка при повторной отправке - запись остается ожидающей
+    assert await delivery.redrive("referral_reminder") == {"delivered": 0, "failed": 1}
+    assert (await repo.get_dead_letters("referral_reminder"))[0].attempts == 2
+
+    bot.failing.clear()
+    assert await delivery.redrive() == {"delivered": 2, "failed": 0}
+    assert await repo.count_dead_letters() == {}
+    assert bot.sent == [1, 2, 2]
+
+
+async def test_redrive_updates_broadcast_counters(repo):
+    for user_id in range(1, 11):
+        await repo.add_user(user_id, f"user{user_id}")
+    bot = FakeBot(failing={3, 7})
+    delivery = Delivery(bot, repo)
+    engine = BroadcastEngine(bot, repo, BroadcastConfig(workers=3, claim_batch=4), delivery)
+
+    broadcast_id = await engine.create(100, "text", "Новости клуба", None)
+    for _ in range(500):
+        broadcast = await repo.get_broadcast(broadcast_id)
+        if broadcast.status == "completed":
+            break
+        await asyncio.sleep(0.01)
+    await engine.close()
+    assert (broadcast.sent, broadcast.failed, broadcast.total) == (8, 2, 10)
+    assert await repo.count_dead_letters() == {f"broadcast:{broadcast_id}": 2}
+
+    bot.failing.clear()
+    assert await delivery.redrive() == {"delivered": 2, "failed": 0}
+    broadcast = await repo.get_broadcast(broadcast_id)
+    assert (broadcast.sent, broadcast.failed) == (10, 0)
+    assert await repo.count_dead_letters() == {}
+
+    # Повторная отметка той же записи счетчики не меняет
+    await repo.resolve_dead_letter(1, True)
+    broadcast = await repo.get_broadcast(broadcast_id)
+    assert (broadcast.sent, broadcast.failed) == (10, 0)
+
+
+def test_broadcast_campaign_id():
+    assert broadcast_campaign_id("broadcast:12") == 12
+    assert broadcast_campaign_id("broadcast:") is None
+    assert broadcast_campaign_id("referral_reminder") is None
+    assert broadcast_campaign_id(None) is None
+
+async def test_blocked_user_becomes_unreachable(repo):
+    for user_id in (1, 2):
+        await repo.add_user(user_id, f"user{user_id}")
+    delivery = Delivery(FakeBot(blocked={2}), repo)
+
+    assert await delivery.send_message(1, "hi", "test")
+    result = await delivery.send_message(2, "hi", "test")
+    assert not result and result.unreachable
+    # Заблокировавшим бота сообщение не сохраняется для повторной отправки
+    assert await repo.count_dead_letters() == {}
+    assert await repo.count_unreachable_users() == 1
+    assert await repo.count_users(Segment()) == 1
+    assert await repo.count_users(Segment().with_unreachable()) == 2
+
+    # Пользователь снова написал боту
+    await repo.add_user(2, "user2")
+    assert await repo.count_unreachable_users() == 0
@@ -0,0 +1,82 @@
+"""
+Тесты замеров запросов к базе данных
+"""
+import logging
+
+import pytest
+
+from database import Database
+from instrumentation import QueryStats, fingerprint
+
+
+def test_fingerprint_removes_values():
+    assert fingerprint("SELECT * FROM users WHERE user_id = 42 AND username = 'it''s'") == \
+        "SELECT * FROM users WHERE user_id = ? AND username = ?"
+    assert fingerprint("SELECT *\n  FROM users WHERE user_id IN (?, ?,?)") == \
+        fingerprint("SELECT * FROM users WHERE user_id IN (?)") == "SELECT * FROM users WHERE user_id IN (...)"
+
+
+def test_percentile_and_top():
+    stats = QueryStats(slow_query_ms=100)
+    fast, _ = stats.get("SELECT user_id FROM users WHERE user_id = 1")
+    slow, first_seen = stats.get("SELECT username FROM users")
+    assert first_seen and not stats.get("SELECT user_id FROM users WHERE user_id = 2")[1]
+    for _ in range(19):
+        stats.record(fast, 0.5)
+    stats.record(fast, 70)
+    stats.record(slow, 200)
+    # Время чтения результата не считается отдельным запросом
+    stats.record(slow, 1, fetch=True)
+
+    assert fast.percentile(0.5) == 1
+    assert fast.percentile(0.99) == 100
+    top = stats.top(order_by="max_ms")
+    assert [stat["fingerprint"] for stat in top] == ["SELECT username FROM users", "SELECT user_id FROM users WHERE user_id = ?"]
+    assert (top[0]["count"], top[0]["slow"], top[0]["total_ms"]) == (1, 1, 201)
+    assert top[1]["slow"] == 0
+    stats.reset()
+    assert stats.top() == []
+
+
+async def test_statements_are_timed_per_fingerprint(db):
+    for user_id in range(1, 4):
+        await db.add_user(user_id, f"user{user_id}")
+        await db.get_user(user_id)
+
+    stats = {stat["fingerprint"]: stat for stat in db.query_stats.top(limit=100)}
+    select = stats["SELECT * FROM users WHERE user_id = ?"]
+    assert select["count"] == 3
+    assert select["plan"] and not select["full_scan"]
+    # Служебные запросы задачи-писателя тоже учитываются
+    assert stats["COMMIT"]["count"] >= 1
+
+
+async def test_full_scan_and_slow_query_are_reported(db, caplog):
+    db.query_stats.slow_query_ms = 0
+    with caplog.at_level(logging.WARNING, logger="instrumentation"):
+        async with db._read() as conn:
+            cursor = await conn.execute("SELECT COUNT(*) FROM users WHERE username = ?", ("x",))
+            await cursor.fetchone()
+
+    scans = db.query_stats.full_scans()
+    assert [stat["fingerprint"] for stat in scans] == ["SELECT COUNT(*) FROM users WHERE username = ?"]
+    assert any("Полный просмотр" in record.message for record in caplog.records)
+    assert any("Медленный запрос" in record.message for record in caplog.records)
+
+
+async def test_migrations_are_not_instrumented(db_config):
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        assert db.query_stats.full_scans() == []
+        assert not any("CREATE TABLE" in stat["fingerprint"] for stat in db.query_stats.top(limit=1000))
+    finally:
+        await db.close()
+
+
+async def test_failed_statement_is_still_counted(db):
+    with pytest.raises(Exception):
+        async with db._read() as conn:
+            await conn.execute("SELECT * FROM missing_table")
+    stats = {stat["fingerprint"]: stat for stat in db.query_stats.top(limit=100)}
+    assert stats["SELECT * FROM missing_table"]["count"] == 1
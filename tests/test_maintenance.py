@@ -0,0 +1,49 @@
+"""
+Тесты обслуживания базы данных
+"""
+import asyncio
+import os
+import sqlite3
+
+from config import MaintenanceConfig
+from maintenance import format_report, run_maintenance
+
+
+async def test_maintenance_frees_pages_and_truncates_wal(db):
+    for user_id in range(1, 2001):
+        await db.add_user(user_id, "x" * 200)
+
+    async def delete_users(conn):
+        await conn.execute("DELETE FROM users WHERE user_id > 100")
+
+    await db._submit(delete_users)
+    assert os.path.getsize(f"{db.db_path}-wal") > 0
+
+    # Бот продолжает работать, пока идет обслуживание
+    report, _ = await asyncio.gather(run_maintenance(db.db_path, MaintenanceConfig()), db.add_user(5000, "late"))
+    assert not report["vacuumed"]
+    assert report["before"]["freelist_count"] > 0
+    assert report["after"]["freelist_count"] == 0
+    assert report["after"]["page_count"] < report["before"]["page_count"]
+    assert report["checkpoint"]["busy"] == 0
+
+    with sqlite3.connect(db.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    assert (await db.get_user(5000))['username'] == "late"
+    assert "Свободных страниц" in format_report(report)
+
+
+def test_old_database_is_converted_to_incremental_vacuum(tmp_path):
+    path = str(tmp_path / "x10_club.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY)")
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    report = asyncio.run(run_maintenance(path, MaintenanceConfig()))
+    assert report["vacuumed"]
+    assert "VACUUM" in format_report(report)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # Повторное обслуживание полный VACUUM не выполняет
+    assert not asyncio.run(run_maintenance(path, MaintenanceConfig()))["vacuumed"]
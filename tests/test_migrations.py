@@ -0,0 +1,79 @@
+"""
+Тесты миграций схемы базы данных
+"""
+import aiosqlite
+import pytest
+
+import migrations
+from database import Database
+from migrations import get_schema_version, LATEST_VERSION
+
+
+async def _index_names(db) -> set:
+    async with db._read() as conn:
+        cursor = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {row[0] for row in await cursor.fetchall()}
+
+
+async def test_fresh_database_migrates_to_latest(db):
+    async with db._read() as conn:
+        assert await get_schema_version(conn) == LATEST_VERSION
+        cursor = await conn.execute("SELECT version FROM schema_version ORDER BY version")
+        assert [row[0] for row in await cursor.fetchall()] == [m[0] for m in migrations.MIGRATIONS]
+    assert {"idx_referrals_referrer_active", "idx_payments_pending"} <= await _index_names(db)
+
+
+async def test_up_to_date_schema_skips_writes(db):
+    async def no_writes(operation):
+        raise AssertionError("миграции не должны выполнять запись")
+
+    db._submit = no_writes
+    assert await db.migrate() == LATEST_VERSION
+
+
+async def test_old_schema_is_upgraded(db_config, migrate_up_to):
+    await migrate_up_to(1)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'old')")
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        assert await db.migrate() == LATEST_VERSION
+        assert "idx_referrals_referrer_active" in await _index_names(db)
+        assert (await db.get_user(1))['username'] == "old"
+    finally:
+        await db.close()
+
+
+async def test_failed_migration_is_rolled_back(db_config, migrate_up_to, monkeypatch):
+    await migrate_up_to(1)
+    broken = (LATEST_VERSION + 1, "Ошибочная миграция", [
+        "CREATE INDEX idx_broken ON users (username)",
+        "CREATE INDEX idx_broken_missing ON missing_table (column)",
+    ])
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [broken])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", broken[0])
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        with pytest.raises(Exception, match="missing_table"):
+            await db.migrate()
+        async with db._read() as conn:
+            assert await get_schema_version(conn) == 1
+        assert "idx_broken" not in await _index_names(db)
+    finally:
+        await db.close()
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT payment_id FROM payments WHERE status = 'pending' ORDER BY created_at",
+    "SELECT subscription_id FROM subscriptions WHERE user_id = 1 AND status = 'active'",
+    "SELECT COUNT(*) FROM referrals WHERE referrer_id = 1 AND is_active = 1",
+    "SELECT referrer_id FROM referrals WHERE user_id = 1",
+])
+async def test_frequent_queries_use_indexes(db, query):
+    async with db._read() as conn:
+        cursor = await conn.execute(f"EXPLAIN QUERY PLAN {query}")
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+    assert "USING" in plan and "INDEX" in plan, plan
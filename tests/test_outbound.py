@@ -0,0 +1,219 @@
+"""
+Тесты планировщика исходящих сообщений
+"""
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from config import OutboundConfig
+from outbound import (
+    OutboundScheduler, PRIORITY_BULK, PRIORITY_TRANSACTIONAL, outbound_priority, send_priority, with_priority
+)
+
+
+def _scheduler(admin_ids=None, **overrides) -> OutboundScheduler:
+    config = OutboundConfig(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000,
+                            retry_base_delay=0, retry_max_delay=0, flood_cluster=2)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return OutboundScheduler(config, admin_ids)
+
+
+def _recorder():
+    """
+    make_request, запоминающий чаты в порядке отправки
+    """
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.chat_id)
+        return True
+
+    return make_request, sent
+
+
+def _failing(errors):
+    """
+    make_request, выбрасывающий ошибки из списка по очереди, затем успешный
+    """
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        if errors:
+            raise errors.pop(0)
+        return True
+
+    return make_request, calls
+
+
+async def test_higher_priority_is_served_first():
+    scheduler = _scheduler(global_rate=50, global_burst=1)
+    make_request, sent = _recorder()
+
+    async def send(chat_id, priority):
+        with send_priority(priority):
+            await scheduler(make_request, None, SendMessage(chat_id=chat_id, text="hi"))
+
+    try:
+        # Первая отправка забирает единственный токен, остальные ждут в очереди
+        await send(1, PRIORITY_BULK)
+        await asyncio.gather(send(2, PRIORITY_BULK), send(3, PRIORITY_BULK), send(4, PRIORITY_TRANSACTIONAL))
+    finally:
+        await scheduler.close()
+    assert sent == [1, 4, 2, 3]
+    lanes = scheduler.stats()["lanes"]
+    assert (lanes["bulk"]["sent"], lanes["transactional"]["sent"]) == (3, 1)
+
+
+async def test_chat_limit_does_not_delay_other_chats():
+    scheduler = _scheduler(chat_rate=10, chat_burst=1)
+    make_request, sent = _recorder()
+    finished = {}
+
+    async def send(chat_id):
+        await scheduler(make_request, None, SendMessage(chat_id=chat_id, text="hi"))
+        finished.setdefault(chat_id, []).append(time.monotonic())
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(send(1), send(1), send(1), send(2))
+    finally:
+        await scheduler.close()
+    assert sorted(sent) == [1, 1, 1, 2]
+    # Третье сообщение в чат 1 ждет два интервала чата, чат 2 - нет
+    assert max(finished[1]) - started >= 0.18
+    assert finished[2][0] - started < 0.1
+
+
+async def test_group_chats_use_group_limit():
+    scheduler = _scheduler(group_rate=0.5, group_burst=2)
+    assert scheduler._chat_bucket(-100123).rate == 0.5
+    assert scheduler._chat_bucket("@channel").capacity == 2
+    assert scheduler._chat_bucket(42).rate == 1000
+
+
+async def test_admin_messages_are_transactional():
+    scheduler = _scheduler(admin_ids=[7])
+    make_request, _ = _recorder()
+    try:
+        with send_priority(PRIORITY_BULK):
+            await scheduler(make_request, None, SendMessage(chat_id=7, text="new payment"))
+            await scheduler(make_request, None, SendMessage(chat_id=8, text="campaign"))
+    finally:
+        await scheduler.close()
+    lanes = scheduler.stats()["lanes"]
+    assert (lanes["transactional"]["sent"], lanes["bulk"]["sent"], lanes["interactive"]["sent"]) == (1, 1, 0)
+
+
+async def test_unlimited_requests_bypass_scheduler():
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        return True
+
+    for scheduler, method in ((_scheduler(), GetMe()),
+                              (_scheduler(enabled=False), SendMessage(chat_id=1, text="hi"))):
+        assert await scheduler(make_request, None, method)
+        assert scheduler._dispatcher is None
+        assert sum(lane["sent"] for lane in scheduler.stats()["lanes"].values()) == 0
+    assert len(calls) == 2
+
+
+async def test_with_priority_sets_context():
+    @with_priority(PRIORITY_BULK)
+    async def job():
+        return outbound_priority.get()
+
+    assert await job() == PRIORITY_BULK
+    assert outbound_priority.get() != PRIORITY_BULK
+
+
+async def test_retry_after_is_retried():
+    scheduler = _scheduler()
+    method = SendMessage(chat_id=1, text="hi")
+    make_request, calls = _failing([TelegramRetryAfter(method=method, message="flood", retry_after=0)])
+    try:
+        assert await scheduler(make_request, None, method)
+    finally:
+        await scheduler.close()
+    assert len(calls) == 2
+    stats = scheduler.stats()
+    assert (stats["retry_after"], stats["backoffs"]) == (1, 0)
+    # Повтор не считается второй отправкой
+    assert stats["lanes"]["interactive"]["sent"] == 1
+
+
+async def test_send_is_not_retried_after_network_error():
+    scheduler = _scheduler()
+    method = SendMessage(chat_id=1, text="hi")
+    make_request, calls = _failing([TelegramNetworkError(method=method, message="timeout")])
+    try:
+        with pytest.raises(TelegramNetworkError):
+            await scheduler(make_request, None, method)
+    finally:
+        await scheduler.close()
+    # Сообщение могло дойти до Telegram - повтор отправил бы его дважды
+    assert len(calls) == 1
+    assert scheduler.stats()["network_retries"] == 0
+
+
+async def test_idempotent_request_is_retried_up_to_limit():
+    scheduler = _scheduler(max_retries=2)
+    method = GetMe()
+    make_request, calls = _failing([TelegramNetworkError(method=method, message="timeout")] * 3)
+    try:
+        with pytest.raises(TelegramNetworkError):
+            await scheduler(make_request, None, method)
+    finally:
+        await scheduler.close()
+    assert len(calls) == 3
+    assert scheduler.stats()["network_retries"] == 2
+
+
+async def test_retry_after_cluster_lowers_rate_once():
+    scheduler = _scheduler()
+    try:
+        for chat_id in (1, 2, 3, 4):
+            method = SendMessage(chat_id=chat_id, text="hi")
+            make_request, _ = _failing([TelegramRetryAfter(method=method, message="flood", retry_after=0)])
+            assert await scheduler(make_request, None, method)
+    finally:
+        await scheduler.close()
+    # Вторая серия пришла в окне после снижения и скорость повторно не снижает
+    stats = scheduler.stats()
+    assert (stats["retry_after"], stats["backoffs"], stats["rate"]) == (4, 1, 500)
+    assert scheduler._global.capacity == 500
+
+
+async def test_retry_after_on_unlimited_method_does_not_pause_sends():
+    scheduler = _scheduler()
+    method = GetMe()
+    make_request, _ = _failing([TelegramRetryAfter(method=method, message="flood", retry_after=0)] * 3)
+    try:
+        assert await scheduler(make_request, None, method)
+    finally:
+        await scheduler.close()
+    assert scheduler._paused_until == 0
+    stats = scheduler.stats()
+    assert (stats["retry_after"], stats["backoffs"], stats["rate"]) == (3, 0, 1000)
+
+
+async def test_rate_recovers_after_backoff():
+    scheduler = _scheduler(rate_increase=100)
+    scheduler._set_rate(500)
+    # Снижение было больше секунды назад
+    scheduler._rate_changed -= 1.5
+    make_request, _ = _recorder()
+    try:
+        await scheduler(make_request, None, SendMessage(chat_id=1, text="hi"))
+        # Не чаще раза в секунду
+        assert scheduler.stats()["rate"] == 600
+        await scheduler(make_request, None, SendMessage(chat_id=1, text="hi"))
+        assert scheduler.stats()["rate"] == 600
+    finally:
+        await scheduler.close()
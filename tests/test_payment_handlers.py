@@ -0,0 +1,38 @@
+"""
+Тесты обработчиков оплаты звездами: подтверждение оплаты отправляется вне очереди рассылок
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from handlers.club import successful_payment_handler
+from handlers.events import successful_payment_handler_event
+from outbound import PRIORITY_TRANSACTIONAL, outbound_priority
+
+CONFIG = SimpleNamespace(payment=SimpleNamespace(club_price=1000), bot=SimpleNamespace(admin_ids=[]))
+
+
+class FakeMessage:
+    """Сообщение об успешной оплате, запоминающее приоритет ответов"""
+
+    def __init__(self, payment_id: int):
+        self.successful_payment = SimpleNamespace(invoice_payload=f"payment_{payment_id}")
+        self.priorities = []
+
+    async def answer(self, text, **kwargs):
+        self.priorities.append(outbound_priority.get())
+
+
+@pytest.mark.parametrize("handler, product_type", [
+    (successful_payment_handler, "club"),
+    (successful_payment_handler, "vietnam"),
+    (successful_payment_handler_event, "vietnam"),
+])
+async def test_payment_confirmation_is_transactional(repo, handler, product_type):
+    await repo.add_user(1, "buyer")
+    payment_id = await repo.create_payment(1, 1000, product_type, "stars")
+    message = FakeMessage(payment_id)
+
+    await handler(message, repo, CONFIG)
+    assert message.priorities == [PRIORITY_TRANSACTIONAL]
+    assert (await repo.get_payment(payment_id))['status'] == "confirmed"
@@ -0,0 +1,152 @@
+"""
+Тесты платежей и привязки TxID
+"""
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from database import Database, normalize_tx_id, now_ts
+
+
+def test_normalize_tx_id():
+    assert normalize_tx_id(" 0xABCdef\n") == "0xabcdef"
+    assert normalize_tx_id("DEADBEEF") == "deadbeef"
+    # Не шестнадцатеричные TxID (например, с буквами вне a-f) не меняют регистр
+    assert normalize_tx_id("ABxCD") == "ABxCD"
+    assert normalize_tx_id("Sig-Solana") == "Sig-Solana"
+
+
+async def test_attach_tx_id(repo):
+    await repo.add_user(1, "buyer")
+    first = await repo.create_payment(1, 1000, "club", "crypto_ETH")
+    second = await repo.create_payment(1, 1000, "club", "crypto_ETH")
+
+    result = await repo.attach_tx_id(first, "0xABC123", "ETH")
+    assert result == {"attached": True, "tx_id": "0xabc123", "duplicate_payment_id": None}
+    # Повторная привязка того же TxID к тому же платежу допустима
+    assert (await repo.attach_tx_id(first, "0xabc123"))["attached"]
+
+    result = await repo.attach_tx_id(second, " 0XABC123 ")
+    assert result == {"attached": False, "tx_id": "0xabc123", "duplicate_payment_id": first}
+
+    # Платежа нет - не повтор
+    result = await repo.attach_tx_id(999, "0xfff")
+    assert result == {"attached": False, "tx_id": "0xfff", "duplicate_payment_id": None}
+
+    payment = await repo.get_payment(first)
+    assert payment['tx_id'] == "0xabc123"
+    assert payment['currency'] == "ETH"
+    assert payment['payment_method'] == "crypto_ETH"
+
+
+async def test_tx_id_of_archived_payment_is_a_duplicate(db):
+    await db.add_user(1, "buyer")
+    old = await db.create_payment(1, 1000, "club", "crypto_ETH")
+    await db.attach_tx_id(old, "0xabc123", "ETH")
+    await db.confirm_payment(old)
+
+    async def backdate(conn):
+        await conn.execute("UPDATE payments SET created_ts = ? WHERE payment_id = ?", (now_ts() - 100 * 86400, old))
+
+    await db._submit(backdate)
+    assert await db.archive_payments(confirmed_days=90, pending_days=30) == 1
+    archived = (await db.get_user_payments(1, include_archive=True))[0]
+    assert (archived['tx_id'], archived['currency']) == ("0xabc123", "ETH")
+
+    new = await db.create_payment(1, 1000, "club", "crypto_ETH")
+    result = await db.attach_tx_id(new, "0xABC123", "ETH")
+    assert result == {"attached": False, "tx_id": "0xabc123", "duplicate_payment_id": old}
+    assert (await db.get_payment(new))['tx_id'] is None
+
+
+async def test_tx_ids_are_moved_out_of_payment_method(db_config, migrate_up_to):
+    await migrate_up_to(8)
+    methods = ["crypto_ETH_TxID:0xABCDEF01", "crypto_ETH_TxID:0xabcdef01", "crypto_USDT_TxID:Sig-Solana", "card"]
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany(
+            "INSERT INTO payments (payment_id, user_id, amount, product_type, payment_method) VALUES (?, 1, 1000, 'club', ?)",
+            list(enumerate(methods, start=1))
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        payments = [await db.get_payment(payment_id) for payment_id in range(1, 5)]
+        assert [(p['payment_method'], p['tx_id'], p['currency']) for p in payments] == [
+            ("crypto_ETH", "0xabcdef01", "ETH"),
+            # Повтор остается в способе оплаты для ручной проверки
+            ("crypto_ETH_TxID:0xabcdef01", None, "ETH"),
+            ("crypto_USDT", "Sig-Solana", "USDT"),
+            ("card", None, None),
+        ]
+    finally:
+        await db.close()
+
+    # Уникальный индекс не допускает двух платежей с одним TxID
+    with sqlite3.connect(db_config.db_path) as conn:
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("UPDATE payments SET tx_id = '0xabcdef01' WHERE payment_id = 3")
+
+
+async def test_unique_index_conflict_reports_owner(db):
+    await db.add_user(1, "buyer")
+    first = await db.create_payment(1, 1000, "club", "crypto_ETH")
+    second = await db.create_payment(1, 1000, "club", "crypto_ETH")
+    await db.attach_tx_id(first, "0xabc123", "ETH")
+
+    # TxID привязан к другому платежу уже после проверки: повтор ловит уникальный индекс
+    writer = db._writer
+    execute = writer.execute
+
+    async def skip_check(sql, *args, **kwargs):
+        if "UNION ALL" in sql:
+            return await execute("SELECT NULL WHERE 0")
+        return await execute(sql, *args, **kwargs)
+
+    writer.execute = skip_check
+    try:
+        result = await db.attach_tx_id(second, "0xABC123", "ETH")
+    finally:
+        writer.execute = execute
+    assert result == {"attached": False, "tx_id": "0xabc123", "duplicate_payment_id": first}
+
+
+async def test_tx_id_backfill_matches_normalize_tx_id(db_config, migrate_up_to):
+    raw_tx_ids = [
+        " 0xABCDEF01\n",
+        "\t0xabcdef01 ",  # Повтор первого после нормализации
+        "ABxCD",  # Не шестнадцатеричный: регистр сохраняется
+        "DeadBeef ",
+    ]
+    await migrate_up_to(8)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany(
+            "INSERT INTO payments (payment_id, user_id, amount, product_type, payment_method) VALUES (?, 1, 1000, 'club', ?)",
+            [(payment_id, f"crypto_ETH_TxID:{raw}") for payment_id, raw in enumerate(raw_tx_ids, start=1)]
+        )
+        await conn.execute(
+            "INSERT INTO payments_archive "
+            "(payment_id, user_id, amount, product_type, payment_method, status, archived_ts) "
+            "VALUES (5, 1, 1000, 'club', 'crypto_BTC_TxID: 0xFEED\n', 'confirmed', 1)"
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        payments = [await db.get_payment(payment_id) for payment_id in range(1, 5)]
+        assert [p['tx_id'] for p in payments] == [normalize_tx_id(raw_tx_ids[0]), None, "ABxCD", "deadbeef"]
+        assert payments[0]['tx_id'] == "0xabcdef01"
+        assert payments[1]['payment_method'] == f"crypto_ETH_TxID:{raw_tx_ids[1]}"
+        archived = (await db.get_user_payments(1, include_archive=True))[-1]
+        assert (archived['payment_id'], archived['tx_id'], archived['payment_method']) == (5, "0xfeed", "crypto_BTC")
+
+        # Новый ввод нормализуется так же и распознается как повтор
+        result = await db.attach_tx_id(4, "0XABCDEF01")
+        assert result == {"attached": False, "tx_id": "0xabcdef01", "duplicate_payment_id": 1}
+        assert (await db.attach_tx_id(2, " ABxCD "))["duplicate_payment_id"] == 3
+        assert (await db.attach_tx_id(2, "0xFEED"))["duplicate_payment_id"] == 5
+    finally:
+        await db.close()
@@ -0,0 +1,50 @@
+"""
+Тесты компактных записей строк базы данных
+"""
+import sqlite3
+
+import pytest
+
+from records import Payment, Subscription, User
+
+
+def _row(**values) -> sqlite3.Row:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    columns = ", ".join(f"? AS {name}" for name in values)
+    return conn.execute(f"SELECT {columns}", tuple(values.values())).fetchone()
+
+
+def test_record_from_row_behaves_like_dict():
+    user = User.from_row(_row(user_id=1, username="member", balance=100, extra="skipped"))
+    assert user['user_id'] == 1 and user.username == "member"
+    assert user['first_name'] is None
+    assert user.get('extra', "default") == "default"
+    assert 'balance' in user and 'extra' not in user
+    assert dict(user)['balance'] == 100
+    assert user.to_dict() == dict(user)
+    with pytest.raises(KeyError):
+        user['extra']
+    # Записи не хранят __dict__
+    with pytest.raises(AttributeError):
+        user.extra = 1
+
+
+def test_record_equality_and_keyword_init():
+    assert User(user_id=1, username="a") == User.from_row(_row(user_id=1, username="a"))
+    assert User(user_id=1) != User(user_id=2)
+    assert User(user_id=1) != Payment(user_id=1)
+    assert "user_id=1" in repr(User(user_id=1))
+
+
+async def test_database_returns_records(repo):
+    await repo.add_user(1, "member")
+    await repo.add_subscription(1, 30)
+    payment_id = await repo.create_payment(1, 1000, "club", "card")
+
+    assert isinstance(await repo.get_user(1), User)
+    assert isinstance(await repo.check_subscription(1), Subscription)
+    assert isinstance(await repo.get_payment(payment_id), Payment)
+    assert all(isinstance(user, User) for user in (await repo.get_users_bulk([1])).values())
+    assert [type(user) async for user in repo.iter_users()] == [User]
+    assert (await repo.get_user(1))['referral_count'] == 0
@@ -0,0 +1,110 @@
+"""
+Тесты начисления за приглашение (db.apply_referral)
+"""
+import aiosqlite
+import pytest
+
+from database import Database, now_ts
+
+
+async def test_missing_referrer_changes_nothing(repo):
+    await repo.add_user(2, "invitee")
+    assert await repo.apply_referral(2, 1, 100, 7) is None
+    assert await repo.get_user_referrer(2) is None
+    assert await repo.check_subscription(2) is None
+
+
+async def test_first_referral_is_awarded_once(repo):
+    await repo.add_user(1, "referrer")
+    await repo.update_user_balance(1, 50)
+    await repo.add_user(2, "invitee")
+
+    referral = await repo.apply_referral(2, 1, 100, 7)
+    assert referral['referral_id'] > 0
+    assert (referral['balance'], referral['referrals_count']) == (150, 1)
+    assert (await repo.get_user_referrer(2))['user_id'] == 1
+    subscription = await repo.check_subscription(2)
+    assert subscription['end_ts'] >= now_ts() + 7 * 86400 - 5
+
+    # Повторный /start с той же ссылкой ничего не начисляет
+    assert await repo.apply_referral(2, 1, 100, 7) is None
+    assert (await repo.get_user(1))['balance'] == 150
+    assert await repo.count_user_referrals(1) == 1
+    assert (await repo.check_subscription(2))['end_ts'] == subscription['end_ts']
+
+
+async def test_free_days_extend_active_subscription(repo):
+    await repo.add_user(1, "referrer")
+    await repo.add_user(2, "invitee")
+    await repo.add_user(3, "second")
+    subscription_id = await repo.add_subscription(2, 30)
+    end_ts = (await repo.check_subscription(2))['end_ts']
+
+    await repo.apply_referral(2, 1, 100, 7)
+    subscription = await repo.check_subscription(2)
+    assert subscription['subscription_id'] == subscription_id
+    assert subscription['end_ts'] == end_ts + 7 * 86400
+    assert (await repo.apply_referral(3, 1, 100, 7))['referrals_count'] == 2
+
+
+async def test_failed_award_is_rolled_back(db, monkeypatch):
+    await db.add_user(1, "referrer")
+    await db.add_user(2, "invitee")
+
+    async def failing_extend(conn, user_id, days):
+        raise RuntimeError("сбой продления подписки")
+
+    monkeypatch.setattr(db, "_extend_subscription", failing_extend)
+    with pytest.raises(RuntimeError):
+        await db.apply_referral(2, 1, 100, 7)
+
+    assert await db.get_user_referrer(2) is None
+    assert (await db.get_user(1))['balance'] == 0
+    assert await db.count_user_referrals(1) == 0
+
+
+async def test_referral_count_follows_referral_changes(db):
+    for user_id in range(1, 6):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.add_referral(3, 1)
+    await db.add_referral(4, 1)
+    await db.add_referral(5, 2)
+    assert [await db.count_user_referrals(user_id) for user_id in (1, 2)] == [2, 1]
+
+    async def change(conn):
+        await conn.execute("UPDATE referrals SET is_active = 0 WHERE user_id = 3")
+        await conn.execute("UPDATE referrals SET referrer_id = 2 WHERE user_id = 4")
+        await conn.execute("DELETE FROM referrals WHERE user_id = 5")
+
+    await db._submit(change)
+    db._user_cache.clear()
+    assert [await db.count_user_referrals(user_id) for user_id in (1, 2)] == [0, 1]
+
+    # Повторная активация снова учитывается
+    async def reactivate(conn):
+        await conn.execute("UPDATE referrals SET is_active = 1 WHERE user_id = 3")
+
+    await db._submit(reactivate)
+    db._user_cache.clear()
+    assert await db.count_user_referrals(1) == 1
+
+
+async def test_referral_count_is_backfilled(db_config, migrate_up_to):
+    await migrate_up_to(5)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany("INSERT INTO users (user_id) VALUES (?)", [(i,) for i in range(1, 6)])
+        await conn.executemany(
+            "INSERT INTO referrals (user_id, referrer_id, is_active) VALUES (?, ?, ?)",
+            [(3, 1, 1), (4, 1, 1), (5, 1, 0), (2, 5, 1)]
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        assert [await db.count_user_referrals(user_id) for user_id in range(1, 6)] == [2, 0, 0, 0, 1]
+        # После заполнения счетчик поддерживают триггеры
+        await db.add_user(6, "user6")
+        assert (await db.apply_referral(6, 1, 100, 7))['referrals_count'] == 3
+    finally:
+        await db.close()
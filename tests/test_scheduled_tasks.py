@@ -0,0 +1,89 @@
+"""
+Тесты задач планировщика: обработка истекших подписок
+"""
+from config import load_config
+from delivery import Delivery
+from scheduled_tasks import ScheduledTasks
+
+
+class FakeBot:
+    """Бот, запоминающий исключения из группы и отправленные сообщения"""
+
+    def __init__(self):
+        self.kicked = []
+        self.sent = []
+        self.events = []
+
+    async def ban_chat_member(self, chat_id, user_id, until_date=None):
+        self.kicked.append(user_id)
+        self.events.append("kick")
+        return True
+
+    async def __call__(self, method):
+        self.sent.append(method.chat_id)
+        self.events.append("send")
+        return True
+
+
+def _tasks(bot, repo) -> ScheduledTasks:
+    return ScheduledTasks(bot, repo, load_config(), Delivery(bot, repo))
+
+
+async def test_expired_subscriptions_are_deactivated(repo, shift_time):
+    for user_id in (1, 2, 3):
+        await repo.add_user(user_id, f"user{user_id}")
+    await repo.add_subscription(1, 1)
+    await repo.add_subscription(2, 1)
+    await repo.add_subscription(3, 30)
+    await repo.load_subscription_index()
+    bot = FakeBot()
+
+    with shift_time(2 * 86400):
+        await _tasks(bot, repo)._check_expired_subscriptions()
+        assert [await repo.check_subscription(user_id) is None for user_id in (1, 2, 3)] == [True, True, False]
+    assert sorted(bot.kicked) == sorted(bot.sent) == [1, 2]
+
+    # Повторный запуск: истекших подписок больше нет
+    with shift_time(2 * 86400):
+        await _tasks(bot, repo)._check_expired_subscriptions()
+    assert len(bot.kicked) == 2
+
+
+async def test_subscription_renewed_during_check_is_kept(repo, shift_time, monkeypatch):
+    for user_id in (1, 2):
+        await repo.add_user(user_id, f"user{user_id}")
+        await repo.add_subscription(user_id, 1)
+    await repo.load_subscription_index()
+    bot = FakeBot()
+
+    deactivate = repo.deactivate_subscription
+
+    async def renew_then_deactivate(subscription_id):
+        # Пользователь 2 продлил подписку после выборки истекших
+        if subscription_id == (await repo.get_user_subscriptions(2))[0]['subscription_id']:
+            await repo.add_subscription(2, 30)
+        return await deactivate(subscription_id)
+
+    monkeypatch.setattr(repo, "deactivate_subscription", renew_then_deactivate)
+    with shift_time(2 * 86400):
+        await _tasks(bot, repo)._check_expired_subscriptions()
+        assert await repo.check_subscription(1) is None
+        assert await repo.check_subscription(2) is not None
+    # Продливший подписку пользователь остается в группе и не получает уведомления об окончании
+    assert bot.kicked == bot.sent == [1]
+
+
+async def test_expired_batch_is_deactivated_before_notices(repo, shift_time):
+    for user_id in range(1, 6):
+        await repo.add_user(user_id, f"user{user_id}")
+        await repo.add_subscription(user_id, 1)
+    await repo.load_subscription_index()
+    await repo.set_user_reachable(4, False)
+    bot = FakeBot()
+
+    with shift_time(2 * 86400):
+        await _tasks(bot, repo)._check_expired_subscriptions()
+    # Уведомления ждут в очереди рассылок только после того, как вся выборка деактивирована
+    assert bot.events == ["kick"] * 5 + ["send"] * 4
+    # Заблокировавший бота исключен из группы, но уведомление ему не отправляется
+    assert sorted(bot.sent) == [1, 2, 3, 5]
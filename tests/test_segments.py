@@ -0,0 +1,105 @@
+"""
+Тесты сегментов аудитории: SQL-условие и проверка в памяти должны отбирать одних и тех же пользователей
+"""
+from dataclasses import replace
+
+import pytest
+
+from database import now_ts
+from repository import create_database
+from segments import Segment, SEGMENT_PRESETS
+
+
+async def _populate(db, shift_time):
+    """
+    Пользователи 1-40: подписки, платежи и рефералы в разных сочетаниях
+    """
+    for user_id in range(1, 41):
+        await db.add_user(user_id, f"user{user_id}")
+    for user_id in range(1, 11):
+        await db.add_subscription(user_id, 30)
+    for user_id in range(11, 16):
+        await db.add_subscription(user_id, 2)
+    for user_id in range(16, 21):
+        subscription_id = await db.add_subscription(user_id, 5)
+        with shift_time(6 * 86400):
+            await db.deactivate_subscription(subscription_id)
+    await db.archive_subscriptions()
+    for user_id, product in ((1, "club"), (2, "club"), (30, "club"), (31, "vietnam")):
+        await db.confirm_payment(await db.create_payment(user_id, 1000, product, "card"))
+    await db.create_payment(32, 1000, "club", "card")
+    await db.add_referral(35, 3)
+    await db.add_referral(36, 3)
+    await db.add_referral(37, 4)
+    await db.set_user_reachable(40, False)
+    await db.load_subscription_index()
+
+
+SEGMENTS = {
+    "all": (Segment(), list(range(1, 40))),
+    "active": (Segment().active(), list(range(1, 16))),
+    "inactive": (Segment().inactive(), list(range(16, 40))),
+    "expiring_3": (Segment().expiring_within(3), list(range(11, 16))),
+    "expired": (Segment().expired(), list(range(16, 21))),
+    "expired_never_paid": (Segment().expired().without_payments(), list(range(16, 21))),
+    "never_paid": (Segment().without_payments(), [n for n in range(3, 40) if n not in (30, 31)]),
+    "paid_vietnam": (Segment().paid_for("vietnam"), [31]),
+    "active_paid_club": (Segment().active().paid_for("club"), [1, 2]),
+    "one_referral": (Segment().referrals(1, 1), [4]),
+    "referrers": (Segment().referrals(min_count=1), [3, 4]),
+    "any_referral": (Segment().with_any_referral(), [3, 4]),
+    "registered_recently": (Segment().registered_after(now_ts() - 3600), list(range(1, 40))),
+    "registered_long_ago": (Segment().registered_before(now_ts() - 3600), []),
+    "with_unreachable": (Segment().with_unreachable(), list(range(1, 41))),
+}
+
+
+@pytest.mark.parametrize("name", sorted(SEGMENTS))
+async def test_segment_selects_expected_users(repo, shift_time, name):
+    segment, expected = SEGMENTS[name]
+    await _populate(repo, shift_time)
+    assert await repo.count_users(segment) == len(expected)
+    assert [user['user_id'] async for user in repo.iter_users(segment, batch_size=4)] == expected
+
+
+async def test_presets_match_between_backends(db_config, tmp_path, shift_time):
+    results = []
+    for backend in ("sqlite", "memory"):
+        db = create_database(replace(db_config, backend=backend, db_path=str(tmp_path / f"{backend}.db")))
+        await db.connect()
+        await db.migrate()
+        try:
+            await _populate(db, shift_time)
+            results.append({
+                key: [user['user_id'] async for user in db.iter_users(segment)]
+                for key, (_, segment) in SEGMENT_PRESETS.items()
+            })
+        finally:
+            await db.close()
+    assert results[0] == results[1]
+    # Заблокировавший бота пользователь не входит ни в один готовый сегмент
+    assert all(40 not in users for users in results[0].values())
+
+
+def test_segment_json_round_trip():
+    segment = Segment().expired().without_payments().with_any_referral().registered_after(1_700_000_000)
+    assert Segment.from_json(segment.to_json()) == segment
+    assert Segment.from_json(None) == Segment()
+    assert Segment.from_json('{"unknown": 1, "min_referrals": 2}') == Segment(min_referrals=2)
+    assert Segment().is_empty and not Segment().active().is_empty
+    assert not Segment().with_unreachable().is_empty
+    assert Segment.from_json(Segment().with_unreachable().to_json()) == Segment().with_unreachable()
+
+
+
+async def test_any_referral_includes_inactive_referrals(db):
+    for user_id in (1, 2, 3):
+        await db.add_user(user_id, f"user{user_id}")
+    await db.add_referral(2, 1)
+
+    async def deactivate(conn):
+        await conn.execute("UPDATE referrals SET is_active = 0 WHERE referrer_id = 1")
+
+    await db._submit(deactivate)
+    assert await db.count_users(Segment().referrals(min_count=1)) == 0
+    assert [user['user_id'] async for user in db.iter_users(Segment().with_any_referral())] == [1]
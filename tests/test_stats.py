@@ -0,0 +1,97 @@
+"""
+Тесты агрегированной статистики
+"""
+import datetime
+
+import aiosqlite
+
+import database
+import memory_database
+from database import Database, now_ts
+
+
+async def test_stats_totals(repo):
+    for user_id in range(1, 5):
+        await repo.add_user(user_id, f"user{user_id}")
+    await repo.add_referral(2, 1)
+    await repo.add_subscription(1, 30)
+
+    payment_id = await repo.create_payment(1, 1000, "club", "card")
+    await repo.confirm_payment(payment_id)
+    # Повторное подтверждение не учитывается дважды
+    await repo.confirm_payment(payment_id)
+    await repo.create_payment(3, 500, "vietnam", "card")
+
+    stats = await repo.get_stats()
+    assert stats["users"] == 4
+    assert stats["referrals"] == 1
+    assert stats["payments"] == 2
+    assert stats["payments_confirmed"] == 1
+    assert stats["revenue"] == 1000
+    assert stats["recent_payments"] == 2
+    assert stats["recent_revenue"] == 1000
+    assert stats["active_subscriptions"] == 1
+
+    today = await repo.get_daily_stats(datetime.date.today())
+    assert (today["new_users"], today["new_referrals"], today["payments_created"]) == (4, 1, 2)
+    assert (today["payments_confirmed"], today["revenue"]) == (1, 1000)
+    assert (await repo.get_daily_stats(datetime.date(2000, 1, 1)))["new_users"] == 0
+
+
+async def test_deactivated_subscription_leaves_active_count(repo, shift_time):
+    await repo.add_user(1, "member")
+    subscription_id = await repo.add_subscription(1, 30)
+    # Продление не создает новой активной подписки
+    await repo.add_subscription(1, 30)
+    assert (await repo.get_stats())["active_subscriptions"] == 1
+
+    with shift_time(61 * 86400):
+        await repo.deactivate_subscription(subscription_id)
+    assert (await repo.get_stats())["active_subscriptions"] == 0
+
+
+async def test_expired_subscription_is_not_counted_before_deactivation(repo, monkeypatch):
+    for user_id in (1, 2):
+        await repo.add_user(user_id, f"user{user_id}")
+    await repo.add_subscription(1, 30)
+
+    # Подписка, истекшая позавчера, но еще не деактивированная проверкой
+    past = now_ts() - 3 * 86400
+    with monkeypatch.context() as patch:
+        patch.setattr(database, "now_ts", lambda: past)
+        patch.setattr(memory_database, "now_ts", lambda: past)
+        expired_id = await repo.add_subscription(2, 1)
+
+    # Истекшая подписка не считается активной, как и до агрегированных таблиц
+    assert (await repo.get_stats())["active_subscriptions"] == 1
+    await repo.deactivate_subscription(expired_id)
+    assert (await repo.get_stats())["active_subscriptions"] == 1
+
+
+async def test_stats_are_backfilled(db_config, migrate_up_to):
+    await migrate_up_to(6)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany(
+            "INSERT INTO users (user_id, registration_date) VALUES (?, '2024-03-10 10:00:00')", [(1,), (2,)]
+        )
+        await conn.execute(
+            "INSERT INTO payments (user_id, amount, status, created_ts, confirmed_ts) VALUES (1, 700, 'confirmed', ?, ?)",
+            (int(datetime.datetime(2024, 3, 10, 12).timestamp()),) * 2
+        )
+        await conn.executemany(
+            "INSERT INTO subscriptions (user_id, status, end_ts) VALUES (?, 'active', ?)",
+            [(1, 4_000_000_000), (2, None)]
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        stats = await db.get_stats()
+        assert (stats["users"], stats["payments_confirmed"], stats["revenue"]) == (2, 1, 700)
+        # Подписка без даты окончания активной не считается
+        assert stats["active_subscriptions"] == 1
+        day = await db.get_daily_stats(datetime.date(2024, 3, 10))
+        assert (day["payments_created"], day["revenue"]) == (1, 700)
+    finally:
+        await db.close()
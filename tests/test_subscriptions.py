@@ -0,0 +1,237 @@
+"""
+Тесты подписок: метки времени Unix, выборки по диапазону end_ts и индекс активных подписок
+"""
+import datetime
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from database import Database, day_bounds_ts, now_ts
+from subscription_index import SubscriptionIndex
+
+
+async def _set_end_ts(db, subscription_id: int, end_ts: int):
+    async def operation(conn):
+        await conn.execute("UPDATE subscriptions SET end_ts = ? WHERE subscription_id = ?", (end_ts, subscription_id))
+
+    await db._submit(operation)
+
+
+async def test_add_subscription_stores_epoch_end(repo):
+    await repo.add_user(1, "member")
+    before = now_ts()
+    subscription_id = await repo.add_subscription(1, 30)
+
+    subscription = await repo.check_subscription(1)
+    assert subscription['subscription_id'] == subscription_id
+    assert before + 30 * 86400 <= subscription['end_ts'] <= now_ts() + 30 * 86400
+    assert subscription['start_ts'] >= before
+
+    # Продление отсчитывается от текущей даты окончания
+    end_ts = subscription['end_ts']
+    assert await repo.add_subscription(1, 10) == subscription_id
+    assert (await repo.check_subscription(1))['end_ts'] == end_ts + 10 * 86400
+
+
+async def test_expired_subscription_is_not_active(db):
+    await db.add_user(1, "member")
+    subscription_id = await db.add_subscription(1, 30)
+    await _set_end_ts(db, subscription_id, now_ts() - 60)
+
+    assert await db.check_subscription(1) is None
+    assert [s['subscription_id'] for s in await db.get_expired_subscriptions()] == [subscription_id]
+
+    # Продление истекшей подписки отсчитывается от текущего момента
+    await db.add_subscription(1, 1)
+    assert (await db.check_subscription(1))['end_ts'] >= now_ts() + 86400 - 5
+
+
+async def test_expiring_subscriptions_select_local_day(db):
+    target_start, target_end = day_bounds_ts(datetime.date.today() + datetime.timedelta(days=3))
+    ends = {1: target_start, 2: target_end - 1, 3: target_end, 4: target_start - 1}
+    for user_id, end_ts in ends.items():
+        await db.add_user(user_id, f"user{user_id}")
+        await _set_end_ts(db, await db.add_subscription(user_id, 5), end_ts)
+
+    expiring = await db.get_expiring_subscriptions(days=3)
+    assert sorted(s['user_id'] for s in expiring) == [1, 2]
+
+
+async def test_subscription_lookups_use_end_ts_indexes(db):
+    async with db._read() as conn:
+        cursor = await conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM subscriptions WHERE user_id = ? AND status = 'active' AND end_ts > ?",
+            (1, now_ts())
+        )
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+        assert "idx_subscriptions_user_status_end_ts" in plan
+
+        cursor = await conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM subscriptions WHERE status = 'active' AND end_ts >= ? AND end_ts < ?",
+            (0, now_ts())
+        )
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+        assert "idx_subscriptions_status_end_ts" in plan
+
+
+async def test_text_dates_are_backfilled(db_config, migrate_up_to):
+    await migrate_up_to(3)
+    local_end = datetime.datetime(2030, 1, 15, 12, 30)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.execute(
+            "INSERT INTO subscriptions (subscription_id, user_id, start_date, end_date) VALUES (1, 1, '2029-12-16 09:30:00', ?)",
+            (local_end.isoformat(),)
+        )
+        await conn.execute(
+            "INSERT INTO payments (payment_id, user_id, amount, created_at, confirmed_at, status) "
+            "VALUES (1, 1, 1000, '2029-12-16 09:00:00', ?, 'confirmed')",
+            (local_end.isoformat(),)
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        subscription = await db.check_subscription(1)
+        assert subscription['end_ts'] == int(local_end.timestamp())
+        # CURRENT_TIMESTAMP хранится в UTC
+        utc_start = datetime.datetime(2029, 12, 16, 9, 30, tzinfo=datetime.timezone.utc)
+        assert subscription['start_ts'] == int(utc_start.timestamp())
+        payment = await db.get_payment(1)
+        assert payment['confirmed_ts'] == int(local_end.timestamp())
+        assert payment['created_ts'] == int(datetime.datetime(2029, 12, 16, 9, tzinfo=datetime.timezone.utc).timestamp())
+    finally:
+        await db.close()
+
+
+def test_subscription_index_lazy_heap():
+    index = SubscriptionIndex()
+    index.load([(1, 10, 100), (1, 11, 300), (2, 20, 200)])
+    assert index.get(1, 0) == (11, 300)
+    assert index.next_expiry() == 200
+
+    # Продление оставляет в куче устаревший элемент, который пропускается при чтении
+    index.set(2, 20, 400)
+    assert index.next_expiry() == 300
+    assert index.expiring_between(0, 500) == [(300, 1, 11), (400, 2, 20)]
+    assert index.expired(350) == [(300, 1, 11)]
+    assert index.get(1, 300) is None
+
+    index.remove(1, subscription_id=99)
+    assert index.get(1, 0) == (11, 300)
+    index.remove(1, subscription_id=11)
+    assert index.get(1, 0) is None
+    assert index.diff([(2, 20, 400), (3, 30, 500)]) == {"missing": [3], "stale": [], "changed": []}
+
+
+async def test_index_follows_subscription_writes(repo, shift_time):
+    for user_id in (1, 2, 3):
+        await repo.add_user(user_id, f"user{user_id}")
+    await repo.add_subscription(1, 30)
+    assert await repo.load_subscription_index() == 1
+
+    first = await repo.add_subscription(2, 30)
+    assert await repo.add_subscription(2, 30) == first
+    subscription = await repo.check_subscription(2)
+    assert repo.subscription_index.get(2, now_ts()) == (first, subscription['end_ts'])
+    assert await repo.get_subscription_end_ts(2) == subscription['end_ts']
+
+    referral = await repo.apply_referral(3, 1, 100, 7)
+    assert await repo.get_subscription_end_ts(3) == referral['end_ts']
+
+    with shift_time(61 * 86400):
+        assert await repo.deactivate_subscription(first)
+    assert await repo.get_subscription_end_ts(2) is None
+    assert await repo.check_subscription(2) is None
+    assert not any((await repo.verify_subscription_index()).values())
+
+
+async def test_index_answers_without_queries(db):
+    await db.add_user(1, "member")
+    await db.load_subscription_index()
+    reads = []
+    read = db._read
+
+    def counting_read(*args, **kwargs):
+        reads.append(args)
+        return read(*args, **kwargs)
+
+    db._read = counting_read
+    # Пользователь без подписки - ответ из индекса
+    assert await db.check_subscription(1) is None
+    assert await db.get_subscription_end_ts(1) is None
+    assert reads == []
+
+
+async def test_verify_rebuilds_diverged_index(db):
+    for user_id in (1, 2):
+        await db.add_user(user_id, f"user{user_id}")
+    subscription_id = await db.add_subscription(1, 30)
+    await db.load_subscription_index()
+
+    async def change(conn):
+        await conn.execute("UPDATE subscriptions SET status = 'expired' WHERE subscription_id = ?", (subscription_id,))
+        await conn.execute("INSERT INTO subscriptions (user_id, status, end_ts) VALUES (2, 'active', ?)", (now_ts() + 3600,))
+
+    await db._submit(change)
+    assert await db.verify_subscription_index() == {"missing": [2], "stale": [1], "changed": []}
+    assert await db.get_subscription_end_ts(1) is None
+    assert await db.get_subscription_end_ts(2) is not None
+    assert not any((await db.verify_subscription_index()).values())
+
+
+async def test_duplicate_active_subscriptions_are_collapsed(db_config, migrate_up_to, shift_time):
+    await migrate_up_to(13)
+    now = now_ts()
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany(
+            "INSERT INTO subscriptions (subscription_id, user_id, status, end_ts) VALUES (?, ?, 'active', ?)",
+            [(1, 1, now + 86400), (2, 1, now + 2 * 86400), (3, 1, now + 3600), (4, 2, 4_000_000_000)]
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        await db.load_subscription_index()
+        assert (await db.check_subscription(1))['subscription_id'] == 2
+        assert (await db.check_subscription(2))['subscription_id'] == 4
+
+        # После деактивации единственной активной подписки пользователь без подписки
+        with shift_time(3 * 86400):
+            assert await db.deactivate_subscription(2)
+        assert await db.check_subscription(1) is None
+        assert (await db.get_stats())['active_subscriptions'] == 1
+    finally:
+        await db.close()
+
+    with sqlite3.connect(db_config.db_path) as conn:
+        statuses = dict(conn.execute("SELECT subscription_id, status FROM subscriptions WHERE user_id = 1"))
+        assert statuses == {1: "expired", 2: "expired", 3: "expired"}
+        # Вторую активную подписку не допускает уникальный индекс
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO subscriptions (user_id, status, end_ts) VALUES (2, 'active', 4200000000)")
+
+
+async def test_renewed_subscription_is_not_deactivated(repo, shift_time):
+    await repo.add_user(1, "member")
+    subscription_id = await repo.add_subscription(1, 1)
+    await repo.load_subscription_index()
+    # Подписка еще не истекла
+    assert not await repo.deactivate_subscription(subscription_id)
+
+    with shift_time(2 * 86400):
+        # Проверка истекших выбрала подписку, но пользователь успел ее продлить
+        assert [s['subscription_id'] for s in await repo.get_expired_subscriptions()] == [subscription_id]
+        assert await repo.add_subscription(1, 30) == subscription_id
+        assert not await repo.deactivate_subscription(subscription_id)
+        assert (await repo.check_subscription(1))['subscription_id'] == subscription_id
+        assert (await repo.get_stats())['active_subscriptions'] == 1
+
+    with shift_time(40 * 86400):
+        assert await repo.deactivate_subscription(subscription_id)
+        # Повторная деактивация ничего не меняет
+        assert not await repo.deactivate_subscription(subscription_id)
+        assert await repo.check_subscription(1) is None
+    assert (await repo.get_stats())['active_subscriptions'] == 0
@@ -0,0 +1,60 @@
+"""
+Тесты постраничного обхода пользователей (пагинация по ключу)
+"""
+from segments import Segment
+
+USER_IDS = [5, 17, 3, 42, 8, 1000000001, 64, 9]
+
+
+async def _add_users(db, user_ids=USER_IDS):
+    for user_id in user_ids:
+        await db.add_user(user_id, f"user{user_id}")
+
+
+async def test_pages_follow_user_id_order(repo):
+    await _add_users(repo)
+    pages = [page async for page in repo.iter_user_pages(batch_size=3)]
+    assert [[user['user_id'] for user in page] for page in pages] == [[3, 5, 8], [9, 17, 42], [64, 1000000001]]
+
+    users = [user['user_id'] async for user in repo.iter_users(batch_size=3)]
+    assert users == sorted(USER_IDS)
+    assert await repo.count_users() == len(USER_IDS)
+
+
+async def test_condition_is_applied_to_every_page(repo):
+    await _add_users(repo)
+    for user_id in (5, 8, 17):
+        await repo.add_referral(user_id + 100, user_id)
+
+    segment = Segment().referrals(min_count=1)
+    users = [user['user_id'] async for user in repo.iter_users(segment, batch_size=2)]
+    assert users == [5, 8, 17]
+    assert await repo.count_users(segment) == 3
+
+
+async def test_full_last_page_ends_iteration(repo):
+    await _add_users(repo, range(1, 7))
+    pages = [len(page) async for page in repo.iter_user_pages(batch_size=3)]
+    assert pages == [3, 3]
+    assert [page async for page in repo.iter_user_pages(Segment().referrals(min_count=1))] == []
+
+
+async def test_reader_is_released_between_pages(db):
+    await _add_users(db)
+    seen = []
+    async for page in db.iter_user_pages(batch_size=2):
+        # Пока обрабатывается страница, все соединения для чтения свободны
+        assert db._readers.qsize() == db.config.read_pool_size
+        seen.extend(user['user_id'] for user in page)
+        if len(seen) == 2:
+            # Пользователь, добавленный во время обхода после текущей позиции, тоже будет обработан
+            await db.add_user(2000000000, "late")
+    assert seen == sorted(USER_IDS) + [2000000000]
+
+
+async def test_page_query_uses_primary_key(db):
+    async with db._read() as conn:
+        cursor = await conn.execute("EXPLAIN QUERY PLAN SELECT * FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (0, 10))
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+    assert "PRIMARY KEY" in plan
+
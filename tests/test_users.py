@@ -0,0 +1,63 @@
+"""
+Тесты пользователей, рефералов и баланса
+"""
+import asyncio
+
+import aiosqlite
+
+from database import Database
+
+
+async def test_repeated_add_user_writes_nothing(db):
+    await db.add_user(1, "member", "Иван", None)
+    changes = db._writer.total_changes
+
+    await db.add_user(1, "member", "Иван", None)
+    assert db._writer.total_changes == changes
+
+    await db.add_user(1, "renamed", "Иван", "Петров")
+    assert db._writer.total_changes == changes + 1
+    user = await db.get_user(1)
+    assert (user['username'], user['last_name']) == ("renamed", "Петров")
+
+
+async def test_add_referral_is_idempotent(repo):
+    for user_id in (1, 2, 3):
+        await repo.add_user(user_id, f"user{user_id}")
+
+    results = await asyncio.gather(repo.add_referral(3, 1), repo.add_referral(3, 2), repo.add_referral(3, 1))
+    assert sorted(results)[:2] == [0, 0] and sorted(results)[2] > 0
+    assert (await repo.get_user_referrer(3))['user_id'] == (1 if results[0] else 2)
+    assert await repo.add_referral(3, 2) == 0
+
+
+async def test_update_user_balance_returns_new_balance(repo):
+    await repo.add_user(1, "member")
+    assert await repo.update_user_balance(1, 200) == 200
+    assert await repo.update_user_balance(1, -50) == 150
+    assert (await repo.get_user(1))['balance'] == 150
+    # Несуществующий пользователь
+    assert await repo.update_user_balance(2, 100) == 0
+
+
+async def test_duplicate_referrals_are_removed(db_config, migrate_up_to):
+    await migrate_up_to(4)
+    async with aiosqlite.connect(db_config.db_path) as conn:
+        await conn.executemany(
+            "INSERT INTO users (user_id, username) VALUES (?, ?)", [(1, "a"), (2, "b"), (3, "c")]
+        )
+        await conn.executemany(
+            "INSERT INTO referrals (referral_id, user_id, referrer_id) VALUES (?, ?, ?)",
+            [(1, 3, 1), (2, 3, 2), (3, 2, 1)]
+        )
+        await conn.commit()
+
+    db = Database(db_config.db_path, db_config)
+    try:
+        await db.migrate()
+        assert (await db.get_user_referrer(3))['user_id'] == 1
+        assert await db.count_user_referrals(1) == 2
+        assert await db.count_user_referrals(2) == 0
+        assert await db.add_referral(3, 2) == 0
+    finally:
+        await db.close()